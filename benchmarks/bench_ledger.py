@@ -0,0 +1,131 @@
+"""
+Benchmark of duplicate-checked appends to the CSV ledger (logic/data_manager.py).
+
+Writes a purchases.csv with --rows synthetic rows in a temporary directory,
+then times save_invoice() with the key index against the previous
+implementation, which re-read the whole CSV on every insert (kept below as
+the baseline). Also times the one-off index rebuild and a cold start that
+loads the sidecar index instead of the CSV, and the throughput of parallel
+writer processes with single-row and batched appends (one lock and one
+fsync per batch).
+
+Usage (from the project root):
+    python -m benchmarks.bench_ledger [--rows 100000] [--inserts 2000]
+"""
+import argparse
+import contextlib
+import csv
+import io
+import multiprocessing
+import os
+import random
+import tempfile
+import time
+
+from logic import data_manager
+from logic.data_manager import KEY_INDEX_SUFFIX, ledger_keys, save_invoice, save_invoices
+
+FIELDNAMES = ["supplier", "date", "total", "description"]
+SUPPLIERS = ["ACME Supplies Ltd", "Dublin Office Depot", "Green Energy Co", "Cafe Nero", "Tesco Ireland"]
+
+# =============================================================================
+# Baseline: duplicate check before the key index
+# =============================================================================
+
+def legacy_save(path: str, row: dict) -> bool:
+    key_new = (row["supplier"], row["date"], row["total"])
+    with open(path, "r", encoding="utf-8") as f:
+        for r in csv.DictReader(f):
+            if ((r.get("supplier") or ""), (r.get("date") or ""), (r.get("total") or "")) == key_new:
+                return False
+    with open(path, "a", newline="", encoding="utf-8") as f:
+        csv.DictWriter(f, fieldnames=FIELDNAMES).writerow(row)
+    return True
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def make_row(rng: random.Random) -> dict:
+    return {
+        "supplier": rng.choice(SUPPLIERS),
+        "date": f"{rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/{rng.randint(2015, 2025)}",
+        "total": f"{rng.uniform(1, 5000):.2f}",
+        "description": "Office supplies | delivery",
+    }
+
+def write_ledger(path: str, rows: int, rng: random.Random) -> None:
+    with open(path, "w", newline="", encoding="utf-8") as f:
+        writer = csv.DictWriter(f, fieldnames=FIELDNAMES)
+        writer.writeheader()
+        writer.writerows(make_row(rng) for _ in range(rows))
+
+def _writer(seed: int, rows: int, batch: int) -> None:
+    rng = random.Random(seed)
+    items = [make_row(rng) for _ in range(rows)]
+    for i in range(0, rows, batch):
+        save_invoices(items[i:i + batch], "purchase")
+
+def parallel_rows_per_s(processes: int, rows: int, batch: int) -> float:
+    ctx = multiprocessing.get_context("fork")
+    procs = [ctx.Process(target=_writer, args=(1000 + p, rows, batch)) for p in range(processes)]
+    start = time.perf_counter()
+    for p in procs:
+        p.start()
+    for p in procs:
+        p.join()
+    return processes * rows / (time.perf_counter() - start)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rows", type=int, default=100000)
+    parser.add_argument("--inserts", type=int, default=2000)
+    parser.add_argument("--legacy-inserts", type=int, default=20,
+                        help="the baseline reads the whole CSV per insert, so keep this small")
+    parser.add_argument("--writers", type=int, default=4, help="parallel writer processes")
+    parser.add_argument("--batch", type=int, default=100, help="rows per save_invoices() call")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    new_rows = [make_row(rng) for _ in range(max(args.inserts, args.legacy_inserts))]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, "purchases.csv")
+        write_ledger(path, args.rows, random.Random(1))
+        os.chdir(tmp)
+
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            ledger_keys("purchases.csv")
+        rebuild_s = time.perf_counter() - start
+
+        data_manager._key_cache.clear()  # new process: only the sidecar on disk
+        start = time.perf_counter()
+        ledger_keys("purchases.csv")
+        sidecar_s = time.perf_counter() - start
+
+        start = time.perf_counter()
+        saved = sum(save_invoice(row, "purchase") for row in new_rows[:args.inserts])
+        indexed_s = (time.perf_counter() - start) / args.inserts
+
+        legacy_path = os.path.join(tmp, "legacy.csv")
+        write_ledger(legacy_path, args.rows, random.Random(1))
+        start = time.perf_counter()
+        for row in new_rows[:args.legacy_inserts]:
+            legacy_save(legacy_path, row)
+        legacy_s = (time.perf_counter() - start) / args.legacy_inserts
+
+        index_kb = os.path.getsize(path + KEY_INDEX_SUFFIX) / 1024
+
+        single_rps = parallel_rows_per_s(args.writers, 200, 1)
+        batched_rps = parallel_rows_per_s(args.writers, 200 * args.batch // 10, args.batch)
+
+    print(f"Ledger: {args.rows} rows, index {index_kb:.0f} KB")
+    print(f"Index rebuild from CSV: {rebuild_s * 1000:.0f} ms   cold load from sidecar: {sidecar_s * 1000:.0f} ms")
+    print(f"Insert with duplicate check: indexed {indexed_s * 1e6:.0f} us   "
+          f"full re-read {legacy_s * 1e3:.1f} ms   ({legacy_s / indexed_s:.0f}x)   saved {saved}/{args.inserts}")
+    print(f"{args.writers} parallel writers: {single_rps:.0f} rows/s one row per lock, "
+          f"{batched_rps:.0f} rows/s in batches of {args.batch}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""
+Micro-benchmark of the per-user near-duplicate index (logic/near_duplicates.py).
+
+Fills a HammingIndex with synthetic receipt hashes and times lookups.
+Real receipt hashes are not uniform (white paper, similar layouts from the
+same shops), so most hashes are drawn as small variations of a few "shop
+layouts" to stress the crowded buckets.
+
+Usage (from the project root):
+    python -m benchmarks.bench_near_duplicates [--receipts 50000] [--queries 2000]
+"""
+import argparse
+import os
+import random
+import time
+
+import django
+
+os.environ.setdefault("DJANGO_SETTINGS_MODULE", "budsi_django.settings")
+django.setup()
+
+from logic.near_duplicates import MAX_DISTANCE, HammingIndex  # noqa: E402
+
+def _variant(base: int, rng: random.Random, flips: int) -> int:
+    for bit in rng.sample(range(64), flips):
+        base ^= 1 << bit
+    return base
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--receipts", type=int, default=50000)
+    parser.add_argument("--queries", type=int, default=2000)
+    parser.add_argument("--layouts", type=int, default=200, help="number of distinct shop layouts")
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    layouts = [rng.getrandbits(64) for _ in range(args.layouts)]
+    hashes = [_variant(rng.choice(layouts), rng, rng.randint(8, 20)) for _ in range(args.receipts)]
+
+    index = HammingIndex()
+    start = time.perf_counter()
+    for item_id, value in enumerate(hashes, 1):
+        index.add(item_id, value)
+    build_s = time.perf_counter() - start
+
+    queries = [_variant(rng.choice(hashes), rng, rng.randint(0, MAX_DISTANCE)) for _ in range(args.queries)]
+    timings = []
+    found = 0
+    for value in queries:
+        start = time.perf_counter()
+        found += bool(index.search(value))
+        timings.append(time.perf_counter() - start)
+    timings.sort()
+
+    print(f"Index: {len(index)} hashes built in {build_s:.2f}s")
+    print(f"Lookups: {len(queries)}  p50 {timings[len(timings) // 2] * 1e6:.0f} us  "
+          f"p99 {timings[int(len(timings) * 0.99)] * 1e6:.0f} us  max {timings[-1] * 1e6:.0f} us  "
+          f"(all within distance {MAX_DISTANCE} found: {found == len(queries)})")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,162 @@
+"""
+OCR benchmark: speed and field accuracy of process_invoice.
+
+Runs process_invoice over the labelled synthetic corpus from
+benchmarks/ocr_corpus.py (generated on first use) and reports, per file
+kind and overall:
+
+    pages/s, p50/p95 latency per file, peak RSS (this process and the
+    tesseract/pdftoppm children) and accuracy of supplier/date/total/vat.
+
+Compare the numbers before and after touching preprocessing or parsing;
+--json saves them so two runs can be diffed.
+
+Usage (from the project root):
+    python -m benchmarks.bench_ocr [--corpus bench_corpus] [--invoices 50]
+                                   [--kinds pdf,scan_pdf,png,jpg] [--json out.json]
+"""
+import argparse
+import contextlib
+import io
+import json
+import os
+import resource
+import shutil
+import sys
+import time
+from typing import Dict, List
+
+from benchmarks.ocr_corpus import DEFAULT_OUT, KINDS, build_corpus, load_manifest
+from logic.ocr_processor import process_invoice
+
+FIELDS = ("supplier", "date", "total", "vat")
+
+# =============================================================================
+# Scoring
+# =============================================================================
+
+def _norm(value) -> str:
+    return " ".join(str(value or "").lower().split())
+
+def field_matches(field: str, expected, found) -> bool:
+    if field in ("total", "vat"):
+        try:
+            return abs(float(expected) - float(found)) < 0.005
+        except (TypeError, ValueError):
+            return False
+    return _norm(expected) == _norm(found)
+
+def percentile(values: List[float], pct: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100.0 * len(ordered) + 0.5)) - 1))
+    return ordered[index]
+
+def _peak_rss_mb() -> Dict[str, float]:
+    # ru_maxrss is KiB on Linux, bytes on macOS.
+    unit = 1 if sys.platform == "darwin" else 1024
+    return {
+        "self": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * unit / 1e6,
+        "children": resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss * unit / 1e6,
+    }
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def run(corpus_dir: str, kinds, limit: int = 0, verbose: bool = False) -> dict:
+    rows = [r for r in load_manifest(corpus_dir) if r["kind"] in kinds]
+    if limit:
+        rows = rows[:limit]
+
+    per_kind: Dict[str, dict] = {}
+    for row in rows:
+        path = os.path.join(corpus_dir, row["file"])
+        start = time.perf_counter()
+        error = ""
+        try:
+            with contextlib.redirect_stdout(io.StringIO()):
+                result = process_invoice(path) or {}
+        except Exception as e:
+            result, error = {}, str(e)
+        elapsed = time.perf_counter() - start
+
+        stats = per_kind.setdefault(row["kind"], {"files": 0, "pages": 0, "errors": 0, "latencies": [],
+                                                  "correct": {f: 0 for f in FIELDS}})
+        stats["files"] += 1
+        stats["pages"] += row["pages"]
+        stats["errors"] += bool(error)
+        stats["latencies"].append(elapsed)
+        wrong = []
+        for field in FIELDS:
+            if field_matches(field, row[field], result.get(field)):
+                stats["correct"][field] += 1
+            else:
+                wrong.append(f"{field}={result.get(field)!r} (expected {row[field]!r})")
+        if verbose and (wrong or error):
+            print(f"  {row['file']}: {error or ', '.join(wrong)}")
+
+    return {"corpus": corpus_dir, "kinds": per_kind, "peak_rss_mb": _peak_rss_mb()}
+
+def _summary(name: str, stats: dict) -> dict:
+    seconds = sum(stats["latencies"])
+    return {
+        "name": name,
+        "files": stats["files"],
+        "pages": stats["pages"],
+        "errors": stats["errors"],
+        "pages_per_s": stats["pages"] / seconds if seconds else 0.0,
+        "p50_ms": percentile(stats["latencies"], 50) * 1000,
+        "p95_ms": percentile(stats["latencies"], 95) * 1000,
+        "accuracy": {f: stats["correct"][f] / stats["files"] for f in FIELDS} if stats["files"] else {},
+    }
+
+def summarize(report: dict) -> List[dict]:
+    total = {"files": 0, "pages": 0, "errors": 0, "latencies": [], "correct": {f: 0 for f in FIELDS}}
+    lines = []
+    for kind, stats in report["kinds"].items():
+        lines.append(_summary(kind, stats))
+        for key in ("files", "pages", "errors"):
+            total[key] += stats[key]
+        total["latencies"] += stats["latencies"]
+        for f in FIELDS:
+            total["correct"][f] += stats["correct"][f]
+    lines.append(_summary("all", total))
+    return lines
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", default=DEFAULT_OUT)
+    parser.add_argument("--invoices", type=int, default=50, help="invoices to generate if the corpus is missing")
+    parser.add_argument("--kinds", default=",".join(KINDS))
+    parser.add_argument("--limit", type=int, default=0, help="only run the first N files")
+    parser.add_argument("--json", help="also write the results to this file")
+    parser.add_argument("-v", "--verbose", action="store_true", help="list every wrong field")
+    args = parser.parse_args()
+
+    kinds = tuple(k for k in args.kinds.split(",") if k)
+    if not os.path.exists(os.path.join(args.corpus, "manifest.json")):
+        print(f"Generating corpus in {args.corpus} ...")
+        build_corpus(args.corpus, args.invoices)
+
+    if not shutil.which("tesseract"):
+        print("Warning: tesseract not found in PATH, only text-layer PDFs will be read.")
+    report = run(args.corpus, kinds, args.limit, args.verbose)
+    summary = summarize(report)
+
+    print(f"{'kind':10s} {'files':>5s} {'pages':>5s} {'err':>4s} {'pages/s':>8s} {'p50 ms':>8s} {'p95 ms':>8s}  "
+          + "  ".join(f"{f:>8s}" for f in FIELDS))
+    for s in summary:
+        acc = "  ".join(f"{s['accuracy'].get(f, 0) * 100:7.1f}%" for f in FIELDS)
+        print(f"{s['name']:10s} {s['files']:5d} {s['pages']:5d} {s['errors']:4d} {s['pages_per_s']:8.2f} "
+              f"{s['p50_ms']:8.1f} {s['p95_ms']:8.1f}  {acc}")
+    rss = report["peak_rss_mb"]
+    print(f"Peak RSS: {rss['self']:.1f} MB (process), {rss['children']:.1f} MB (OCR subprocesses)")
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"summary": summary, "peak_rss_mb": rss}, f, indent=2)
+
+if __name__ == "__main__":
+    main()
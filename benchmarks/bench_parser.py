@@ -0,0 +1,171 @@
+"""
+Micro-benchmark of the OCR text parser (extract_amounts / extract_date).
+
+Builds a large dump of synthetic OCR text, parses it with the single-pass
+tokenizer in logic/ocr_processor.py and with the previous regex-per-line
+implementation (kept below as the baseline), checks that both agree and
+reports throughput.
+
+Usage (from the project root):
+    python -m benchmarks.bench_parser [--invoices 5000] [--repeat 3]
+"""
+import argparse
+import contextlib
+import io
+import random
+import re
+import time
+from typing import List, Tuple
+
+from logic.ocr_processor import _clean_lines, _money_tokens_in, extract_amounts, extract_date, parse_money, tokenize
+
+# =============================================================================
+# Baseline: parser before the single-pass tokenizer
+# =============================================================================
+
+def legacy_extract_date(text: str) -> str:
+    """
+    Return a date in the format found (dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd).
+    If not found, return an empty string.
+    """
+    m = re.search(r'\b(\d{2}[/-]\d{2}[/-]\d{4})\b', text)
+    if m:
+        return m.group(1)
+    m = re.search(r'\b(\d{4}-\d{2}-\d{2})\b', text)
+    if m:
+        return m.group(1)
+    return ""
+
+def legacy_extract_amounts(text: str) -> Tuple[float, float]:
+    """
+    Extract Total and VAT robustly:
+      - 'Total' per line (avoids 'Subtotal')
+      - 'VAT/IVA' per line, avoiding 'VAT No', 'VAT Number', 'Tax ID', etc.
+      - Monetary tokens with decimal or symbol.
+      - Sanity check: if VAT > Total, try to fix; if not, set VAT=0.
+    """
+    lines = _clean_lines(text)
+
+    # --- TOTAL ---
+    total = 0.0
+    total_lines = [ln for ln in lines
+                   if re.search(r'(?i)\btotal\b', ln)
+                   and not re.search(r'(?i)sub\s*total', ln)]
+    for ln in reversed(total_lines):
+        toks = _money_tokens_in(ln)
+        if toks:
+            total = parse_money(toks[-1])
+            break
+
+    if total == 0.0:
+        m = re.search(
+            r'(?is)\btotal\b[^0-9€$+-]*([€$]?\s*[+-]?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{2}))',
+            text
+        )
+        if m:
+            total = parse_money(m.group(1))
+
+    # --- VAT ---
+    vat = 0.0
+    vat_exclude = re.compile(r'(?i)\b(vat\s*(no|number)|tax\s*id|nif|cif)\b')
+    vat_lines = [ln for ln in lines
+                 if re.search(r'(?i)\b(vat|iva)\b', ln) and not vat_exclude.search(ln)]
+
+    vat_lines_sorted = sorted(
+        vat_lines,
+        key=lambda s: 0 if re.search(r'(?i)@\s*\d{1,2}', s) else 1
+    )
+
+    for ln in vat_lines_sorted:
+        toks = _money_tokens_in(ln)
+        if toks:
+            candidate = parse_money(toks[-1])
+            vat = candidate
+            break
+
+    if vat == 0.0 and total > 0:
+        vat = round(total * 0.23, 2)
+
+    if total > 0 and vat > total:
+        toks_all = [parse_money(t) for t in _money_tokens_in(text)]
+        plausibles = [t for t in toks_all if 0 < t <= total]
+        if plausibles:
+            vat = max(plausibles)
+        else:
+            vat = 0.0
+
+    return total, vat
+
+# =============================================================================
+# Synthetic OCR text
+# =============================================================================
+
+SUPPLIERS = ["ACME Supplies Ltd", "Dublin Office Depot", "Green Energy Co", "Cafe Nero", "Tesco Ireland"]
+NOISE = ["Qty Description Unit Price", "Thank you for your business", "www.example.ie",
+         "Payment due within 30 days", "IBAN IE29 AIBK 9311 5212 3456 78", "Page 1 of 1"]
+
+def _amount(value: float, rng: random.Random) -> str:
+    text = f"{value:,.2f}"
+    if rng.random() < 0.3:  # European format
+        text = text.replace(",", "_").replace(".", ",").replace("_", ".")
+    return ("€ " if rng.random() < 0.5 else "") + text
+
+def make_invoice_text(rng: random.Random) -> str:
+    net = round(rng.uniform(5, 5000), 2)
+    vat = round(net * 0.23, 2)
+    lines = [rng.choice(SUPPLIERS), "12 Main Street, Dublin 2", f"VAT No IE{rng.randint(1000000, 9999999)}X",
+             f"Date: {rng.randint(1, 28):02d}/{rng.randint(1, 12):02d}/2025", ""]
+    for _ in range(rng.randint(3, 30)):
+        lines.append(f"{rng.randint(1, 9)} x Item {rng.randint(100, 999)}   {_amount(rng.uniform(1, 500), rng)}")
+        if rng.random() < 0.2:
+            lines.append(rng.choice(NOISE))
+    lines += [f"Subtotal {_amount(net, rng)}", f"VAT @ 23% {_amount(vat, rng)}", f"Total {_amount(net + vat, rng)}"]
+    return "\n".join(lines)
+
+def make_corpus(count: int, seed: int = 42) -> List[str]:
+    rng = random.Random(seed)
+    return [make_invoice_text(rng) for _ in range(count)]
+
+# =============================================================================
+# Runner
+# =============================================================================
+
+def _time(fn, texts: List[str], repeat: int) -> Tuple[float, list]:
+    best = float("inf")
+    results = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            results = [fn(t) for t in texts]
+        best = min(best, time.perf_counter() - start)
+    return best, results
+
+def _new(text: str):
+    parsed = tokenize(text)
+    return extract_date(text, parsed), extract_amounts(text, parsed)
+
+def _old(text: str):
+    return legacy_extract_date(text), legacy_extract_amounts(text)
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--invoices", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=3)
+    args = parser.parse_args()
+
+    texts = make_corpus(args.invoices)
+    size_mb = sum(len(t.encode("utf-8")) for t in texts) / 1e6
+    line_count = sum(t.count("\n") + 1 for t in texts)
+    print(f"Corpus: {len(texts)} invoices, {line_count} lines, {size_mb:.1f} MB")
+
+    old_s, old_results = _time(_old, texts, args.repeat)
+    new_s, new_results = _time(_new, texts, args.repeat)
+    mismatches = sum(a != b for a, b in zip(old_results, new_results))
+
+    for name, seconds in (("baseline (regex per line)", old_s), ("single-pass tokenizer", new_s)):
+        print(f"{name:28s} {seconds:7.3f}s  {len(texts) / seconds:9.0f} invoices/s  "
+              f"{line_count / seconds:10.0f} lines/s  {size_mb / seconds:6.1f} MB/s")
+    print(f"Speed-up: {old_s / new_s:.2f}x   mismatches: {mismatches}")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,224 @@
+"""
+Labelled corpus of synthetic purchase invoices for the OCR benchmark.
+
+Every invoice is generated from a seed, so the same corpus can be rebuilt
+offline on any machine, and is written in several forms:
+
+    pdf       digital PDF with a text layer (reportlab)
+    scan_pdf  image-only PDF, as produced by a scanner
+    png       clean page image
+    jpg       "phone photo": slightly rotated, blurred and JPEG-compressed
+
+manifest.json lists every file with the values process_invoice should find
+(supplier, date, total, vat) and its page count.
+
+Usage (from the project root):
+    python -m benchmarks.ocr_corpus [--out bench_corpus] [--invoices 50]
+"""
+import argparse
+import json
+import os
+import random
+from io import BytesIO
+from typing import List, NamedTuple, Tuple
+
+from PIL import Image, ImageDraw, ImageFilter, ImageFont
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.utils import ImageReader
+from reportlab.pdfgen import canvas
+
+KINDS = ("pdf", "scan_pdf", "png", "jpg")
+DEFAULT_OUT = "bench_corpus"
+IMAGE_DPI = 150
+ITEMS_PER_PAGE = 18
+
+SUPPLIERS = ["ACME Supplies Ltd", "Dublin Office Depot", "Green Energy Co", "Cafe Nero Ireland",
+             "Tesco Ireland", "Murphy Hardware", "Atlantic Print Services", "Liffey Cloud Hosting"]
+STREETS = ["12 Main Street, Dublin 2", "4 Quay Road, Cork", "Unit 7, Sandyford, Dublin 18",
+           "88 Shop Street, Galway"]
+PRODUCTS = ["Printer paper A4", "Toner cartridge", "Consulting hours", "Office chair", "USB-C cable",
+            "Web hosting (monthly)", "Coffee beans 1kg", "Delivery", "Desk lamp", "Software licence"]
+FONT_PATHS = ["/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", "/Library/Fonts/Arial.ttf",
+              r"C:\Windows\Fonts\arial.ttf"]
+
+class Line(NamedTuple):
+    text: str
+    x: float         # points from the left edge
+    y: float         # points from the top edge
+    size: int
+    bold: bool = False
+
+class SyntheticInvoice(NamedTuple):
+    name: str
+    supplier: str
+    date: str
+    total: float
+    vat: float
+    pages: List[List[Line]]
+
+    def expected(self) -> dict:
+        return {"supplier": self.supplier, "date": self.date,
+                "total": f"{self.total:.2f}", "vat": f"{self.vat:.2f}"}
+
+# =============================================================================
+# Content
+# =============================================================================
+
+def _money(value: float) -> str:
+    return f"€{value:,.2f}"
+
+def make_invoice(rng: random.Random, index: int) -> SyntheticInvoice:
+    supplier = rng.choice(SUPPLIERS)
+    day, month = rng.randint(1, 28), rng.randint(1, 12)
+    date = f"{day:02d}/{month:02d}/2025" if rng.random() < 0.7 else f"2025-{month:02d}-{day:02d}"
+
+    items = []
+    for _ in range(rng.randint(2, ITEMS_PER_PAGE * 2 if rng.random() < 0.15 else ITEMS_PER_PAGE)):
+        qty, price = rng.randint(1, 9), round(rng.uniform(2, 400), 2)
+        items.append((rng.choice(PRODUCTS), qty, price))
+    net = round(sum(qty * price for _, qty, price in items), 2)
+    vat = round(net * 0.23, 2)
+    total = round(net + vat, 2)
+
+    pages: List[List[Line]] = []
+    for start in range(0, len(items), ITEMS_PER_PAGE):
+        page = []
+        if not pages:
+            page += [
+                Line(supplier, 50, 60, 18, bold=True),
+                Line(rng.choice(STREETS), 50, 85, 11),
+                Line(f"VAT No IE{rng.randint(1000000, 9999999)}X", 50, 102, 11),
+                Line(f"Invoice INV-{index:05d}", 380, 60, 12),
+                Line(f"Date: {date}", 380, 80, 12),
+            ]
+        y = 150
+        page.append(Line("Description                  Qty      Unit price      Amount", 50, y, 11, bold=True))
+        for desc, qty, price in items[start:start + ITEMS_PER_PAGE]:
+            y += 20
+            page.append(Line(f"{desc:<28} {qty:>3}   {_money(price):>12}   {_money(qty * price):>12}", 50, y, 11))
+        pages.append(page)
+
+    last = pages[-1]
+    y = max(line.y for line in last) + 40
+    last += [
+        Line(f"Subtotal {_money(net)}", 360, y, 12),
+        Line(f"VAT @ 23% {_money(vat)}", 360, y + 20, 12),
+        Line(f"Total {_money(total)}", 360, y + 42, 14, bold=True),
+        Line("Thank you for your business", 50, 790, 9),
+    ]
+    return SyntheticInvoice(f"inv{index:05d}", supplier, date, total, vat, pages)
+
+# =============================================================================
+# Rendering
+# =============================================================================
+
+_font_cache: dict = {}
+
+def _font(size: int, bold: bool) -> ImageFont.ImageFont:
+    key = (size, bold)
+    if key not in _font_cache:
+        font = None
+        for path in FONT_PATHS:
+            if bold:
+                path = path.replace("DejaVuSans.ttf", "DejaVuSans-Bold.ttf")
+            if os.path.exists(path):
+                font = ImageFont.truetype(path, size)
+                break
+        _font_cache[key] = font or ImageFont.load_default()
+    return _font_cache[key]
+
+def render_page_image(page: List[Line], dpi: int = IMAGE_DPI) -> Image.Image:
+    scale = dpi / 72.0
+    width, height = A4
+    img = Image.new("RGB", (int(width * scale), int(height * scale)), "white")
+    draw = ImageDraw.Draw(img)
+    for line in page:
+        draw.text((line.x * scale, line.y * scale), line.text, fill="black",
+                  font=_font(int(line.size * scale), line.bold))
+    return img
+
+def _photo(img: Image.Image, rng: random.Random) -> Image.Image:
+    """Simulate a phone photo of the printed page."""
+    img = img.rotate(rng.uniform(-1.5, 1.5), resample=Image.BICUBIC, expand=True, fillcolor="white")
+    return img.filter(ImageFilter.GaussianBlur(rng.uniform(0.3, 0.9)))
+
+def write_text_pdf(invoice: SyntheticInvoice, path: str) -> None:
+    width, height = A4
+    c = canvas.Canvas(path, pagesize=A4)
+    for page in invoice.pages:
+        for line in page:
+            c.setFont("Helvetica-Bold" if line.bold else "Helvetica", line.size)
+            c.drawString(line.x, height - line.y - line.size, line.text)
+        c.showPage()
+    c.save()
+
+def write_scan_pdf(images: List[Image.Image], path: str) -> None:
+    width, height = A4
+    c = canvas.Canvas(path, pagesize=A4)
+    for img in images:
+        buf = BytesIO()
+        img.convert("L").save(buf, format="PNG")
+        buf.seek(0)
+        c.drawImage(ImageReader(buf), 0, 0, width=width, height=height)
+        c.showPage()
+    c.save()
+
+def write_invoice(invoice: SyntheticInvoice, out_dir: str, kinds: Tuple[str, ...],
+                  rng: random.Random) -> List[dict]:
+    """Write one invoice in every requested kind; returns its manifest rows."""
+    images = [render_page_image(page) for page in invoice.pages] if set(kinds) - {"pdf"} else []
+    rows = []
+    for kind in kinds:
+        # Single images can only hold one page.
+        if kind in ("png", "jpg") and len(invoice.pages) > 1:
+            continue
+        ext = "pdf" if kind.endswith("pdf") else kind
+        filename = f"{invoice.name}_{kind}.{ext}"
+        path = os.path.join(out_dir, filename)
+        if kind == "pdf":
+            write_text_pdf(invoice, path)
+        elif kind == "scan_pdf":
+            write_scan_pdf(images, path)
+        elif kind == "png":
+            images[0].save(path, format="PNG")
+        else:
+            _photo(images[0], rng).save(path, format="JPEG", quality=70)
+        rows.append({"file": filename, "kind": kind, "pages": len(invoice.pages), **invoice.expected()})
+    for img in images:
+        img.close()
+    return rows
+
+def build_corpus(out_dir: str = DEFAULT_OUT, invoices: int = 50, kinds: Tuple[str, ...] = KINDS,
+                 seed: int = 42) -> str:
+    """Generate the corpus and return the path of its manifest."""
+    os.makedirs(out_dir, exist_ok=True)
+    rng = random.Random(seed)
+    rows = []
+    for index in range(invoices):
+        rows += write_invoice(make_invoice(rng, index), out_dir, tuple(kinds), rng)
+    manifest = os.path.join(out_dir, "manifest.json")
+    with open(manifest, "w", encoding="utf-8") as f:
+        json.dump({"seed": seed, "invoices": invoices, "files": rows}, f, indent=2)
+    return manifest
+
+def load_manifest(out_dir: str) -> List[dict]:
+    with open(os.path.join(out_dir, "manifest.json"), encoding="utf-8") as f:
+        return json.load(f)["files"]
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--invoices", type=int, default=50)
+    parser.add_argument("--kinds", default=",".join(KINDS), help=f"comma separated subset of {KINDS}")
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+
+    kinds = tuple(k for k in args.kinds.split(",") if k)
+    unknown = set(kinds) - set(KINDS)
+    if unknown:
+        parser.error(f"unknown kinds: {', '.join(sorted(unknown))}")
+    manifest = build_corpus(args.out, args.invoices, kinds, args.seed)
+    print(f"Corpus written: {manifest} ({len(load_manifest(args.out))} files)")
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,6 @@
 from django.contrib import admin
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
-from .models import User, FiscalProfile, Contact, Invoice, InvoiceLine, TaxPeriod, FiscalConfig
+from .models import User, FiscalProfile, Contact, Invoice, InvoiceLine, TaxPeriod, FiscalConfig, OcrJob, OcrResultCache
 
 @admin.register(User)
 class UserAdmin(DjangoUserAdmin):
@@ -66,3 +66,15 @@ class FiscalConfigAdmin(admin.ModelAdmin):
     list_display = ('user', 'year')
     list_filter = ('year',)
     search_fields = ('user__email',)
+
+@admin.register(OcrJob)
+class OcrJobAdmin(admin.ModelAdmin):
+    list_display = ('id', 'invoice', 'status', 'cache_hit', 'attempts', 'worker', 'created_at', 'finished_at')
+    list_filter = ('status', 'cache_hit')
+    search_fields = ('invoice__invoice_number', 'invoice__user__email', 'worker')
+
+@admin.register(OcrResultCache)
+class OcrResultCacheAdmin(admin.ModelAdmin):
+    list_display = ('content_hash', 'parser_version', 'hits', 'file_size', 'created_at', 'last_used_at')
+    list_filter = ('parser_version',)
+    search_fields = ('content_hash',)
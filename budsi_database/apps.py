@@ -0,0 +1,8 @@
+from django.apps import AppConfig
+
+
+class BudsiDatabaseConfig(AppConfig):
+    name = "budsi_database"
+
+    def ready(self):
+        from . import signals  # noqa: F401
@@ -0,0 +1,21 @@
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from budsi_database.models import FiscalProfile, Invoice
+from budsi_django.storage import ContentAddressedStorage
+
+
+class Command(BaseCommand):
+    help = "Move media files saved before ContentAddressedStorage into the deduplicated blob store."
+
+    def handle(self, *args, **options):
+        if not isinstance(default_storage, ContentAddressedStorage):
+            raise CommandError("The default storage is not ContentAddressedStorage (see STORAGES).")
+
+        names = set(Invoice.objects.exclude(original_file="").values_list("original_file", flat=True))
+        names |= set(FiscalProfile.objects.exclude(logo="").exclude(logo=None).values_list("logo", flat=True))
+        adopted = 0
+        for name in sorted(names):
+            if default_storage.adopt(name):
+                adopted += 1
+        self.stdout.write(f"[MEDIA] {adopted} of {len(names)} files moved to the blob store")
@@ -0,0 +1,33 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from logic.ocr_cache import cache_stats, evict
+
+
+class Command(BaseCommand):
+    help = "Show OCR result cache hit/miss stats and evict old entries."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--evict", action="store_true",
+                            help="Evict entries by age/size before printing stats.")
+        parser.add_argument("--max-entries", type=int, default=settings.OCR_CACHE_MAX_ENTRIES,
+                            help="Keep at most this many entries (least recently used go first).")
+        parser.add_argument("--max-age-days", type=int, default=settings.OCR_CACHE_MAX_AGE_DAYS,
+                            help="Drop entries not used for this many days.")
+        parser.add_argument("--days", type=int, default=0,
+                            help="Only count uploads from the last N days in the hit ratio.")
+
+    def handle(self, *args, **options):
+        if options["evict"]:
+            deleted = evict(options["max_entries"], options["max_age_days"])
+            self.stdout.write(f"[CACHE] Evicted {deleted} entr{'y' if deleted == 1 else 'ies'}")
+
+        since = timezone.now() - timedelta(days=options["days"]) if options["days"] else None
+        stats = cache_stats(since)
+        self.stdout.write(
+            f"[CACHE] entries={stats['entries']} hits={stats['hits']} "
+            f"misses={stats['misses']} hit_ratio={stats['hit_ratio']:.2%}"
+        )
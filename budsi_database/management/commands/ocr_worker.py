@@ -0,0 +1,57 @@
+import time
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+
+from logic.ocr_queue import process_next, requeue_stale_jobs, worker_name
+
+
+class Command(BaseCommand):
+    help = "Process queued OCR jobs (invoice uploads) in the background."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--once", action="store_true",
+                            help="Drain the queue once and exit instead of polling.")
+        parser.add_argument("--max-jobs", type=int, default=0,
+                            help="Exit after processing this many jobs (0 = no limit).")
+        parser.add_argument("--poll-interval", type=float, default=2.0,
+                            help="Seconds to sleep when the queue is empty.")
+        parser.add_argument("--pdf-workers", type=int, default=None,
+                            help="Processes used to OCR PDF pages concurrently "
+                                 "(default: OCR_PDF_WORKERS env, 1 = sequential).")
+        parser.add_argument("--stale-after", type=int, default=600,
+                            help="Re-queue running jobs older than this many seconds.")
+
+    def handle(self, *args, **options):
+        if options["pdf_workers"] is not None:
+            from logic import ocr_processor
+            ocr_processor.PDF_OCR_WORKERS = max(1, options["pdf_workers"])
+
+        # Load the OCR engine once, before the first job.
+        from logic.ocr_engine import get_engine
+        get_engine()
+
+        name = worker_name()
+        stale_after = timedelta(seconds=options["stale_after"])
+        max_jobs = options["max_jobs"]
+        processed = 0
+
+        self.stdout.write(f"[QUEUE] OCR worker {name} started")
+        while True:
+            requeued = requeue_stale_jobs(stale_after)
+            if requeued:
+                self.stdout.write(f"[QUEUE] Re-queued {requeued} stale job(s)")
+
+            job = process_next(name)
+            if job is None:
+                if options["once"]:
+                    break
+                time.sleep(options["poll_interval"])
+                continue
+
+            processed += 1
+            self.stdout.write(f"[QUEUE] Job {job.id} -> {job.status}")
+            if max_jobs and processed >= max_jobs:
+                break
+
+        self.stdout.write(f"[QUEUE] OCR worker {name} stopped after {processed} job(s)")
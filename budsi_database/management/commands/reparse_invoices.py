@@ -0,0 +1,29 @@
+from django.core.management.base import BaseCommand
+
+from logic.ocr_processor import PARSER_VERSION
+from logic.ocr_reparse import DEFAULT_BATCH_SIZE, reparse_candidates, reparse_invoices
+
+
+class Command(BaseCommand):
+    help = ("Re-run the invoice parser over stored OCR text (no OCR) for invoices "
+            "the user has not confirmed yet.")
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                            help="Invoices per transaction / bulk update.")
+        parser.add_argument("--user", type=int, default=None,
+                            help="Only re-parse this user's invoices (user id).")
+        parser.add_argument("--force", action="store_true",
+                            help="Also re-parse invoices already at the current parser version.")
+        parser.add_argument("--dry-run", action="store_true",
+                            help="Count the invoices that would change without saving them.")
+
+    def handle(self, *args, **options):
+        qs = reparse_candidates(force=options["force"])
+        if options["user"]:
+            qs = qs.filter(user_id=options["user"])
+
+        self.stdout.write(f"[PARSE] Parser version {PARSER_VERSION}: {qs.count()} candidate invoices")
+        stats = reparse_invoices(qs, batch_size=options["batch_size"], dry_run=options["dry_run"])
+        verb = "would change" if options["dry_run"] else "changed"
+        self.stdout.write(f"[PARSE] Done: {stats['scanned']} scanned, {stats['updated']} {verb}")
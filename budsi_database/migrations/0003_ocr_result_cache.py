@@ -0,0 +1,40 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:33
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budsi_database', '0002_ocrjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='content_hash',
+            field=models.CharField(blank=True, db_index=True, max_length=64),
+        ),
+        migrations.AddField(
+            model_name='ocrjob',
+            name='cache_hit',
+            field=models.BooleanField(default=False),
+        ),
+        migrations.CreateModel(
+            name='OcrResultCache',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('content_hash', models.CharField(max_length=64)),
+                ('parser_version', models.PositiveIntegerField()),
+                ('result', models.JSONField(default=dict)),
+                ('file_size', models.PositiveIntegerField(default=0)),
+                ('hits', models.PositiveIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('last_used_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'indexes': [models.Index(fields=['last_used_at'], name='budsi_datab_last_us_c5f8bd_idx')],
+                'unique_together': {('content_hash', 'parser_version')},
+            },
+        ),
+    ]
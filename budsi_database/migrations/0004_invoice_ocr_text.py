@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budsi_database', '0003_ocr_result_cache'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='ocr_parser_version',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='ocr_text',
+            field=models.BinaryField(blank=True, default=b''),
+        ),
+    ]
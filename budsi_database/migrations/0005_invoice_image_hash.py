@@ -0,0 +1,24 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:46
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budsi_database', '0004_invoice_ocr_text'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='near_duplicates', to='budsi_database.invoice'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='image_hash',
+            field=models.BigIntegerField(blank=True, null=True),
+        ),
+    ]
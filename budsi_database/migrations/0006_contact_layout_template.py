@@ -0,0 +1,23 @@
+# Generated by Django 5.2.7 on 2026-10-17 03:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budsi_database', '0005_invoice_image_hash'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='contact',
+            name='layout_template',
+            field=models.JSONField(blank=True, default=dict),
+        ),
+        migrations.AddField(
+            model_name='contact',
+            name='layout_updated_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 5.2.7 on 2026-10-17 04:20
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('budsi_database', '0007_stored_blob'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['user', 'is_confirmed', 'date'], name='budsi_datab_user_id_730c3a_idx'),
+        ),
+    ]
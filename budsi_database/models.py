@@ -122,8 +122,20 @@ class Contact(models.Model):
     is_client = models.BooleanField(default=False)
     is_favorite = models.BooleanField(default=False)
 
+    # Where total/VAT/date sit on this supplier's invoices (logic/layout_templates.py)
+    layout_template = models.JSONField(default=dict, blank=True)
+    layout_updated_at = models.DateTimeField(blank=True, null=True)
+
     class Meta:
-        unique_together = (('user', 'tax_id'),)
+        # Blank tax IDs are common for OCR-detected suppliers, so only enforce
+        # uniqueness when a tax ID is actually set.
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'tax_id'],
+                condition=~models.Q(tax_id=''),
+                name='unique_contact_tax_id_per_user',
+            ),
+        ]
         indexes = [models.Index(fields=['user', 'name'])]
 
     def __str__(self):
@@ -139,6 +151,9 @@ class Invoice(models.Model):
     PURCHASE = 'purchase'
     INVOICE_TYPES = ((SALE, 'Sale'), (PURCHASE, 'Purchase'))
 
+    DRAFT = 'draft'
+    PROCESSING = 'processing'  # waiting for the OCR worker
+
     user = models.ForeignKey('User', on_delete=models.CASCADE, related_name='invoices')
     invoice_type = models.CharField(max_length=10, choices=INVOICE_TYPES, default=SALE)
     contact = models.ForeignKey('Contact', on_delete=models.PROTECT, related_name='invoices')
@@ -153,11 +168,18 @@ class Invoice(models.Model):
     total = models.DecimalField(max_digits=12, decimal_places=2, default=Decimal('0.00'))
     currency = models.CharField(max_length=3, default='EUR')
 
-    status = models.CharField(max_length=20, default='draft')
+    status = models.CharField(max_length=20, default=DRAFT)
     is_confirmed = models.BooleanField(default=False)  # NUEVO
 
     ocr_data = models.JSONField(default=dict, blank=True)
     original_file = models.FileField(upload_to=invoice_upload_to, blank=True, null=True)
+    content_hash = models.CharField(max_length=64, blank=True, db_index=True)  # SHA-256 of original_file
+    image_hash = models.BigIntegerField(blank=True, null=True)  # 64-bit dHash of the image (signed)
+    duplicate_of = models.ForeignKey(
+        'self', on_delete=models.SET_NULL, blank=True, null=True, related_name='near_duplicates'
+    )  # receipt that looked the same at upload time
+    ocr_text = models.BinaryField(blank=True, default=b'')  # raw OCR text, zlib-compressed
+    ocr_parser_version = models.PositiveSmallIntegerField(default=0)  # 0 = never parsed
 
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
@@ -167,6 +189,7 @@ class Invoice(models.Model):
         indexes = [
             models.Index(fields=['user', 'date']),
             models.Index(fields=['user', 'status']),
+            models.Index(fields=['user', 'is_confirmed', 'date']),  # tax report period
         ]
 
     def __str__(self):
@@ -213,3 +236,66 @@ class FiscalConfig(models.Model):
 
     def __str__(self):
         return f'Config {self.year} for {self.user}'
+
+# -------- OCR Job Queue --------
+class OcrJob(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = ((QUEUED, 'Queued'), (RUNNING, 'Running'), (DONE, 'Done'), (FAILED, 'Failed'))
+
+    invoice = models.ForeignKey('Invoice', on_delete=models.CASCADE, related_name='ocr_jobs')
+    status = models.CharField(max_length=10, choices=STATUSES, default=QUEUED)
+    attempts = models.PositiveIntegerField(default=0)
+    worker = models.CharField(max_length=100, blank=True)
+    error = models.TextField(blank=True)
+    cache_hit = models.BooleanField(default=False)  # resolved from OcrResultCache, no OCR run
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+
+    class Meta:
+        indexes = [models.Index(fields=['status', 'created_at'])]
+
+    def __str__(self):
+        return f'OCR job {self.id} ({self.status}) for invoice {self.invoice_id}'
+
+# -------- OCR Result Cache --------
+class OcrResultCache(models.Model):
+    content_hash = models.CharField(max_length=64)
+    parser_version = models.PositiveIntegerField()
+    result = models.JSONField(default=dict)
+    file_size = models.PositiveIntegerField(default=0)
+    hits = models.PositiveIntegerField(default=0)
+
+    created_at = models.DateTimeField(auto_now_add=True)
+    last_used_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = (('content_hash', 'parser_version'),)
+        indexes = [models.Index(fields=['last_used_at'])]
+
+    def __str__(self):
+        return f'{self.content_hash[:12]}… v{self.parser_version} ({self.hits} hits)'
+
+# -------- Content-addressed media (budsi_django/storage.py) --------
+class StoredBlob(models.Model):
+    sha256 = models.CharField(max_length=64, unique=True)
+    size = models.PositiveBigIntegerField(default=0)
+    refcount = models.PositiveIntegerField(default=0)  # BlobAlias rows pointing here
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.sha256[:12]}… ({self.refcount} refs)'
+
+class BlobAlias(models.Model):
+    name = models.CharField(max_length=255, unique=True)  # what FileFields store
+    blob = models.ForeignKey(StoredBlob, on_delete=models.PROTECT, related_name='aliases')
+
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    def __str__(self):
+        return f'{self.name} -> {self.blob.sha256[:12]}…'
@@ -0,0 +1,41 @@
+from django.db import transaction
+from django.db.models.signals import post_delete, pre_save
+
+from .models import FiscalProfile, Invoice
+
+# =============================================================================
+# Stored files follow their rows
+# =============================================================================
+# ContentAddressedStorage counts the names pointing at each blob. These
+# handlers delete a name when its row is deleted or its file replaced, so the
+# blob goes with the last name. Deletion waits for the commit: a rolled back
+# delete keeps its file.
+
+FILE_FIELDS = {Invoice: "original_file", FiscalProfile: "logo"}
+
+def release_file(model, name: str) -> None:
+    """Delete the stored file `name` of `model` (and its renditions) if no row uses it."""
+    field = FILE_FIELDS[model]
+    if not name or model.objects.filter(**{field: name}).exists():
+        return
+    if model is Invoice:
+        from logic.renditions import delete_renditions
+        delete_renditions(name)
+    model._meta.get_field(field).storage.delete(name)
+
+def file_row_deleted(sender, instance, **kwargs):
+    name = getattr(instance, FILE_FIELDS[sender]).name
+    if name:
+        transaction.on_commit(lambda: release_file(sender, name))
+
+def file_replaced(sender, instance, update_fields=None, **kwargs):
+    field = FILE_FIELDS[sender]
+    if instance.pk is None or (update_fields is not None and field not in update_fields):
+        return
+    old = sender.objects.filter(pk=instance.pk).values_list(field, flat=True).first()
+    if old and old != getattr(instance, field).name:
+        transaction.on_commit(lambda: release_file(sender, old))
+
+for model in FILE_FIELDS:
+    post_delete.connect(file_row_deleted, sender=model, dispatch_uid=f"release_file_{model.__name__}")
+    pre_save.connect(file_replaced, sender=model, dispatch_uid=f"replace_file_{model.__name__}")
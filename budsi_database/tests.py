@@ -1,5 +1,6 @@
-from django.test import TestCase
-from .models import User, Contact, Invoice
+from django.test import TestCase, override_settings
+from unittest import mock
+from .models import User, Contact, Invoice, OcrJob
 from decimal import Decimal
 from datetime import date
 
@@ -24,3 +25,1137 @@ class InvoiceModelTest(TestCase):
         )
         self.assertEqual(invoice.total, Decimal("123.00"))
         self.assertEqual(str(invoice), f"{invoice.invoice_number} - {contact.name} - {invoice.total} {invoice.currency}")
+
+class OcrQueueTest(TestCase):
+    def setUp(self):
+        from logic.ocr_queue import placeholder_contact
+        self.user = User.objects.create_user(email="ocr@example.com", password="pass")
+        self.invoice = Invoice.objects.create(
+            user=self.user,
+            invoice_type="purchase",
+            contact=placeholder_contact(self.user),
+            invoice_number="OCR-1",
+            date=date.today(),
+            original_file="invoices/user_1/receipt.png",
+        )
+
+    def test_enqueue_and_process(self):
+        from logic.ocr_queue import enqueue_invoice, process_next
+        enqueue_invoice(self.invoice)
+        self.assertEqual(self.invoice.status, Invoice.PROCESSING)
+
+        ocr = {"supplier": "ACME Ltd", "date": "05/03/2025", "total": "100.00", "vat": "23.00", "description": ""}
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=ocr), \
+             mock.patch("logic.data_manager.save_invoice"):
+            job = process_next("test")
+
+        self.assertEqual(job.status, OcrJob.DONE)
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.DRAFT)
+        self.assertEqual(self.invoice.contact.name, "ACME Ltd")
+        self.assertEqual(self.invoice.date, date(2025, 3, 5))
+        self.assertEqual(self.invoice.total, Decimal("123.00"))
+        self.assertIsNone(process_next("test"))
+
+    def test_no_template_lookup_without_templates(self):
+        from django.utils import timezone
+        from logic.layout_templates import forget_user
+        from logic.ocr_queue import enqueue_invoice, process_next
+        ocr = {"supplier": "ACME Ltd", "date": "", "total": "1.00", "vat": "0.00", "description": ""}
+        self.addCleanup(forget_user, self.user.id)
+
+        enqueue_invoice(self.invoice)
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=ocr) as run_ocr, \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test")
+        self.assertIsNone(run_ocr.call_args.kwargs["template_for"])  # no extra header OCR
+
+        Contact.objects.create(user=self.user, name="ACME Ltd", layout_updated_at=timezone.now(),
+                               layout_template={"fields": {"total": [0.8, 0.9]}, "samples": 2})
+        enqueue_invoice(self.invoice)
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=ocr) as run_ocr, \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test")
+        self.assertIsNotNone(run_ocr.call_args.kwargs["template_for"])
+
+    def test_duplicate_content_uses_cache(self):
+        from logic.ocr_cache import cache_stats
+        from logic.ocr_queue import enqueue_invoice, process_next
+        self.invoice.content_hash = "ab" * 32
+        self.invoice.save()
+        enqueue_invoice(self.invoice)
+
+        ocr = {"supplier": "ACME Ltd", "date": "", "total": "10.00", "vat": "2.30", "description": "",
+               "text": "ACME Ltd\nVAT 2.30\nTotal 10.00", "text_source": "ocr", "ocr_passes": 1}
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=ocr) as run_ocr, \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test")
+            duplicate = Invoice.objects.create(
+                user=self.user, invoice_type="purchase", contact=self.invoice.contact,
+                invoice_number="OCR-2", date=date.today(), content_hash=self.invoice.content_hash,
+            )
+            enqueue_invoice(duplicate)
+            job = process_next("test")
+
+        self.assertEqual(run_ocr.call_count, 1)
+        self.assertTrue(job.cache_hit)
+        stats = cache_stats()
+        self.assertEqual((stats["hits"], stats["misses"], stats["entries"]), (1, 1, 1))
+
+    def test_confirmed_during_ocr_is_not_overwritten(self):
+        from logic.ocr_queue import enqueue_invoice, process_next
+        enqueue_invoice(self.invoice)
+        ocr = {"supplier": "ACME Ltd", "date": "05/03/2025", "total": "100.00", "vat": "23.00", "description": ""}
+
+        def user_confirms(*args, **kwargs):
+            Invoice.objects.filter(pk=self.invoice.pk).update(is_confirmed=True, subtotal=Decimal("7.00"))
+            return ocr
+
+        with mock.patch("logic.ocr_processor.process_invoice", side_effect=user_confirms), \
+             mock.patch("logic.data_manager.save_invoice") as save_invoice:
+            job = process_next("test")
+
+        self.assertEqual(job.status, OcrJob.DONE)
+        save_invoice.assert_not_called()
+        self.invoice.refresh_from_db()
+        self.assertTrue(self.invoice.is_confirmed)
+        self.assertEqual(self.invoice.subtotal, Decimal("7.00"))
+        self.assertEqual(self.invoice.status, Invoice.DRAFT)
+
+    def test_preview_form_hidden_while_processing(self):
+        from logic.ocr_queue import enqueue_invoice
+        enqueue_invoice(self.invoice)
+        self.client.force_login(self.user)
+        url = f"/invoices/{self.invoice.id}/preview/"
+
+        self.assertNotContains(self.client.get(url), 'name="confirm"')
+        self.client.post(url, {"contact": self.invoice.contact_id, "date": "2025-01-01",
+                               "subtotal": "1", "vat_amount": "0", "confirm": "1"})
+        self.invoice.refresh_from_db()
+        self.assertFalse(self.invoice.is_confirmed)
+
+    def test_failed_ocr_is_not_cached(self):
+        from budsi_database.models import OcrResultCache
+        from logic.ocr_queue import enqueue_invoice, process_next
+        self.invoice.content_hash = "cd" * 32
+        self.invoice.save()
+        enqueue_invoice(self.invoice)
+
+        # What process_invoice returns when tesseract fails on the file.
+        failed = {"supplier": "Unknown supplier", "date": "", "total": "0.00", "vat": "0.00", "description": "",
+                  "text": "", "text_source": "ocr", "ocr_passes": 0}
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=failed), \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test")
+        self.assertFalse(OcrResultCache.objects.exists())
+
+    def test_failed_job_is_requeued(self):
+        from logic.ocr_queue import enqueue_invoice, process_next
+        enqueue_invoice(self.invoice)
+        with mock.patch("logic.ocr_processor.process_invoice", side_effect=RuntimeError("boom")):
+            job = process_next("test")
+        self.assertEqual(job.status, OcrJob.QUEUED)
+        self.assertEqual(job.attempts, 1)
+
+    def test_user_threshold_reaches_ocr(self):
+        from budsi_database.models import FiscalProfile
+        from logic.ocr_queue import enqueue_invoice, process_next
+        FiscalProfile.objects.create(user=self.user, ocr_confidence_threshold=Decimal("0.85"))
+        enqueue_invoice(self.invoice)
+        with mock.patch("logic.ocr_processor.process_invoice", return_value={}) as ocr:
+            process_next("test")
+        self.assertEqual(ocr.call_args.kwargs["confidence_threshold"], 0.85)
+
+    def test_job_that_keeps_killing_the_worker_fails(self):
+        from datetime import timedelta
+        from django.utils import timezone
+        from logic.ocr_queue import MAX_ATTEMPTS, claim_next_job, enqueue_invoice, requeue_stale_jobs
+        enqueue_invoice(self.invoice)
+        long_ago = timezone.now() - timedelta(hours=1)
+
+        # The worker dies mid-job (no exception reaches run_job) every time.
+        for attempt in range(1, MAX_ATTEMPTS + 1):
+            job = claim_next_job("test")
+            self.assertEqual(job.attempts, attempt)
+            OcrJob.objects.filter(pk=job.pk).update(started_at=long_ago)
+            requeued = requeue_stale_jobs(timedelta(minutes=10))
+            self.assertEqual(requeued, 0 if attempt == MAX_ATTEMPTS else 1)
+
+        job.refresh_from_db()
+        self.assertEqual(job.status, OcrJob.FAILED)
+        self.assertIsNone(claim_next_job("test"))
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.status, Invoice.DRAFT)
+        self.assertEqual(self.invoice.description, "OCR failed (please fill in manually).")
+
+    def test_reparse_uses_stored_text(self):
+        from logic.ocr_queue import enqueue_invoice, process_next, unpack_text
+        from logic.ocr_reparse import reparse_invoices
+        text = "ACME Ltd\nDate 05/03/2025\nVAT 23.00\nTotal 100.00"
+        ocr = {"supplier": "ACME Ltd", "date": "05/03/2025", "total": "100.00", "vat": "23.00",
+               "description": "", "text": text}
+        enqueue_invoice(self.invoice)
+        with mock.patch("logic.ocr_processor.process_invoice", return_value=ocr), \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test")
+        self.invoice.refresh_from_db()
+        self.assertEqual(unpack_text(self.invoice.ocr_text), text)
+        self.assertNotIn("text", self.invoice.ocr_data)
+
+        confirmed = Invoice.objects.create(
+            user=self.user, invoice_type="purchase", contact=self.invoice.contact, invoice_number="OCR-2",
+            date=date.today(), is_confirmed=True, ocr_text=self.invoice.ocr_text, ocr_parser_version=1,
+        )
+        newer = dict(ocr, total="200.00", vat="46.00")
+        with mock.patch("logic.ocr_reparse.PARSER_VERSION", 2), \
+             mock.patch("logic.ocr_reparse.parse_invoice_text", return_value=newer) as parse, \
+             mock.patch("logic.ocr_processor.process_invoice") as run_ocr:
+            stats = reparse_invoices(batch_size=1)
+
+        run_ocr.assert_not_called()
+        parse.assert_called_once_with(text)
+        self.assertEqual(stats, {"scanned": 1, "updated": 1})
+        self.invoice.refresh_from_db()
+        self.assertEqual(self.invoice.total, Decimal("246.00"))
+        self.assertEqual(self.invoice.ocr_parser_version, 2)
+        confirmed.refresh_from_db()
+        self.assertEqual(confirmed.ocr_parser_version, 1)
+
+class OcrEngineTest(TestCase):
+    def test_backend_selection_and_fallback(self):
+        from logic import ocr_engine
+
+        fake = mock.Mock()
+        with mock.patch.object(ocr_engine, "tesserocr", None):
+            self.assertIsInstance(ocr_engine.create_engine("auto"), ocr_engine.PytesseractEngine)
+            self.assertIsInstance(ocr_engine.create_engine("tesserocr"), ocr_engine.PytesseractEngine)
+        with mock.patch.object(ocr_engine, "tesserocr", fake):
+            engine = ocr_engine.create_engine("auto")
+            self.assertIsInstance(engine, ocr_engine.TesserocrEngine)
+            fake.PyTessBaseAPI.assert_called_once_with(
+                lang=ocr_engine.OCR_LANG, psm=ocr_engine.OCR_PSM, oem=ocr_engine.OCR_OEM)
+            self.assertIsInstance(ocr_engine.create_engine("pytesseract"), ocr_engine.PytesseractEngine)
+
+            fake.PyTessBaseAPI.side_effect = RuntimeError("no eng.traineddata")
+            self.assertIsInstance(ocr_engine.create_engine("tesserocr"), ocr_engine.PytesseractEngine)
+
+    def test_engine_is_created_once_per_process(self):
+        from logic import ocr_engine
+
+        with mock.patch.object(ocr_engine, "_engine", None), \
+             mock.patch.object(ocr_engine, "create_engine", return_value=mock.Mock(name="engine")) as create:
+            self.assertIs(ocr_engine.get_engine(), ocr_engine.get_engine())
+        create.assert_called_once_with()
+
+    def test_broken_pool_is_replaced(self):
+        from concurrent.futures.process import BrokenProcessPool
+        from logic import ocr_engine, ocr_processor
+
+        broken, fresh = mock.Mock(name="broken"), mock.Mock(name="fresh")
+        broken.map.side_effect = BrokenProcessPool("a child process terminated abruptly")
+        fresh.map.return_value = [ocr_processor.OcrText("page 1", 0.9, 1), ocr_processor.OcrText("page 2", 0.9, 1)]
+        with mock.patch.object(ocr_engine, "_pool", None), mock.patch.object(ocr_engine, "_pool_size", 0), \
+             mock.patch.object(ocr_engine, "ProcessPoolExecutor", side_effect=[broken, fresh]), \
+             mock.patch.object(ocr_processor, "_iter_pdf_pages", return_value=[]) as sequential:
+            self.assertEqual(ocr_processor._ocr_pdf_pages("scan.pdf", [1, 2], 2, 1), {})
+            sequential.assert_called_once()
+            broken.shutdown.assert_called_once_with(wait=False, cancel_futures=True)
+            self.assertIsNone(ocr_engine._pool)
+
+            pages = ocr_processor._ocr_pdf_pages("scan.pdf", [1, 2], 2, 1)
+        self.assertEqual(pages[2].text, "page 2")
+        sequential.assert_called_once()
+
+class MultipassOcrTest(TestCase):
+    def _words(self, total_conf, other_conf=95, total_text="Total"):
+        from logic.ocr_engine import OcrWord
+        return [OcrWord("ACME", other_conf, 0, 0, 50, 10, (0,)),
+                OcrWord(total_text, total_conf, 0, 40, 50, 10, (1,)),
+                OcrWord("123.00", total_conf, 60, 40, 50, 10, (1,))]
+
+    def test_field_confidence_uses_key_lines(self):
+        from logic.ocr_processor import field_confidence
+        self.assertAlmostEqual(field_confidence(self._words(90, other_conf=30)), 0.9)
+        no_key = self._words(60, other_conf=90, total_text="Amount")
+        self.assertEqual(field_confidence(no_key), 0.0)
+        self.assertAlmostEqual(field_confidence(no_key, require_fields=False), 0.7)
+
+    def _multipass(self, words):
+        from PIL import Image
+        from logic import ocr_processor
+
+        engine = mock.Mock()
+        engine.image_to_data.return_value = words
+        engine.image_to_string.return_value = "full page"
+        load_full = mock.Mock(return_value=Image.new("L", (2000, 2800), 255))
+        with mock.patch.object(ocr_processor, "get_engine", return_value=engine), \
+             mock.patch.object(ocr_processor, "OCR_LAYOUT_MODE", False):
+            result = ocr_processor._ocr_multipass(Image.new("L", (600, 840), 255), 0.7, load_full, True)
+        return result, load_full, engine
+
+    def test_confident_cheap_pass_is_kept(self):
+        result, load_full, engine = self._multipass(self._words(92))
+        self.assertEqual(result.passes, 1)
+        self.assertEqual(result.text, "ACME\nTotal 123.00")
+        load_full.assert_not_called()
+        engine.image_to_string.assert_not_called()
+
+    def test_low_confidence_escalates_to_full_image(self):
+        result, load_full, engine = self._multipass(self._words(40))
+        self.assertEqual(result.passes, 2)
+        self.assertAlmostEqual(result.confidence, 0.4)
+        self.assertEqual(result.text, "full page")
+        load_full.assert_called_once_with()
+        self.assertEqual(engine.image_to_string.call_args[0][0].size, (2000, 2800))
+
+    def test_missing_key_lines_escalate(self):
+        result, load_full, _ = self._multipass(self._words(99, other_conf=99, total_text="Amount"))
+        self.assertEqual(result.passes, 2)
+        load_full.assert_called_once_with()
+
+class OcrTextLayerTest(TestCase):
+    def test_digital_pdf_skips_ocr(self):
+        import os
+        import tempfile
+        from reportlab.pdfgen import canvas
+        from logic import ocr_processor
+
+        path = os.path.join(tempfile.mkdtemp(), "invoice.pdf")
+        c = canvas.Canvas(path)
+        for y, line in enumerate(["ACME Supplies Ltd", "Date: 05/03/2025", "VAT @ 23% 23.00", "Total 123.00"]):
+            c.drawString(50, 800 - y * 20, line)
+        c.save()
+
+        with mock.patch.object(ocr_processor, "_ocr_pdf_pages") as ocr:
+            result = ocr_processor.process_invoice(path)
+        ocr.assert_not_called()
+        self.assertEqual(result["text_source"], "text_layer")
+        self.assertEqual(result["supplier"], "ACME Supplies Ltd")
+        self.assertEqual(result["total"], "123.00")
+
+class PdfOcrTest(TestCase):
+    def test_parallel_pages_come_back_in_page_order(self):
+        from logic import ocr_processor
+        from logic.ocr_processor import OcrText
+
+        class ReversePool:
+            """Finishes the last page first; map() still returns in submission order."""
+            def map(self, fn, *iterables):
+                calls = list(zip(*iterables))
+                done = {args: fn(*args) for args in reversed(calls)}
+                return iter([done[args] for args in calls])
+
+        def ocr_page(file_path, page_no, threshold):
+            return OcrText(f"page {page_no}", 0.9 - page_no / 100, 1)
+
+        with mock.patch.object(ocr_processor, "get_pool", return_value=ReversePool()) as get_pool, \
+             mock.patch.object(ocr_processor, "_ocr_pdf_page", side_effect=ocr_page):
+            result = ocr_processor.pdf_ocr("scan.pdf", workers=3, pages=[3, 1, 4, 2])
+
+        get_pool.assert_called_once_with(3)
+        self.assertEqual(result.text, "page 1\npage 2\npage 3\npage 4")
+        self.assertAlmostEqual(result.confidence, 0.86)
+
+    def test_page_batches_split_on_gaps_and_window(self):
+        from logic.ocr_processor import _page_batches
+        self.assertEqual(list(_page_batches([1, 2, 3, 5, 6, 9], 2)), [(1, 2), (3, 3), (5, 6), (9, 9)])
+        self.assertEqual(list(_page_batches([4, 5, 6], 0)), [(4, 4), (5, 5), (6, 6)])
+        self.assertEqual(list(_page_batches([], 3)), [])
+
+    def test_only_the_first_max_pages_are_read(self):
+        from logic import ocr_processor
+        from logic.ocr_processor import OcrText
+
+        with mock.patch.object(ocr_processor, "pdfinfo_from_path", return_value={"Pages": 120}), \
+             mock.patch.object(ocr_processor, "_ocr_pdf_pages", return_value={1: OcrText("", None, 1)}) as ocr:
+            ocr_processor.pdf_ocr("long.pdf", workers=1, max_pages=5)
+            self.assertEqual(ocr.call_args[0][1], [1, 2, 3, 4, 5])
+            ocr_processor.pdf_ocr("long.pdf", workers=1, max_pages=0)
+            self.assertEqual(len(ocr.call_args[0][1]), 120)
+            with mock.patch.object(ocr_processor, "PDF_MAX_PAGES", 50):
+                ocr_processor.pdf_ocr("long.pdf", workers=1)
+            self.assertEqual(ocr.call_args[0][1][-1], 50)
+
+    def test_text_layer_is_not_capped_like_ocr(self):
+        from logic import ocr_processor
+
+        pages = [mock.Mock(**{"extract_text.return_value": f"Statement page {n} with enough text"})
+                 for n in range(1, 121)]
+        pages[-1].extract_text.return_value = "Total due 1234.56 on the very last page"
+        for page in pages[:90]:
+            page.extract_text.return_value = ""  # scanned
+        reader = mock.Mock(is_encrypted=False, pages=pages)
+        with mock.patch.object(ocr_processor, "PdfReader", return_value=reader), \
+             mock.patch.object(ocr_processor, "PDF_MAX_PAGES", 50), \
+             mock.patch.object(ocr_processor, "_ocr_pdf_pages", return_value={}) as ocr:
+            result, source = ocr_processor.pdf_extract_text("statement.pdf")
+
+        self.assertEqual(source, "mixed")
+        self.assertIn("Total due 1234.56", result.text)
+        self.assertEqual(ocr.call_args[0][1], list(range(1, 51)))  # raster work stays capped
+
+class OcrParserTest(TestCase):
+    def test_tokenizer_classifies_lines(self):
+        from logic.ocr_processor import (
+            tokenize, extract_amounts, LINE_SUBTOTAL, LINE_TOTAL, LINE_VAT, LINE_VAT_NUMBER, LINE_VAT_RATE,
+        )
+        text = "ACME Ltd\nVAT No IE1234567X\n01/02/2025\nSubtotal 100.00\nVAT @ 23% 23.00\nTotal € 123.00\n"
+        parsed = tokenize(text)
+        self.assertEqual(parsed.kinds, [LINE_VAT_NUMBER, LINE_SUBTOTAL, LINE_VAT | LINE_VAT_RATE, LINE_TOTAL])
+        self.assertEqual(parsed.date, "01/02/2025")
+        self.assertEqual(extract_amounts(text, parsed), (123.0, 23.0))
+
+    def test_total_on_next_line(self):
+        from logic.ocr_processor import extract_amounts
+        self.assertEqual(extract_amounts("Amount due\nTOTAL\n€\n1.234,50\n"), (1234.5, 283.94))
+
+class RegionOcrTest(TestCase):
+    def _words(self):
+        from logic.ocr_engine import OcrWord
+        lines = ["ACME Ltd", "12 Main St", "Dublin", "Invoice", "Widgets x 3",
+                 "VAT 23.00", "Total 123.00", "Date 05/03/2025"]
+        tops = [10, 30, 50, 70, 200, 800, 815, 990]
+        return [OcrWord(text, 90, 0, top, 100, 10, (i,)) for i, (text, top) in enumerate(zip(lines, tops))]
+
+    def test_header_band_and_key_lines(self):
+        from logic.ocr_processor import find_regions
+        from logic.ocr_engine import OcrWord
+
+        # Header down to line 4 plus padding; VAT and Total overlap into one strip; clipped at the page.
+        self.assertEqual(find_regions(self._words(), (500, 1000)),
+                         [(0, 0, 500, 86), (0, 794, 500, 831), (0, 984, 500, 1000)])
+        self.assertEqual(find_regions([OcrWord("Widgets", 90, 0, 10, 100, 10, (0,))], (500, 1000)), [])
+
+    def test_roi_text_crops_full_resolution_regions(self):
+        from PIL import Image
+        from logic import ocr_processor
+
+        sizes = []
+        engine = mock.Mock()
+        engine.image_to_string.side_effect = lambda img: sizes.append(img.size) or f"strip {len(sizes)}"
+        with mock.patch.object(ocr_processor, "get_engine", return_value=engine):
+            text = ocr_processor._roi_text(self._words(), (500, 1000), Image.new("L", (2000, 4000), 255))
+
+        self.assertEqual(sizes, [(2000, 344), (2000, 148), (2000, 64)])
+        self.assertEqual(text, "strip 1\nstrip 2\nstrip 3")
+
+class NearDuplicateTest(TestCase):
+    def _receipt(self, lines):
+        from PIL import Image, ImageDraw
+        img = Image.new("L", (400, 600), 255)
+        draw = ImageDraw.Draw(img)
+        for i, line in enumerate(lines):
+            draw.rectangle((40, 40 + i * 60, 40 + len(line) * 20, 70 + i * 60), fill=0)
+        return img
+
+    def test_rephotographed_receipt_is_found(self):
+        import io
+        from PIL import Image
+        from logic.near_duplicates import dhash, find_near_duplicates, to_db
+        from logic.ocr_queue import placeholder_contact
+
+        user = User.objects.create_user(email="dup@example.com", password="pass")
+        original = self._receipt(["ACME", "Total 12.50", "VAT 2.34", "Thanks"])
+        first = Invoice.objects.create(
+            user=user, invoice_type="purchase", contact=placeholder_contact(user), invoice_number="OCR-1",
+            date=date.today(), image_hash=to_db(dhash(original)),
+        )
+
+        buf = io.BytesIO()
+        original.resize((300, 450)).save(buf, format="JPEG", quality=60)
+        buf.seek(0)
+        again = dhash(Image.open(buf))
+        self.assertEqual([inv.id for inv in find_near_duplicates(user, again)], [first.id])
+
+        other = dhash(self._receipt(["Tesco", "Milk", "Bread", "Eggs", "Total 4.10", "VAT 0.00"]))
+        self.assertEqual(find_near_duplicates(user, other), [])
+        stranger = User.objects.create_user(email="other@example.com", password="pass")
+        self.assertEqual(find_near_duplicates(stranger, again), [])
+
+    def test_photo_is_hashed_from_a_reduced_decode(self):
+        import io
+        from PIL import Image, ImageOps
+        from logic import near_duplicates
+
+        buf = io.BytesIO()
+        self._receipt(["ACME", "Total 12.50"]).resize((4000, 3000)).save(buf, format="JPEG")
+        buf.seek(0)
+        decoded, exif_transpose = [], ImageOps.exif_transpose
+        def transpose(img):
+            decoded.append(img.size)
+            return exif_transpose(img)
+        with mock.patch.object(near_duplicates.ImageOps, "exif_transpose", side_effect=transpose):
+            self.assertIsNotNone(near_duplicates.upload_dhash(buf))
+        self.assertLessEqual(max(decoded[0]), 4000 // 8)
+
+class LayoutTemplateTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="tpl@example.com", password="pass")
+        self.acme = Contact.objects.create(user=self.user, name="ACME Ltd", is_supplier=True)
+
+    def _confirmed(self, number, offset):
+        layout = [
+            {"text": "ACME Ltd", "top": 0.05, "bottom": 0.07},
+            {"text": "Date 05/03/2025", "top": 0.12 + offset, "bottom": 0.14 + offset},
+            {"text": "VAT @ 23% 23.00", "top": 0.80 + offset, "bottom": 0.82 + offset},
+            {"text": "Total 123.00", "top": 0.85 + offset, "bottom": 0.87 + offset},
+        ]
+        return Invoice.objects.create(
+            user=self.user, invoice_type="purchase", contact=self.acme, invoice_number=number,
+            date=date(2025, 3, 5), subtotal=Decimal("123.00"), vat_amount=Decimal("23.00"),
+            total=Decimal("146.00"), is_confirmed=True, ocr_data={"layout": layout},
+        )
+
+    def test_learn_and_find_template(self):
+        from logic.layout_templates import find_template, learn_template, maybe_learn_template
+        maybe_learn_template(self._confirmed("OCR-1", 0))
+        self.assertIsNone(find_template(self.user.id, "ACME LTD\nInvoice"))  # one sample is not enough
+
+        maybe_learn_template(self._confirmed("OCR-2", 0.01))
+        template = find_template(self.user.id, "ACME LTD\n12 Main St")
+        self.assertEqual(set(template["fields"]), {"date", "vat", "total"})
+        self.assertEqual(template["fields"]["total"], [0.835, 0.895])
+        self.assertIsNone(find_template(self.user.id, "Tesco Ireland"))
+        self.assertEqual(learn_template(self.acme), template)
+
+    def test_template_ocr_reads_only_the_boxes(self):
+        from PIL import Image
+        from logic import ocr_processor
+        from logic.ocr_engine import OcrWord
+
+        engine = mock.Mock()
+        engine.image_to_string.return_value = "ACME Ltd"
+        engine.image_to_data.return_value = [OcrWord("Total", 95, 0, 0, 10, 10, (1,)),
+                                             OcrWord("123.00", 95, 20, 0, 10, 10, (1,))]
+        template = {"fields": {"vat": [0.78, 0.83], "total": [0.82, 0.9]}}
+        img = Image.new("L", (1000, 1400), 255)
+        with mock.patch.object(ocr_processor, "get_engine", return_value=engine):
+            result = ocr_processor._template_ocr(img, 0.7, lambda header: template)
+
+        self.assertTrue(result.template)
+        self.assertEqual(engine.image_to_data.call_count, 1)  # overlapping boxes read once
+        crop = engine.image_to_data.call_args[0][0]
+        self.assertLess(crop.height, img.height // 4)
+        self.assertEqual(result.text, "ACME Ltd\nTotal 123.00")
+
+UBL_INVOICE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<Invoice xmlns="urn:oasis:names:specification:ubl:schema:xsd:Invoice-2"
+         xmlns:cac="urn:oasis:names:specification:ubl:schema:xsd:CommonAggregateComponents-2"
+         xmlns:cbc="urn:oasis:names:specification:ubl:schema:xsd:CommonBasicComponents-2">
+  <cbc:ID>INV-2025-0042</cbc:ID>
+  <cbc:IssueDate>2025-03-05</cbc:IssueDate>
+  <cbc:DocumentCurrencyCode>EUR</cbc:DocumentCurrencyCode>
+  <cac:AccountingSupplierParty><cac:Party>
+    <cac:PartyName><cbc:Name>ACME Supplies Ltd</cbc:Name></cac:PartyName>
+    <cac:PartyTaxScheme><cbc:CompanyID>IE1234567X</cbc:CompanyID></cac:PartyTaxScheme>
+  </cac:Party></cac:AccountingSupplierParty>
+  <cac:TaxTotal><cbc:TaxAmount currencyID="EUR">24.15</cbc:TaxAmount></cac:TaxTotal>
+  <cac:LegalMonetaryTotal>
+    <cbc:TaxExclusiveAmount currencyID="EUR">110.00</cbc:TaxExclusiveAmount>
+    <cbc:TaxInclusiveAmount currencyID="EUR">134.15</cbc:TaxInclusiveAmount>
+  </cac:LegalMonetaryTotal>
+  <cac:InvoiceLine>
+    <cbc:ID>1</cbc:ID><cbc:InvoicedQuantity unitCode="EA">2</cbc:InvoicedQuantity>
+    <cbc:LineExtensionAmount currencyID="EUR">100.00</cbc:LineExtensionAmount>
+    <cac:Item><cbc:Name>Toner cartridge</cbc:Name>
+      <cac:ClassifiedTaxCategory><cbc:Percent>23</cbc:Percent></cac:ClassifiedTaxCategory></cac:Item>
+    <cac:Price><cbc:PriceAmount currencyID="EUR">50.00</cbc:PriceAmount></cac:Price>
+  </cac:InvoiceLine>
+  <cac:InvoiceLine>
+    <cbc:ID>2</cbc:ID><cbc:InvoicedQuantity unitCode="EA">1</cbc:InvoicedQuantity>
+    <cbc:LineExtensionAmount currencyID="EUR">10.00</cbc:LineExtensionAmount>
+    <cac:Item><cbc:Name>Delivery</cbc:Name>
+      <cac:ClassifiedTaxCategory><cbc:Percent>11.5</cbc:Percent></cac:ClassifiedTaxCategory></cac:Item>
+    <cac:Price><cbc:PriceAmount currencyID="EUR">10.00</cbc:PriceAmount></cac:Price>
+  </cac:InvoiceLine>
+</Invoice>"""
+
+CII_INVOICE = b"""<?xml version="1.0" encoding="UTF-8"?>
+<rsm:CrossIndustryInvoice xmlns:rsm="urn:un:unece:uncefact:data:standard:CrossIndustryInvoice:100"
+    xmlns:ram="urn:un:unece:uncefact:data:standard:ReusableAggregateBusinessInformationEntity:100"
+    xmlns:udt="urn:un:unece:uncefact:data:standard:UnqualifiedDataType:100">
+  <rsm:ExchangedDocument><ram:ID>FX-7</ram:ID>
+    <ram:IssueDateTime><udt:DateTimeString format="102">20250214</udt:DateTimeString></ram:IssueDateTime>
+  </rsm:ExchangedDocument>
+  <rsm:SupplyChainTradeTransaction>
+    <ram:IncludedSupplyChainTradeLineItem>
+      <ram:SpecifiedTradeProduct><ram:Name>Consulting hours</ram:Name></ram:SpecifiedTradeProduct>
+      <ram:SpecifiedLineTradeAgreement><ram:NetPriceProductTradePrice>
+        <ram:ChargeAmount>80.00</ram:ChargeAmount></ram:NetPriceProductTradePrice></ram:SpecifiedLineTradeAgreement>
+      <ram:SpecifiedLineTradeDelivery><ram:BilledQuantity unitCode="HUR">3</ram:BilledQuantity></ram:SpecifiedLineTradeDelivery>
+      <ram:SpecifiedLineTradeSettlement>
+        <ram:ApplicableTradeTax><ram:RateApplicablePercent>23</ram:RateApplicablePercent></ram:ApplicableTradeTax>
+        <ram:SpecifiedTradeSettlementLineMonetarySummation>
+          <ram:LineTotalAmount>240.00</ram:LineTotalAmount></ram:SpecifiedTradeSettlementLineMonetarySummation>
+      </ram:SpecifiedLineTradeSettlement>
+    </ram:IncludedSupplyChainTradeLineItem>
+    <ram:ApplicableHeaderTradeAgreement><ram:SellerTradeParty><ram:Name>Liffey Consulting</ram:Name>
+      <ram:SpecifiedTaxRegistration><ram:ID schemeID="VA">IE7654321Y</ram:ID></ram:SpecifiedTaxRegistration>
+    </ram:SellerTradeParty></ram:ApplicableHeaderTradeAgreement>
+    <ram:ApplicableHeaderTradeSettlement><ram:InvoiceCurrencyCode>EUR</ram:InvoiceCurrencyCode>
+      <ram:SpecifiedTradeSettlementHeaderMonetarySummation>
+        <ram:TaxBasisTotalAmount>240.00</ram:TaxBasisTotalAmount>
+        <ram:TaxTotalAmount currencyID="EUR">55.20</ram:TaxTotalAmount>
+        <ram:GrandTotalAmount>295.20</ram:GrandTotalAmount>
+      </ram:SpecifiedTradeSettlementHeaderMonetarySummation>
+    </ram:ApplicableHeaderTradeSettlement>
+  </rsm:SupplyChainTradeTransaction>
+</rsm:CrossIndustryInvoice>"""
+
+class EInvoiceTest(TestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(email="einv@example.com", password="pass")
+
+    def test_ubl_maps_to_invoice_and_lines(self):
+        import io
+        from logic.einvoice import read_einvoice, save_einvoice
+
+        einvoice = read_einvoice(io.BytesIO(UBL_INVOICE))
+        self.assertEqual((einvoice.syntax, einvoice.number, einvoice.issue_date), ("ubl", "INV-2025-0042", date(2025, 3, 5)))
+        with mock.patch("logic.data_manager.save_invoice"):
+            invoice, created = save_einvoice(self.user, einvoice)
+            again, created_again = save_einvoice(self.user, einvoice)
+
+        self.assertTrue(created)
+        self.assertFalse(created_again)
+        self.assertEqual(again.id, invoice.id)
+        self.assertEqual((invoice.subtotal, invoice.vat_amount, invoice.total),
+                         (Decimal("110.00"), Decimal("24.15"), Decimal("134.15")))
+        self.assertEqual(invoice.contact.tax_id, "IE1234567X")
+        self.assertEqual(list(invoice.lines.values_list("description", "quantity", "unit_price", "vat_rate")), [
+            ("Toner cartridge", Decimal("2.00"), Decimal("50.00"), Decimal("23.00")),
+            ("Delivery", Decimal("1.00"), Decimal("10.00"), Decimal("11.50")),
+        ])
+        self.assertFalse(OcrJob.objects.exists())
+
+    def test_cii_embedded_in_pdf(self):
+        import io
+        from PyPDF2 import PdfWriter
+        from logic.einvoice import read_einvoice
+
+        writer = PdfWriter()
+        writer.add_blank_page(width=595, height=842)
+        writer.add_attachment("factur-x.xml", CII_INVOICE)
+        pdf = io.BytesIO()
+        writer.write(pdf)
+
+        einvoice = read_einvoice(pdf)
+        self.assertEqual(pdf.tell(), 0)
+        self.assertEqual((einvoice.syntax, einvoice.number, einvoice.supplier), ("cii", "FX-7", "Liffey Consulting"))
+        self.assertEqual((einvoice.subtotal, einvoice.vat, einvoice.total),
+                         (Decimal("240.00"), Decimal("55.20"), Decimal("295.20")))
+        self.assertEqual(einvoice.lines[0].unit_price, Decimal("80.00"))
+        self.assertIsNone(read_einvoice(io.BytesIO(b"%PDF-1.4 not an e-invoice")))
+
+LOCMEM_CACHE = {"default": {"BACKEND": "django.core.cache.backends.locmem.LocMemCache", "LOCATION": "admission-tests"}}
+
+@override_settings(CACHES=LOCMEM_CACHE, OCR_MAX_ACTIVE_JOBS=1000)
+class AdmissionTest(TestCase):
+    def setUp(self):
+        from django.core.cache import cache
+        cache.clear()
+
+    def test_concurrent_burst_is_capped(self):
+        import threading
+        from logic.admission import take_token
+
+        results = []
+        start = threading.Barrier(20)
+
+        def upload():
+            start.wait()
+            results.append(take_token("upload-bucket:burst", burst=5, per_minute=1))
+
+        threads = [threading.Thread(target=upload) for _ in range(20)]
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+
+        self.assertEqual(sum(1 for wait in results if wait == 0), 5)
+        self.assertTrue(all(wait > 0 for wait in results if wait))
+
+    def test_upload_view_returns_429(self):
+        from logic.plan_tiers import UPLOAD_LIMITS
+        user = User.objects.create_user(email="burst@example.com", password="pass")
+        self.client.force_login(user)
+
+        burst = UPLOAD_LIMITS["lite"]["burst"]
+        codes = [self.client.post("/invoice/upload/").status_code for _ in range(burst + 1)]
+        self.assertEqual(codes[:burst], [302] * burst)  # no file: redirected, token spent
+        response = self.client.post("/invoice/upload/")
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response["Retry-After"]), 1)
+
+        with override_settings(OCR_MAX_ACTIVE_JOBS=0):
+            from django.core.cache import cache
+            cache.delete("ocr-active-jobs")
+            other = User.objects.create_user(email="elite@example.com", password="pass", plan="elite")
+            self.client.force_login(other)
+            self.assertEqual(self.client.post("/invoice/upload/").status_code, 429)
+
+    def test_rejected_before_body_is_read(self):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from django.test import Client
+        from logic.admission import take_token
+        from logic.plan_tiers import UPLOAD_LIMITS
+
+        user = User.objects.create_user(email="csrf@example.com", password="pass")
+        client = Client(enforce_csrf_checks=True)  # CsrfViewMiddleware parses the body
+        client.force_login(user)
+        for _ in range(UPLOAD_LIMITS["lite"]["burst"]):
+            take_token(f"upload-bucket:{user.pk}", UPLOAD_LIMITS["lite"]["burst"], UPLOAD_LIMITS["lite"]["per_minute"])
+
+        upload = SimpleUploadedFile("receipt.pdf", b"%PDF-1.4 " + b"x" * 1000)
+        with mock.patch("budsi_django.upload_handlers.InvoiceUploadHandler.new_file",
+                        side_effect=AssertionError("body read")):
+            response = client.post("/invoice/upload/", {"file": upload})
+        self.assertEqual(response.status_code, 429)  # not 403 from CSRF, which would read the body
+
+    def test_lock_contention_waits_instead_of_rejecting(self):
+        from django.core.cache import cache
+        from logic.admission import take_token
+
+        cache.add("upload-bucket:busy:lock", 1, 1)  # another request of the user holds it
+        self.assertEqual(take_token("upload-bucket:busy", burst=5, per_minute=1), 0)
+
+class UploadHandlerTest(TestCase):
+    def setUp(self):
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media, CACHES=LOCMEM_CACHE)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        from django.core.cache import cache
+        cache.clear()
+        self.user = User.objects.create_user(email="upload@example.com", password="pass")
+        self.client.force_login(self.user)
+
+    def _upload(self, name, data):
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        return self.client.post("/invoice/upload/", {"file": SimpleUploadedFile(name, data)}, follow=True)
+
+    def test_hash_and_kind_computed_while_streaming(self):
+        import hashlib
+        with mock.patch("logic.data_manager.save_invoice"), \
+                mock.patch("logic.ocr_cache.hashlib") as view_hashlib:
+            self._upload("invoice.xml", UBL_INVOICE)
+
+        view_hashlib.sha256.assert_not_called()
+        invoice = Invoice.objects.get(user=self.user)
+        self.assertEqual(invoice.content_hash, hashlib.sha256(UBL_INVOICE).hexdigest())
+        self.assertEqual(invoice.invoice_number, "INV-2025-0042")
+
+    def test_rejects_unknown_type_and_oversized_files(self):
+        response = self._upload("invoice.pdf", b"MZ\x90\x00 not really a pdf")
+        self.assertContains(response, "is not a PDF, image or XML invoice")
+        self.assertContains(self._upload("tiny.pdf", b"MZ"), "is not a PDF, image or XML invoice")
+
+        with override_settings(UPLOAD_MAX_MB=0):
+            response = self._upload("big.pdf", b"%PDF-1.4" + b"0" * 1024)
+        self.assertContains(response, "is larger than 0 MB")
+        self.assertFalse(Invoice.objects.exists())
+
+    def test_rejects_xml_that_is_not_an_einvoice(self):
+        response = self._upload("page.html", b"<html><body>Invoice</body></html>")
+        self.assertContains(response, "is not a supported e-invoice")
+        self.assertFalse(Invoice.objects.exists())
+        self.assertFalse(OcrJob.objects.exists())
+
+class IngestTest(TestCase):
+    def test_photo_is_rotated_downscaled_and_archived(self):
+        import io
+        import tempfile
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+        from logic.ingest import ingest_image
+
+        img = Image.effect_noise((4000, 3000), 40).convert("RGB")
+        exif = Image.Exif()
+        exif[0x0112] = 6  # shot sideways: rotate 90° clockwise to view
+        buf = io.BytesIO()
+        img.save(buf, "JPEG", quality=95, exif=exif)
+        upload = SimpleUploadedFile("IMG_0001.JPG", buf.getvalue())
+
+        with tempfile.TemporaryDirectory() as archive, \
+                override_settings(INGEST_MAX_SIDE=2000, INGEST_ARCHIVE_ORIGINALS=True, ARCHIVE_ROOT=archive):
+            stored = ingest_image(upload, 7, "abc123")
+            with open(f"{archive}/user_7/abc123.jpg", "rb") as original:
+                self.assertEqual(original.read(), buf.getvalue())
+
+        self.assertEqual(stored.name, "IMG_0001.jpg")
+        self.assertLess(stored.size, upload.size)
+        with Image.open(stored) as normalized:
+            self.assertEqual(normalized.size, (1500, 2000))
+            self.assertNotIn(0x0112, normalized.getexif())
+
+    def test_unreadable_or_small_images_are_kept(self):
+        import io
+        from django.core.files.uploadedfile import SimpleUploadedFile
+        from PIL import Image
+        from logic.ingest import ingest_image
+
+        buf = io.BytesIO()
+        Image.new("L", (300, 200), 255).save(buf, "PNG")
+        small = SimpleUploadedFile("tiny.png", buf.getvalue())
+        self.assertIs(ingest_image(small, 1, "h"), small)
+        broken = SimpleUploadedFile("broken.jpg", b"\xff\xd8\xff not a jpeg")
+        self.assertIs(ingest_image(broken, 1, "h"), broken)
+
+class UserMediaMixin:
+    """Logged-in user with a throwaway MEDIA_ROOT."""
+
+    def setUp(self):
+        import shutil
+        import tempfile
+        media = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, media, ignore_errors=True)
+        settings = override_settings(MEDIA_ROOT=media)
+        settings.enable()
+        self.addCleanup(settings.disable)
+        self.user = User.objects.create_user(email="thumbs@example.com", password="pass")
+        self.client.force_login(self.user)
+
+    def _invoice(self, name, data):
+        from django.core.files.base import ContentFile
+        contact, _ = Contact.objects.get_or_create(user=self.user, name="Supplier")
+        return Invoice.objects.create(
+            user=self.user, contact=contact, invoice_type="purchase",
+            invoice_number=f"{name}-{Invoice.objects.count()}",
+            date=date(2025, 1, 1), subtotal=0, vat_amount=0, total=0,
+            original_file=ContentFile(data, name=name), content_hash="f" * 64,
+        )
+
+class RenditionTest(UserMediaMixin, TestCase):
+    def test_small_rendition_is_cached_and_revalidated(self):
+        import io
+        from django.core.files.storage import default_storage
+        from PIL import Image
+        from logic.renditions import rendition_name
+
+        buf = io.BytesIO()
+        Image.effect_noise((2400, 3200), 40).save(buf, "PNG")
+        invoice = self._invoice("receipt.png", buf.getvalue())
+        url = f"/invoices/{invoice.id}/rendition/small/"
+
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        body = b"".join(response.streaming_content)
+        self.assertLess(len(body), 50_000)
+        with Image.open(io.BytesIO(body)) as thumb:
+            self.assertEqual(thumb.size, (240, 320))
+        self.assertTrue(default_storage.exists(rendition_name(invoice, "small")))
+
+        again = self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"])
+        self.assertEqual(again.status_code, 304)
+
+        invoice.content_hash = "e" * 64  # original replaced: new key
+        invoice.save()
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=response["ETag"]).status_code, 200)
+
+    def test_no_rendition_for_xml_or_other_users(self):
+        xml = self._invoice("einvoice.xml", UBL_INVOICE)
+        self.assertEqual(self.client.get(f"/invoices/{xml.id}/rendition/small/").status_code, 404)
+
+        other = User.objects.create_user(email="other@example.com", password="pass")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(f"/invoices/{xml.id}/rendition/medium/").status_code, 404)
+
+class MediaViewTest(UserMediaMixin, TestCase):
+    def test_owner_gets_ranges_and_304s(self):
+        import hashlib
+        data = b"%PDF-1.4 " + bytes(range(256)) * 40
+        invoice = self._invoice("big.pdf", data)
+        url = invoice.original_file.url
+
+        full = self.client.get(url)
+        self.assertEqual(full.status_code, 200)
+        self.assertEqual(b"".join(full.streaming_content), data)
+        self.assertEqual(full["Accept-Ranges"], "bytes")
+
+        part = self.client.get(url, HTTP_RANGE="bytes=100-199")
+        self.assertEqual(part.status_code, 206)
+        self.assertEqual(part["Content-Range"], f"bytes 100-199/{len(data)}")
+        self.assertEqual(b"".join(part.streaming_content), data[100:200])
+        tail = self.client.get(url, HTTP_RANGE="bytes=-10")
+        self.assertEqual(b"".join(tail.streaming_content), data[-10:])
+        self.assertEqual(self.client.get(url, HTTP_RANGE=f"bytes={len(data)}-").status_code, 416)
+
+        self.assertEqual(self.client.get(url, HTTP_IF_NONE_MATCH=full["ETag"]).status_code, 304)
+
+        with override_settings(MEDIA_ACCEL="nginx"):
+            offloaded = self.client.get(url)
+        blob = invoice.original_file.storage.blob_name(hashlib.sha256(data).hexdigest())
+        self.assertEqual(offloaded["X-Accel-Redirect"], "/protected-media/" + blob)
+        self.assertEqual(offloaded["Content-Type"], "application/pdf")
+        self.assertEqual(offloaded.content, b"")
+
+    def test_other_users_and_anonymous_are_refused(self):
+        invoice = self._invoice("mine.pdf", b"%PDF-1.4 secret")
+        url = invoice.original_file.url
+
+        self.client.logout()
+        self.assertEqual(self.client.get(url).status_code, 302)  # to login
+        other = User.objects.create_user(email="snoop@example.com", password="pass")
+        self.client.force_login(other)
+        self.assertEqual(self.client.get(url).status_code, 404)
+        self.assertEqual(self.client.get("/media/../budsi_django/settings.py").status_code, 404)
+
+class ContentAddressedStorageTest(UserMediaMixin, TestCase):
+    def test_identical_files_share_one_blob(self):
+        import os
+        from .models import BlobAlias, StoredBlob
+
+        first = self._invoice("ticket.jpg", b"same bytes")
+        second = self._invoice("ticket.jpg", b"same bytes")
+        storage = first.original_file.storage
+
+        self.assertNotEqual(first.original_file.name, second.original_file.name)
+        self.assertEqual(first.original_file.path, second.original_file.path)
+        self.assertEqual(StoredBlob.objects.get().refcount, 2)
+        with second.original_file.open("rb") as f:
+            self.assertEqual(f.read(), b"same bytes")
+
+        storage.delete(first.original_file.name)
+        self.assertTrue(os.path.exists(second.original_file.path))
+        storage.delete(second.original_file.name)
+        self.assertFalse(StoredBlob.objects.exists() or BlobAlias.objects.exists())
+        self.assertFalse(os.path.exists(first.original_file.path))
+
+    def _png(self, color):
+        import io
+        from PIL import Image
+        buf = io.BytesIO()
+        Image.new("RGB", (800, 600), color).save(buf, "PNG")
+        return buf.getvalue()
+
+    def test_deleting_or_replacing_the_row_releases_the_blob(self):
+        import os
+        from django.core.files.base import ContentFile
+        from logic.renditions import get_rendition
+        from .models import BlobAlias, StoredBlob
+
+        invoice = self._invoice("receipt.png", self._png("white"))
+        blob_path = invoice.original_file.path
+        self.assertTrue(get_rendition(invoice, "small"))
+        self.assertEqual(StoredBlob.objects.count(), 2)  # original and rendition
+
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.original_file = ContentFile(self._png("black"), name="receipt.png")
+            invoice.save()
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertEqual(list(BlobAlias.objects.values_list("name", flat=True)), [invoice.original_file.name])
+        self.assertEqual(StoredBlob.objects.get().refcount, 1)
+
+        blob_path = invoice.original_file.path
+        with self.captureOnCommitCallbacks(execute=True):
+            invoice.delete()
+        self.assertFalse(os.path.exists(blob_path))
+        self.assertFalse(StoredBlob.objects.exists() or BlobAlias.objects.exists())
+
+    def test_renditions_of_an_old_version_are_removed(self):
+        from django.core.files.storage import default_storage
+        from logic import renditions
+
+        invoice = self._invoice("receipt.png", self._png("white"))
+        old_small = renditions.get_rendition(invoice, "small")
+        medium = renditions.get_rendition(invoice, "medium")
+        with mock.patch.object(renditions, "RENDITION_VERSION", renditions.RENDITION_VERSION + 1):
+            new_small = renditions.get_rendition(invoice, "small")
+        self.assertNotEqual(new_small, old_small)
+        self.assertFalse(default_storage.exists(old_small))
+        self.assertTrue(default_storage.exists(new_small) and default_storage.exists(medium))
+
+    def test_legacy_files_are_read_and_adopted(self):
+        import io
+        import os
+        from django.conf import settings
+        from django.core.management import call_command
+        from .models import StoredBlob
+
+        legacy = "invoices/user_1/old.pdf"
+        os.makedirs(os.path.join(settings.MEDIA_ROOT, "invoices/user_1"))
+        with open(os.path.join(settings.MEDIA_ROOT, legacy), "wb") as f:
+            f.write(b"%PDF-1.4 legacy")
+        invoice = self._invoice("new.pdf", b"%PDF-1.4 legacy")
+        Invoice.objects.filter(id=invoice.id).update(original_file=legacy)
+        invoice.refresh_from_db()
+        with invoice.original_file.open("rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 legacy")
+
+        call_command("media_dedupe", stdout=io.StringIO())
+        self.assertFalse(os.path.exists(os.path.join(settings.MEDIA_ROOT, legacy)))
+        self.assertEqual(StoredBlob.objects.get().refcount, 2)
+        invoice.refresh_from_db()
+        with invoice.original_file.open("rb") as f:
+            self.assertEqual(f.read(), b"%PDF-1.4 legacy")
+
+    def test_ocr_queue_reads_pdf_blob_as_pdf(self):
+        import io
+        from reportlab.pdfgen import canvas
+        from logic.ocr_queue import enqueue_invoice, process_next
+
+        buf = io.BytesIO()
+        c = canvas.Canvas(buf)
+        for y, line in enumerate(["ACME Supplies Ltd", "Date: 05/03/2025", "VAT @ 23% 23.00", "Total 123.00"]):
+            c.drawString(50, 800 - y * 20, line)
+        c.save()
+        invoice = self._invoice("inv.pdf", buf.getvalue())
+        self.assertFalse(invoice.original_file.path.endswith(".pdf"))  # a blob
+
+        enqueue_invoice(invoice)
+        with mock.patch("logic.ocr_processor.image_ocr") as image_ocr, \
+             mock.patch("logic.data_manager.save_invoice"):
+            process_next("test", invoice=invoice)
+        image_ocr.assert_not_called()
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.ocr_data["text_source"], "text_layer")
+        self.assertEqual(invoice.subtotal, Decimal("123.00"))
+
+class LedgerKeyIndexTest(TestCase):
+    def setUp(self):
+        import os
+        import tempfile
+        from logic import data_manager
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        self.addCleanup(os.chdir, os.getcwd())
+        os.chdir(tmp.name)
+        data_manager._key_cache.clear()
+        self.addCleanup(data_manager._key_cache.clear)
+
+    def test_duplicates_checked_without_rereading_csv(self):
+        from logic import data_manager
+        from logic.data_manager import save_invoice
+
+        row = {"supplier": "ACME, Ltd", "date": "05/03/2025", "total": "134.15"}
+        self.assertTrue(save_invoice(row, "purchase"))
+        self.assertTrue(save_invoice({**row, "total": "10"}, "purchase"))
+        with mock.patch.object(data_manager, "_read_csv", side_effect=AssertionError("CSV re-read")):
+            self.assertFalse(save_invoice(row, "purchase"))
+            data_manager._key_cache.clear()  # another process: loads the sidecar
+            self.assertFalse(save_invoice({**row, "total": "10.00"}, "purchase"))
+        self.assertEqual(len(data_manager.load_data("purchases.csv")), 2)
+
+    def test_index_rebuilt_when_csv_changes(self):
+        from logic import data_manager
+        from logic.data_manager import save_invoice
+
+        row = {"supplier": "Cafe Nero", "date": "01/02/2025", "total": "4.50"}
+        self.assertTrue(save_invoice(row, "purchase"))
+        with open("purchases.csv", "w", encoding="utf-8") as f:  # edited by hand
+            f.write("supplier,date,total,description\nTesco,02/02/2025,20.00,\n")
+
+        self.assertTrue(save_invoice(row, "purchase"))
+        self.assertFalse(save_invoice({"supplier": "Tesco", "date": "02/02/2025", "total": "20"}, "purchase"))
+        self.assertEqual(data_manager.ledger_keys("purchases.csv"),
+                         {("Tesco", "02/02/2025", "20.00"), ("Cafe Nero", "01/02/2025", "4.50")})
+
+    def test_parallel_writers_do_not_interleave(self):
+        import multiprocessing
+        from logic import data_manager
+
+        # 4 processes x 2 threads, overlapping rows: every row saved exactly once.
+        ctx = multiprocessing.get_context("fork")
+        procs = [ctx.Process(target=_ledger_writer_process, args=(p,)) for p in range(4)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join(30)
+            self.assertEqual(p.exitcode, 0)
+
+        with open("purchases.csv", encoding="utf-8") as f:
+            self.assertEqual(f.read().count("supplier,date,total"), 1)
+        rows = data_manager.load_data("purchases.csv")
+        keys = [(r["supplier"], r["total"]) for r in rows]
+        self.assertEqual(len(keys), len(set(keys)))
+        self.assertEqual(set(keys), {(f"Supplier {i}", f"{i + 1}.00") for i in range(300)})
+        self.assertEqual(data_manager.ledger_keys("purchases.csv"), {(s, "01/01/2025", t) for s, t in keys})
+
+def _ledger_writer_process(offset):
+    import threading
+    from logic.data_manager import save_invoice, save_invoices
+
+    def write(start):
+        for i in range(start, 300, 25):
+            batch = [{"supplier": f"Supplier {j}", "date": "01/01/2025", "total": j + 1} for j in range(i, min(i + 25, 300))]
+            save_invoices(batch, "purchase")
+            save_invoice(batch[0], "purchase")
+
+    threads = [threading.Thread(target=write, args=(offset * 5 + t * 10,)) for t in range(2)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+class TaxReportTest(TestCase):
+    def _invoice(self, user, number, invoice_type, day, subtotal, vat, confirmed=True, lines=()):
+        from .models import InvoiceLine
+        contact, _ = Contact.objects.get_or_create(user=user, name="ACME")
+        invoice = Invoice.objects.create(
+            user=user, contact=contact, invoice_number=number, invoice_type=invoice_type, date=day,
+            subtotal=Decimal(subtotal), vat_amount=Decimal(vat), total=Decimal(subtotal) + Decimal(vat),
+            is_confirmed=confirmed,
+        )
+        for quantity, price, rate in lines:
+            InvoiceLine.objects.create(invoice=invoice, description="Item", quantity=Decimal(quantity),
+                                       unit_price=Decimal(price), vat_rate=Decimal(rate))
+        return invoice
+
+    def test_report_from_confirmed_invoices(self):
+        from logic.tax_report import build_tax_report
+
+        user = User.objects.create_user(email="report@example.com", password="pass")
+        other = User.objects.create_user(email="other@example.com", password="pass")
+        self._invoice(user, "S1", "sale", date(2025, 3, 1), "100000", "23000")
+        self._invoice(user, "P1", "purchase", date(2025, 4, 1), "250", "52.75",
+                      lines=[("2", "100", "23.00"), ("1", "50", "13.50")])
+        self._invoice(user, "P2", "purchase", date(2025, 4, 2), "999", "0", confirmed=False)
+        self._invoice(user, "P3", "purchase", date(2024, 12, 31), "999", "0")
+        self._invoice(other, "S1", "sale", date(2025, 3, 1), "999", "0")
+
+        with self.assertNumQueries(3):  # sums by type, by VAT rate, and of unitemised invoices
+            report = build_tax_report(user, date(2025, 1, 1), date(2025, 12, 31))
+
+        self.assertEqual(report["sales_totals"]["count"], 1)
+        self.assertEqual(report["sales_totals"]["net"], Decimal("100000.00"))
+        self.assertEqual(report["sales_rates"], [{"rate": None, "count": 1, "net": Decimal("100000.00"),
+                                                  "vat": Decimal("23000.00"), "gross": Decimal("123000.00")}])
+        self.assertEqual([(r["rate"], r["count"], r["net"], r["vat"]) for r in report["purchase_rates"]],
+                         [(Decimal("23.00"), 1, Decimal("200.00"), Decimal("46.00")),
+                          (Decimal("13.50"), 1, Decimal("50.00"), Decimal("6.75"))])
+        self.assertEqual(report["tax_data"]["vat"], {"collected": 23000.0, "paid": 52.75, "liability": 22947.25})
+        self.assertEqual(report["tax_data"]["income"]["taxable"], 99750.0)
+
+    def test_rate_rows_add_up_to_the_totals(self):
+        from logic.tax_report import build_tax_report
+
+        user = User.objects.create_user(email="report@example.com", password="pass")
+        # 10.00 document-level allowance: in the header, not in the lines.
+        self._invoice(user, "P1", "purchase", date(2025, 4, 1), "90", "20.70", lines=[("1", "100", "23.00")])
+        self._invoice(user, "P2", "purchase", date(2025, 4, 2), "40", "9.20")
+
+        report = build_tax_report(user, date(2025, 1, 1), date(2025, 12, 31))
+        rows = report["purchase_rates"]
+        self.assertEqual(rows[-1], {"rate": None, "adjustment": True, "count": None, "net": Decimal("-10.00"),
+                                    "vat": Decimal("-2.30"), "gross": Decimal("-12.30")})
+        for key in ("net", "vat", "gross"):
+            self.assertEqual(sum(r[key] for r in rows), report["purchase_totals"][key])
+        self.assertEqual(report["sales_rates"], [])
+
+    def test_report_view_renders(self):
+        user = User.objects.create_user(email="report@example.com", password="pass")
+        self._invoice(user, "S1", "sale", date(2025, 1, 1), "100000", "23000")
+        self._invoice(user, "P1", "purchase", date(2025, 1, 1), "1000", "230", lines=[("1", "1000", "23.00")])
+        self.client.force_login(user)
+
+        response = self.client.get("/budsi/report/", {"start": "2025-01-01", "end": "2025-12-31"})
+        self.assertContains(response, "Not itemised")   # the sale has no lines
+        self.assertContains(response, "23.00%")
+        self.assertContains(response, "€1000.00</td>", count=2)  # purchase rate row and totals
+        self.assertContains(response, "€55000.00")      # excess over the first band
+
+        response = self.client.get("/budsi/report/", {"start": "2025-12-31", "end": "2025-01-01"})
+        self.assertContains(response, "The start date must be before the end date.")
@@ -48,4 +48,16 @@ class InvoiceForm(forms.ModelForm):
         user = kwargs.pop("user", None)
         super().__init__(*args, **kwargs)
         if user is not None:
-            self.fields["contact"].queryset = Contact.objects.filter(user=user)
\ No newline at end of file
+            self.fields["contact"].queryset = Contact.objects.filter(user=user)
+
+
+class TaxReportPeriodForm(forms.Form):
+    start = forms.DateField(widget=forms.DateInput(attrs={"type": "date"}))
+    end = forms.DateField(widget=forms.DateInput(attrs={"type": "date"}))
+
+    def clean(self):
+        cleaned = super().clean()
+        start, end = cleaned.get("start"), cleaned.get("end")
+        if start and end and start > end:
+            raise forms.ValidationError("The start date must be before the end date.")
+        return cleaned
@@ -0,0 +1,146 @@
+import mimetypes
+import os
+import re
+from typing import Optional, Tuple
+
+from django.conf import settings
+from django.contrib.auth.decorators import login_required
+from django.core.exceptions import SuspiciousFileOperation
+from django.core.files.storage import default_storage
+from django.http import (
+    FileResponse, Http404, HttpResponse, HttpResponseNotModified, StreamingHttpResponse,
+)
+from django.utils.http import http_date, parse_http_date_safe
+
+from budsi_database.models import FiscalProfile, Invoice
+
+# Constantes
+STREAM_CHUNK = 64 * 1024
+BYTE_RANGE = re.compile(r"^bytes=(\d*)-(\d*)$")
+
+# =============================================================================
+# Ownership
+# =============================================================================
+
+def user_owns(user, name: str) -> bool:
+    """
+    True if `name` (a path relative to MEDIA_ROOT) is the user's invoice
+    original, a rendition of one, or the user's fiscal profile logo.
+    """
+    if user.is_superuser:
+        return True
+    invoices = Invoice.objects.filter(user=user)
+    folder, filename = os.path.split(name)
+    if os.path.basename(folder) == "renditions":
+        # <dir>/renditions/<stem>.<size>.<key>.jpg (logic/renditions.py)
+        stem = filename.rsplit(".", 3)[0]
+        prefix = f"{os.path.dirname(folder)}/{stem}."
+        return invoices.filter(original_file__startswith=prefix).exists()
+    return (
+        invoices.filter(original_file=name).exists()
+        or FiscalProfile.objects.filter(user=user, logo=name).exists()
+    )
+
+# =============================================================================
+# Serving
+# =============================================================================
+
+def _etag(stat: os.stat_result) -> str:
+    return f'"{stat.st_mtime_ns:x}-{stat.st_size:x}"'
+
+def parse_range(header: str, size: int) -> Optional[Tuple[int, int]]:
+    """
+    (first, last) byte of a single 'bytes=a-b' range, clamped to the file.
+    None if the header is absent or not a single range we can honour
+    (then the whole file is sent); raises ValueError if it is unsatisfiable.
+    """
+    match = BYTE_RANGE.match(header.strip()) if header else None
+    if not match or match.groups() == ("", ""):
+        return None
+    first, last = match.groups()
+    if first == "":  # suffix: the last N bytes
+        length = int(last)
+        if length == 0:
+            raise ValueError("empty suffix range")
+        return max(0, size - length), size - 1
+    first = int(first)
+    last = min(int(last), size - 1) if last else size - 1
+    if first >= size or first > last:
+        raise ValueError("range not satisfiable")
+    return first, last
+
+def _read_range(path: str, first: int, last: int):
+    with open(path, "rb") as f:
+        f.seek(first)
+        remaining = last - first + 1
+        while remaining > 0:
+            chunk = f.read(min(STREAM_CHUNK, remaining))
+            if not chunk:
+                break
+            remaining -= len(chunk)
+            yield chunk
+
+def serve_file(request, name: str) -> HttpResponse:
+    """
+    Send MEDIA_ROOT/name. With MEDIA_ACCEL="nginx" (X-Accel-Redirect) or
+    "sendfile" (X-Sendfile, Apache/lighttpd) only the headers are produced
+    and the proxy sends the bytes; otherwise the file is streamed here with
+    ETag/If-None-Match, If-Modified-Since and single byte ranges.
+    """
+    try:
+        # Physical path: a content-addressed blob or an old-style file.
+        path = default_storage.path(name)
+        stat = os.stat(path)
+    except (OSError, SuspiciousFileOperation):
+        raise Http404("File not found")
+    # From the logical name: blobs have no extension.
+    content_type = mimetypes.guess_type(name)[0] or "application/octet-stream"
+
+    if settings.MEDIA_ACCEL == "nginx":
+        response = HttpResponse(content_type=content_type)
+        relative = os.path.relpath(path, settings.MEDIA_ROOT).replace(os.sep, "/")
+        response["X-Accel-Redirect"] = settings.MEDIA_ACCEL_PREFIX + relative
+        return response
+    if settings.MEDIA_ACCEL == "sendfile":
+        response = HttpResponse(content_type=content_type)
+        response["X-Sendfile"] = path
+        return response
+
+    etag = _etag(stat)
+    modified = parse_http_date_safe(request.headers.get("If-Modified-Since", ""))
+    if request.headers.get("If-None-Match") == etag or (
+        "If-None-Match" not in request.headers and modified and int(stat.st_mtime) <= modified
+    ):
+        response = HttpResponseNotModified()
+    else:
+        try:
+            byte_range = parse_range(request.headers.get("Range", ""), stat.st_size)
+        except ValueError:
+            response = HttpResponse(status=416)
+            response["Content-Range"] = f"bytes */{stat.st_size}"
+            return response
+        # A stale If-Range (the file changed) means: send all of it.
+        if_range = request.headers.get("If-Range")
+        if byte_range and if_range and if_range != etag:
+            byte_range = None
+
+        if byte_range is None:
+            response = FileResponse(open(path, "rb"), content_type=content_type)
+        else:
+            first, last = byte_range
+            response = StreamingHttpResponse(_read_range(path, first, last), status=206, content_type=content_type)
+            response["Content-Range"] = f"bytes {first}-{last}/{stat.st_size}"
+            response["Content-Length"] = str(last - first + 1)
+        response["Accept-Ranges"] = "bytes"
+
+    response["ETag"] = etag
+    response["Last-Modified"] = http_date(stat.st_mtime)
+    response["Cache-Control"] = "private, no-cache"
+    return response
+
+@login_required
+def media_view(request, name):
+    """MEDIA_URL/<name> for the owner only (404 otherwise, so paths are not probed)."""
+    if not user_owns(request.user, name):
+        raise Http404("File not found")
+    return serve_file(request, name)
@@ -51,6 +51,8 @@ MIDDLEWARE = [
     "django.middleware.common.CommonMiddleware",
     "django.middleware.csrf.CsrfViewMiddleware",
     "django.contrib.auth.middleware.AuthenticationMiddleware",
+    # Límite de subidas: responde 429 antes de que CSRF lea el cuerpo.
+    "logic.admission.UploadAdmissionMiddleware",
     "django.contrib.messages.middleware.MessageMiddleware",
     "django.middleware.clickjacking.XFrameOptionsMiddleware",
 ]
@@ -118,15 +120,70 @@ STATIC_URL = "/static/"
 STATICFILES_DIRS = [BASE_DIR / "static"]
 STATIC_ROOT = BASE_DIR / "staticfiles"
 
-# AÑADIR ESTA CONFIGURACIÓN PARA WHITENOISE
-STATICFILES_STORAGE = "whitenoise.storage.CompressedManifestStaticFilesStorage"
+# Ficheros subidos: cada contenido se guarda una sola vez en media/blobs/
+# (budsi_django/storage.py); los modelos siguen usando nombres lógicos.
+# Estáticos comprimidos y con hash en el nombre (WhiteNoise).
+STORAGES = {
+    "default": {"BACKEND": "budsi_django.storage.ContentAddressedStorage"},
+    "staticfiles": {"BACKEND": "whitenoise.storage.CompressedManifestStaticFilesStorage"},
+}
 
 MEDIA_URL = "/media/"
 MEDIA_ROOT = BASE_DIR / "media"
+# MEDIA se sirve siempre por budsi_django/media.py (solo al dueño del fichero).
+# MEDIA_ACCEL="nginx" delega el envío con X-Accel-Redirect (location internal
+# en MEDIA_ACCEL_PREFIX apuntando a MEDIA_ROOT); "sendfile" usa X-Sendfile.
+MEDIA_ACCEL = os.getenv("MEDIA_ACCEL", "")
+MEDIA_ACCEL_PREFIX = os.getenv("MEDIA_ACCEL_PREFIX", "/protected-media/")
+
+# SUBIDAS - se escriben por trozos a un fichero temporal mientras se calcula
+# el hash y se comprueban tamaño y tipo (budsi_django/upload_handlers.py).
+# Si FILE_UPLOAD_TEMP_DIR está en el mismo disco que MEDIA_ROOT, guardar el
+# fichero es un simple rename.
+FILE_UPLOAD_HANDLERS = ["budsi_django.upload_handlers.InvoiceUploadHandler"]
+FILE_UPLOAD_TEMP_DIR = os.getenv("FILE_UPLOAD_TEMP_DIR") or None
+UPLOAD_MAX_MB = int(os.getenv("UPLOAD_MAX_MB", "20"))
+
+# Las fotos de tickets se giran según EXIF, se limitan a INGEST_MAX_SIDE px
+# (suficiente para el OCR) y se guardan como JPEG (logic/ingest.py).
+# Con INGEST_ARCHIVE_ORIGINALS=True el original se guarda en ARCHIVE_ROOT.
+INGEST_MAX_SIDE = int(os.getenv("INGEST_MAX_SIDE", "2500"))
+INGEST_JPEG_QUALITY = int(os.getenv("INGEST_JPEG_QUALITY", "85"))
+INGEST_ARCHIVE_ORIGINALS = os.getenv("INGEST_ARCHIVE_ORIGINALS", "False") == "True"
+ARCHIVE_ROOT = Path(os.getenv("ARCHIVE_ROOT", BASE_DIR / "archive"))
 
 # Configuración de autenticación (sin cambios)
 LOGIN_URL = 'login'
 LOGIN_REDIRECT_URL = 'dashboard'
 LOGOUT_REDIRECT_URL = 'login'
 
-DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
\ No newline at end of file
+DEFAULT_AUTO_FIELD = "django.db.models.BigAutoField"
+
+# OCR - las subidas se procesan con `python manage.py ocr_worker`, que debe
+# correr como proceso aparte junto a la web (proceso "worker" del Procfile);
+# sin él las subidas se quedan en "processing".
+# OCR_INLINE=True ejecuta el job dentro de la petición (solo desarrollo).
+OCR_INLINE = os.getenv("OCR_INLINE", "False") == "True"
+# Cache de resultados OCR por hash de contenido (`python manage.py ocr_cache --evict`).
+OCR_CACHE_MAX_ENTRIES = int(os.getenv("OCR_CACHE_MAX_ENTRIES", "50000"))
+OCR_CACHE_MAX_AGE_DAYS = int(os.getenv("OCR_CACHE_MAX_AGE_DAYS", "180"))
+# Tope global de jobs OCR en cola/ejecución; por encima, las subidas reciben 429.
+OCR_MAX_ACTIVE_JOBS = int(os.getenv("OCR_MAX_ACTIVE_JOBS", "200"))
+
+# CACHE compartida entre workers de gunicorn (límites de subida por usuario).
+# Por defecto en la base de datos: `python manage.py createcachetable` (build.sh).
+# Con REDIS_URL se usa Redis.
+if os.getenv("REDIS_URL"):
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.redis.RedisCache",
+            "LOCATION": os.getenv("REDIS_URL"),
+        }
+    }
+else:
+    CACHES = {
+        "default": {
+            "BACKEND": "django.core.cache.backends.db.DatabaseCache",
+            "LOCATION": "budsi_cache",
+        }
+    }
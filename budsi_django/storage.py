@@ -0,0 +1,125 @@
+import hashlib
+import os
+import tempfile
+
+from django.core.files import File
+from django.core.files.move import file_move_safe
+from django.core.files.storage import FileSystemStorage
+from django.db import transaction
+from django.db.models import F
+
+from budsi_database.models import BlobAlias, StoredBlob
+
+# Constantes
+BLOB_DIR = "blobs"
+HASH_CHUNK = 1024 * 1024
+
+class ContentAddressedStorage(FileSystemStorage):
+    """
+    Media storage that keeps each distinct file once, under
+    blobs/<ab>/<cd>/<sha256> (two levels of 256 directories, so no directory
+    grows large), while FileFields keep their logical names
+    ("invoices/user_1/ticket.jpg"). BlobAlias maps a name to its StoredBlob
+    through a unique index, and the blob file is removed when the last name
+    pointing at it is deleted.
+
+    Names without an alias are files saved before this storage existed; they
+    are read from their old place (see `manage.py media_dedupe`).
+    """
+
+    def blob_name(self, sha256: str) -> str:
+        return f"{BLOB_DIR}/{sha256[:2]}/{sha256[2:4]}/{sha256}"
+
+    def _alias(self, name: str):
+        return BlobAlias.objects.select_related("blob").filter(name=name).first()
+
+    def path(self, name):
+        alias = self._alias(name)
+        if alias is not None:
+            return super().path(self.blob_name(alias.blob.sha256))
+        return super().path(name)
+
+    def listdir(self, path):
+        """Old-style files on disk plus the logical names stored as blobs."""
+        try:
+            directories, files = super().listdir(path)
+        except FileNotFoundError:
+            directories, files = [], []
+        directories, files = set(directories), set(files)
+        prefix = f"{path.rstrip('/')}/" if path else ""
+        for name in BlobAlias.objects.filter(name__startswith=prefix).values_list("name", flat=True):
+            head, sep, _ = name[len(prefix):].partition("/")
+            (directories if sep else files).add(head)
+        return sorted(directories), sorted(files)
+
+    def _hash_to_temp(self, content):
+        """Copy `content` to a temp file next to the blobs, hashing it; (path, sha256, size)."""
+        blob_root = super().path(BLOB_DIR)
+        os.makedirs(blob_root, exist_ok=True)
+        digest = hashlib.sha256()
+        size = 0
+        fd, tmp_path = tempfile.mkstemp(dir=blob_root, prefix=".upload-")
+        with os.fdopen(fd, "wb") as out:
+            content.seek(0)
+            for chunk in content.chunks(HASH_CHUNK):
+                digest.update(chunk)
+                size += len(chunk)
+                out.write(chunk)
+        return tmp_path, digest.hexdigest(), size
+
+    def _save(self, name, content):
+        # Uploads that went through InvoiceUploadHandler are already hashed
+        # and on disk: move the temp file instead of copying it.
+        sha256 = getattr(content, "content_hash", None)
+        if sha256 and hasattr(content, "temporary_file_path"):
+            tmp_path, size, moved = content.temporary_file_path(), content.size, True
+        else:
+            tmp_path, sha256, size = self._hash_to_temp(content)
+            moved = False
+
+        blob_path = super().path(self.blob_name(sha256))
+        with transaction.atomic():
+            blob, _ = StoredBlob.objects.select_for_update().get_or_create(
+                sha256=sha256, defaults={"size": size}
+            )
+            if os.path.exists(blob_path):
+                if not moved:
+                    os.remove(tmp_path)
+            else:
+                os.makedirs(os.path.dirname(blob_path), exist_ok=True)
+                file_move_safe(tmp_path, blob_path, allow_overwrite=True)
+                if self.file_permissions_mode is not None:
+                    os.chmod(blob_path, self.file_permissions_mode)
+            BlobAlias.objects.create(name=name, blob=blob)
+            StoredBlob.objects.filter(pk=blob.pk).update(refcount=F("refcount") + 1)
+        return name
+
+    def delete(self, name):
+        if not name:
+            raise ValueError("The name must be given to delete().")
+        with transaction.atomic():
+            alias = BlobAlias.objects.filter(name=name).first()
+            if alias is None:
+                return super().delete(name)  # old-style file
+            blob = StoredBlob.objects.select_for_update().get(pk=alias.blob_id)
+            alias.delete()
+            blob.refcount = max(0, blob.refcount - 1)
+            if blob.refcount:
+                blob.save(update_fields=["refcount"])
+                return
+            blob.delete()
+            super().delete(self.blob_name(blob.sha256))
+
+    def adopt(self, name) -> bool:
+        """
+        Move an old-style file at `name` into the blob store (dropping it if
+        the same content is already there). Returns False if there is
+        nothing to adopt.
+        """
+        legacy_path = super().path(name)
+        if self._alias(name) is not None or not os.path.isfile(legacy_path):
+            return False
+        with open(legacy_path, "rb") as f:
+            self._save(name, File(f, name=name))
+        os.remove(legacy_path)
+        return True
@@ -0,0 +1,91 @@
+import hashlib
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.uploadhandler import SkipFile, TemporaryFileUploadHandler
+
+# Constantes
+SNIFF_BYTES = 16
+MAGIC_NUMBERS = (
+    (b"%PDF", "pdf"),
+    (b"\xff\xd8\xff", "jpeg"),
+    (b"\x89PNG\r\n\x1a\n", "png"),
+    (b"GIF8", "gif"),
+    (b"II*\x00", "tiff"),
+    (b"MM\x00*", "tiff"),
+    (b"BM", "bmp"),
+)
+IMAGE_KINDS = {"jpeg", "png", "gif", "tiff", "bmp", "webp"}
+
+def sniff_kind(head: bytes) -> Optional[str]:
+    """File kind from its first bytes ('pdf', 'xml', an image kind) or None."""
+    for magic, kind in MAGIC_NUMBERS:
+        if head.startswith(magic):
+            return kind
+    if head[:4] == b"RIFF" and head[8:12] == b"WEBP":
+        return "webp"
+    if head.lstrip(b"\xef\xbb\xbf \t\r\n").startswith(b"<"):
+        return "xml"
+    return None
+
+class InvoiceUploadHandler(TemporaryFileUploadHandler):
+    """
+    Streams every upload to a temporary file (moved, not copied, into
+    MEDIA_ROOT when saved) while hashing it and checking its size and magic
+    bytes, so the view does not read it again and bad files never reach
+    storage. The finished file carries:
+      - content_hash (SHA-256, used by logic.ocr_cache.hash_upload)
+      - content_kind (see sniff_kind)
+    Rejected files are left out of request.FILES and the reason is kept in
+    request.upload_error.
+    """
+
+    def new_file(self, field_name, file_name, content_type, content_length, charset=None, content_type_extra=None):
+        self.max_bytes = settings.UPLOAD_MAX_MB * 1024 * 1024
+        self.digest = hashlib.sha256()
+        self.head = b""
+        self.kind = None
+        self.size = 0
+        super().new_file(field_name, file_name, content_type, content_length, charset, content_type_extra)
+        # After super(), so SkipFile closes this file and not a previous one.
+        if content_length and content_length > self.max_bytes:
+            self._reject(f"{file_name} is larger than {settings.UPLOAD_MAX_MB} MB.")
+
+    def _reject(self, reason: str):
+        if self.request is not None:
+            self.request.upload_error = reason
+        raise SkipFile(reason)
+
+    def _check_kind(self):
+        self.kind = sniff_kind(self.head)
+        if self.kind is None:
+            self._reject(self._bad_kind())
+
+    def _bad_kind(self) -> str:
+        return f"{self.file_name} is not a PDF, image or XML invoice."
+
+    def receive_data_chunk(self, raw_data, start):
+        self.size += len(raw_data)
+        if self.size > self.max_bytes:
+            self._reject(f"{self.file_name} is larger than {settings.UPLOAD_MAX_MB} MB.")
+        if self.kind is None and len(self.head) < SNIFF_BYTES:
+            self.head += raw_data[:SNIFF_BYTES - len(self.head)]
+            if len(self.head) == SNIFF_BYTES:
+                self._check_kind()
+        self.digest.update(raw_data)
+        return super().receive_data_chunk(raw_data, start)
+
+    def file_complete(self, file_size):
+        if self.kind is None:
+            # File shorter than SNIFF_BYTES. SkipFile is not caught here, so
+            # drop the file by returning None instead.
+            self.kind = sniff_kind(self.head)
+            if self.kind is None:
+                if self.request is not None:
+                    self.request.upload_error = self._bad_kind()
+                self.file.close()
+                return None
+        upload = super().file_complete(file_size)
+        upload.content_hash = self.digest.hexdigest()
+        upload.content_kind = self.kind
+        return upload
@@ -4,6 +4,7 @@ from django.contrib.auth.views import LogoutView
 from django.conf import settings
 from django.conf.urls.static import static
 from . import views
+from .media import media_view
 
 urlpatterns = [
     # Admin panel - ¡AGREGA ESTA LÍNEA!
@@ -50,11 +51,14 @@ urlpatterns = [
     path("dash/whiz/", views.whiz_view, name="dash_whiz"),
     path("dash/help/", views.help_view, name="dash_help"),
     path("invoices/gallery/<int:invoice_id>/", views.invoice_gallery_view, name="invoice_gallery"),
+    path("invoices/<int:invoice_id>/rendition/<str:size>/", views.invoice_rendition_view, name="invoice_rendition"),
+
+    # Ficheros subidos: con control de acceso, también en producción
+    path(f"{settings.MEDIA_URL.lstrip('/')}<path:name>", media_view, name="media"),
 
     
 ]
 
-# Para servir archivos estáticos y media en desarrollo
+# Para servir archivos estáticos en desarrollo
 if settings.DEBUG:
-    urlpatterns += static(settings.MEDIA_URL, document_root=settings.MEDIA_ROOT)
     urlpatterns += static(settings.STATIC_URL, document_root=settings.STATIC_ROOT)
\ No newline at end of file
@@ -4,14 +4,16 @@
 
 # ---- 1. Standard library ----
 import json
-from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+import uuid
+from decimal import Decimal, InvalidOperation
 from datetime import datetime
 
 # ---- 2. Django ----
 from django.conf import settings
 from django.contrib.auth import authenticate, login
 from django.contrib.auth.decorators import login_required
-from django.http import FileResponse, JsonResponse
+from django.core.files.storage import default_storage
+from django.http import FileResponse, Http404, HttpResponseNotModified, JsonResponse
 from django.shortcuts import redirect, render, get_object_or_404
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.dateparse import parse_date
@@ -22,7 +24,8 @@ from django.contrib import messages
 import stripe
 
 # ---- 4. Forms ----
-from .forms import CustomUserCreationForm, InvoiceForm
+from .forms import CustomUserCreationForm, InvoiceForm, TaxReportPeriodForm
+from .upload_handlers import IMAGE_KINDS
 
 # ---- 5. Models ----
 from budsi_database.models import FiscalProfile, Invoice, Contact
@@ -30,8 +33,15 @@ from budsi_database.models import FiscalProfile, Invoice, Contact
 # ---- 6. Helper logic ----
 from logic.debugger import debug
 from logic.fill_pdf import generate_invoice_pdf
-from logic.data_manager import load_data
-from logic.tax_calculator import calculate_taxes
+from logic.tax_report import build_tax_report, tax_year
+from logic.ocr_cache import get_cached_result, hash_upload
+from logic.admission import upload_admission
+from logic.einvoice import read_einvoice, save_einvoice
+from logic.ingest import ingest_image
+from logic.layout_templates import maybe_learn_template
+from logic.renditions import RENDITION_SIZES, get_rendition, is_renderable, rendition_key
+from logic.near_duplicates import find_near_duplicates, to_db, upload_dhash
+from logic.ocr_queue import complete_from_cache, enqueue_invoice, placeholder_contact, process_next
 
 
 #############################
@@ -203,6 +213,11 @@ def invoice_create(request):
 def invoice_preview_view(request, invoice_id: int):
     invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
 
+    if request.method == "POST" and invoice.status == Invoice.PROCESSING:
+        # The OCR worker is about to fill in these fields.
+        messages.info(request, "This invoice is still being read; please try again in a moment.")
+        return redirect("invoice_preview", invoice_id=invoice.id)
+
     if request.method == "POST":
         form = InvoiceForm(request.POST, instance=invoice, user=request.user)
         if form.is_valid():
@@ -211,18 +226,22 @@ def invoice_preview_view(request, invoice_id: int):
                 inv.is_confirmed = True
             inv.total = inv.subtotal + inv.vat_amount
             inv.save()
+            if inv.is_confirmed:
+                maybe_learn_template(inv)
             return redirect("dash_tax")
     else:
         form = InvoiceForm(instance=invoice, user=request.user)
 
     original_url = invoice.original_file.url if invoice.original_file else None
     is_pdf = (original_url or "").lower().endswith(".pdf")
+    is_xml = (original_url or "").lower().endswith(".xml")
 
     return render(request, "budgidesk_app/dash/expenses/preview_purchase.html", {
         "invoice": invoice,
         "form": form,
         "original_url": original_url,
         "is_pdf": is_pdf,
+        "is_xml": is_xml,
     })
 
 
@@ -243,45 +262,15 @@ def tax_view(request):
 
 @login_required
 def budsi_tax_report(request):
-    invoices = load_data('invoices.csv')
-    purchases = load_data('purchases.csv')
-    tax_data = calculate_taxes(invoices, purchases)
-
-    def _D(x):
-        try: return Decimal(str(x))
-        except: return Decimal('0')
-
-    def _q2(x):
-        return x.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-
-    rows_sales = []
-    for i, inv in enumerate(invoices, start=1):
-        total = _D(inv.get('total', 0))
-        net = (total / Decimal('1.23')) if total else Decimal('0')
-        vat = net * Decimal('0.23')
-        rows_sales.append({"n": i, "net": _q2(net), "vat": _q2(vat), "total": _q2(total)})
-
-    rows_pur = []
-    for i, pur in enumerate(purchases, start=1):
-        total = _D(pur.get('total', 0))
-        net = (total / Decimal('1.23')) if total else Decimal('0')
-        vat = net * Decimal('0.23')
-        rows_pur.append({"n": i, "net": _q2(net), "vat": _q2(vat), "total": _q2(total)})
-
-    taxable_income = _D(tax_data['income']['taxable'])
-    first_band = min(taxable_income, Decimal('44000'))
-    excess = max(taxable_income - Decimal('44000'), Decimal('0'))
-
-    context = {
-        "rows_sales": rows_sales,
-        "rows_purchases": rows_pur,
-        "tax_data": tax_data,
-        "first_band_amount": _q2(first_band),
-        "first_band_tax": _q2(first_band * Decimal('0.2')),
-        "excess_amount": _q2(excess),
-        "excess_tax": _q2(excess * Decimal('0.4')),
-        "show_excess": taxable_income > Decimal('44000'),
-    }
+    # Facturas confirmadas del usuario en el periodo (por defecto, el año
+    # fiscal en curso); las sumas las hace la base de datos.
+    start, end = tax_year()
+    form = TaxReportPeriodForm(request.GET or None, initial={"start": start, "end": end})
+    if form.is_valid():
+        start, end = form.cleaned_data["start"], form.cleaned_data["end"]
+
+    context = build_tax_report(request.user, start, end)
+    context["form"] = form
     return render(request, "budgidesk_app/dash/tax/report.html", context)
 
 #############################
@@ -443,83 +432,77 @@ def payment_page(request):
 #  OCR → AUTOMATIC INVOICE
 #############################
 
-def _parse_date_str(date_str: str):
-    if not date_str:
-        return None
-    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d"):
-        try:
-            return datetime.strptime(date_str, fmt).date()
-        except Exception:
-            pass
-    return None
-
 @login_required
+@upload_admission
 def invoice_upload_view(request):
     if request.method == "POST" and request.FILES.get("file"):
         f = request.FILES["file"]
+        content_hash = hash_upload(f)
+        # Sniffed from the magic bytes by InvoiceUploadHandler.
+        kind = getattr(f, "content_kind", None)
+
+        # UBL/CII e-invoices (or PDFs carrying one) have exact data: no OCR.
+        einvoice = read_einvoice(f) if kind not in IMAGE_KINDS else None
+        if einvoice is not None:
+            invoice, created = save_einvoice(request.user, einvoice, f, content_hash)
+            if not created:
+                messages.info(request, f"Invoice {invoice.invoice_number} was already imported.")
+            return redirect("invoice_preview", invoice_id=invoice.id)
+        if kind == "xml":
+            # HTML, SVG or XML we cannot read: OCR would only fail on it.
+            messages.error(request, f"{f.name} is not a supported e-invoice (UBL or CII).")
+            return redirect("dash_tax")
 
+        cached = get_cached_result(content_hash)
+
+        # Same receipt photographed again: flag it before spending OCR on it.
+        image_hash = upload_dhash(f) if kind in IMAGE_KINDS or kind is None else None
+        duplicates = find_near_duplicates(request.user, image_hash) if image_hash is not None else []
+
+        # Photos are stored rotated, downscaled and re-encoded (logic/ingest.py).
+        if kind in IMAGE_KINDS:
+            f = ingest_image(f, request.user.id, content_hash)
+
+        # OCR runs in the background worker (manage.py ocr_worker); the invoice
+        # stays in "processing" state until the job fills in the fields.
         invoice = Invoice.objects.create(
             user=request.user,
             invoice_type="purchase",
+            contact=placeholder_contact(request.user),
+            invoice_number=f"OCR-{uuid.uuid4().hex[:12].upper()}",
             date=datetime.now().date(),
             subtotal=0,
             vat_amount=0,
             total=0,
             description="",
             original_file=f,
+            content_hash=content_hash,
+            image_hash=to_db(image_hash) if image_hash is not None else None,
+            duplicate_of=duplicates[0] if duplicates else None,
             ocr_data={},
             is_confirmed=False,
         )
+        if duplicates:
+            messages.warning(
+                request,
+                f"This receipt looks like one you already uploaded ({duplicates[0].invoice_number}). "
+                "Please check it is not a duplicate before confirming."
+            )
+        if cached is not None:
+            # Exact duplicate of an already processed document.
+            complete_from_cache(invoice, cached)
+            return redirect("invoice_preview", invoice_id=invoice.id)
 
-        from logic.ocr_processor import process_invoice
-        from logic.data_manager import save_invoice
-
-        ocr = process_invoice(invoice.original_file.path) or {}
-
-        supplier_name = (ocr.get("supplier") or "").strip() or "Supplier"
-        parsed_date = _parse_date_str(ocr.get("date") or "")
-        try:
-            subtotal = Decimal(str(ocr.get("total") or 0))
-        except Exception:
-            subtotal = Decimal("0")
-        try:
-            vat_amount = Decimal(str(ocr.get("vat") or 0))
-        except Exception:
-            vat_amount = Decimal("0")
-        description = (ocr.get("description") or "").strip()
-
-        contact, _ = Contact.objects.get_or_create(
-            user=request.user,
-            name=supplier_name,
-            defaults={"is_supplier": True}
-        )
-
-        invoice.contact = contact
-        if parsed_date:
-            invoice.date = parsed_date
-        invoice.subtotal = subtotal
-        invoice.vat_amount = vat_amount
-        invoice.total = subtotal + vat_amount
-        invoice.description = description or "OCR Invoice (please review)."
-        invoice.ocr_data = ocr
-        invoice.save()
+        job = enqueue_invoice(invoice)
 
-        try:
-            save_invoice(
-                {
-                    "supplier": supplier_name,
-                    "date": ocr.get("date") or "",
-                    "total": float(subtotal),
-                    "description": description,
-                },
-                invoice_type="purchase",
-                prevent_duplicates=True
-            )
-        except Exception as e:
-            debug(f"CSV save skipped: {e}")
+        if settings.OCR_INLINE:
+            process_next(invoice=invoice)
+            debug(f"OCR job {job.id} processed inline")
 
         return redirect("invoice_preview", invoice_id=invoice.id)
 
+    if getattr(request, "upload_error", None):
+        messages.error(request, request.upload_error)
     return redirect("dash_tax")
 
 
@@ -553,6 +536,30 @@ def invoice_gallery_view(request, invoice_id):
     )
 
 
+@login_required
+def invoice_rendition_view(request, invoice_id, size):
+    """
+    Small/medium JPEG of an invoice's image or first PDF page, rendered on
+    first request (logic/renditions.py). The ETag changes with the original
+    file, so browsers revalidate with a cheap 304.
+    """
+    invoice = get_object_or_404(Invoice, id=invoice_id, user=request.user)
+    if size not in RENDITION_SIZES or not is_renderable(invoice):
+        raise Http404("No preview for this invoice")
+
+    etag = f'"{rendition_key(invoice)}-{size}"'
+    if request.headers.get("If-None-Match") == etag:
+        response = HttpResponseNotModified()
+    else:
+        name = get_rendition(invoice, size)
+        if name is None:
+            raise Http404("Preview not available")
+        response = FileResponse(default_storage.open(name, "rb"), content_type="image/jpeg")
+    response["ETag"] = etag
+    response["Cache-Control"] = "private, max-age=86400"
+    return response
+
+
 @login_required
 def invoice_list_view(request):
     invoices = Invoice.objects.filter(user=request.user).order_by("-date", "-id")
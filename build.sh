@@ -1,6 +1,16 @@
 #!/usr/bin/env bash
 set -o errexit
 
+# OCR: tesseract (with the library and headers tesserocr builds against)
+# and poppler for PDF pages. Skipped where apt is not available, e.g. when
+# the image already ships them.
+if command -v apt-get >/dev/null && [ "$(id -u)" = "0" ]; then
+  apt-get update
+  apt-get install -y --no-install-recommends \
+    tesseract-ocr tesseract-ocr-eng libtesseract-dev libleptonica-dev pkg-config poppler-utils
+fi
+
 pip install -r requirements.txt
 python manage.py collectstatic --noinput
 python manage.py migrate
+python manage.py createcachetable
@@ -0,0 +1,141 @@
+import math
+import time
+from functools import wraps
+from typing import NamedTuple
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import HttpResponse
+from django.urls import Resolver404, resolve
+
+from budsi_database.models import OcrJob
+from logic.plan_tiers import upload_limits
+
+# Constantes
+LOCK_TIMEOUT = 2           # s a per-user lock may be held (if a worker dies holding it)
+LOCK_WAIT = LOCK_TIMEOUT + 0.5  # s waited for a contended lock; by then a dead holder's lock expired
+ACTIVE_JOBS_KEY = "ocr-active-jobs"
+ACTIVE_JOBS_TTL = 2        # s the global queued/running count is reused
+BUSY_RETRY_AFTER = 30      # s suggested when the OCR queue is full
+
+class Admission(NamedTuple):
+    allowed: bool
+    retry_after: int = 0   # seconds, for the Retry-After header
+    reason: str = ""
+
+# =============================================================================
+# Token bucket (shared cache)
+# =============================================================================
+
+def take_token(key: str, burst: int, per_minute: float) -> float:
+    """
+    Take one token from the bucket stored at `key` in the shared cache.
+    Returns 0 when granted, otherwise the seconds until a token is available.
+
+    The read-refill-write is serialised per bucket with a cache.add() lock,
+    which is atomic on the database, Redis and local-memory backends, so
+    the limit holds across gunicorn workers.
+    """
+    rate = per_minute / 60.0
+    lock_key = f"{key}:lock"
+    deadline = time.monotonic() + LOCK_WAIT
+    pause = 0.002
+    locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    while not locked and time.monotonic() < deadline:
+        # Two requests of the same user overlapping: wait our turn, since
+        # rejecting here would refuse uploads that are within the limit.
+        time.sleep(pause)
+        pause = min(pause * 2, 0.05)
+        locked = cache.add(lock_key, 1, LOCK_TIMEOUT)
+    try:
+        now = time.time()
+        tokens, stamp = cache.get(key) or (float(burst), now)
+        tokens = min(float(burst), tokens + max(0.0, now - stamp) * rate)
+        wait = 0.0
+        if tokens >= 1:
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+        # Expire once the bucket would be full again anyway.
+        cache.set(key, (tokens, now), int(burst / rate) + 1)
+        return wait
+    finally:
+        if locked:  # otherwise the cache is misbehaving; better unserialised than refused
+            cache.delete(lock_key)
+
+# =============================================================================
+# Upload admission
+# =============================================================================
+
+def active_ocr_jobs() -> int:
+    """Queued + running OCR jobs, recounted at most every ACTIVE_JOBS_TTL seconds."""
+    count = cache.get(ACTIVE_JOBS_KEY)
+    if count is None:
+        count = OcrJob.objects.filter(status__in=[OcrJob.QUEUED, OcrJob.RUNNING]).count()
+        cache.set(ACTIVE_JOBS_KEY, count, ACTIVE_JOBS_TTL)
+    return count
+
+def admit_upload(user) -> Admission:
+    """Global OCR cap first (so a rejected upload costs no token), then the user's bucket."""
+    if active_ocr_jobs() >= settings.OCR_MAX_ACTIVE_JOBS:
+        return Admission(False, BUSY_RETRY_AFTER, "OCR queue is full")
+
+    limits = upload_limits(getattr(user, "plan", "lite"))
+    wait = take_token(f"upload-bucket:{user.pk}", limits["burst"], limits["per_minute"])
+    if wait > 0:
+        return Admission(False, max(1, math.ceil(wait)), "upload limit reached for your plan")
+    return Admission(True)
+
+def too_many_requests(admission: Admission) -> HttpResponse:
+    response = HttpResponse(
+        f"Too many uploads: {admission.reason}. Please try again in {admission.retry_after} s.",
+        status=429,
+        content_type="text/plain",
+    )
+    response["Retry-After"] = str(admission.retry_after)
+    return response
+
+def upload_admission(view_func):
+    """
+    Marca la vista de subida: UploadAdmissionMiddleware rechaza con 429 +
+    Retry-After antes de leer el fichero si el usuario agotó su cupo o la
+    cola OCR está llena. Sin el middleware, la comprobación se hace aquí
+    (ya con el cuerpo leído por CsrfViewMiddleware).
+    """
+    @wraps(view_func)
+    def _wrapped_view(request, *args, **kwargs):
+        if request.method == "POST" and not hasattr(request, "upload_admission"):
+            admission = admit_upload(request.user)
+            if not admission.allowed:
+                return too_many_requests(admission)
+        return view_func(request, *args, **kwargs)
+    _wrapped_view.upload_admission = True
+    return _wrapped_view
+
+class UploadAdmissionMiddleware:
+    """
+    Admission of POSTs to views decorated with @upload_admission, before
+    the body is parsed. CsrfViewMiddleware reads request.POST in
+    process_view, which only runs after every middleware's __call__, so a
+    rejected upload is never streamed to disk. Goes after
+    AuthenticationMiddleware (it needs request.user).
+    """
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        if request.method == "POST" and request.user.is_authenticated and self._is_upload(request):
+            admission = admit_upload(request.user)
+            if not admission.allowed:
+                return too_many_requests(admission)
+            request.upload_admission = admission
+        return self.get_response(request)
+
+    @staticmethod
+    def _is_upload(request) -> bool:
+        try:
+            match = resolve(request.path_info)
+        except Resolver404:
+            return False
+        return getattr(match.func, "upload_admission", False)
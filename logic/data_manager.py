@@ -1,10 +1,24 @@
 
 import csv
+import io
 import os
-from typing import Dict, List, Optional, Tuple
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
 
 # Constantes
 VAT_RATE = 0.23  # Tasa de IVA fija del 23%
+KEY_INDEX_SUFFIX = ".keys"   # índice de claves junto al CSV (purchases.csv.keys)
+KEY_INDEX_HEADER = "{:020d} {:020d}\n"  # tamaño y mtime_ns del CSV, ancho fijo
+
+LEDGER_FIELDS = ["supplier", "date", "total", "description"]
+LOCK_SUFFIX = ".lock"        # fichero de bloqueo (flock) junto al CSV
+
+Key = Tuple[str, str, str]   # (supplier, date, total)
+
+try:
+    import fcntl
+except ImportError:  # Windows: solo se serializa dentro del proceso
+    fcntl = None
 
 def safe_float(value) -> float:
     """Convierte a float de forma segura; en error devuelve 0.0."""
@@ -26,13 +40,221 @@ def _read_csv(path: str) -> List[Dict[str, str]]:
     with open(path, "r", encoding="utf-8") as f:
         return list(csv.DictReader(f))
 
-def _write_row(path: str, fieldnames: List[str], row: Dict[str, object]) -> None:
-    file_exists = os.path.exists(path)
-    with open(path, "a", newline="", encoding="utf-8") as f:
-        writer = csv.DictWriter(f, fieldnames=fieldnames)
-        if not file_exists:
+# =============================================================================
+# Índice de claves para detectar duplicados
+# =============================================================================
+# El índice (<csv>.keys) guarda una clave (supplier, date, total) por línea y
+# en la cabecera el tamaño y mtime del CSV cuando se escribió. Si el CSV cambia
+# por otra vía (edición a mano, copia de seguridad restaurada...) la cabecera
+# ya no coincide y el índice se reconstruye leyendo el CSV una vez.
+
+# Por proceso: ruta -> (estado del CSV, claves, (inodo, bytes leídos) del índice).
+# El índice solo crece por el final, así que si otro proceso añadió filas
+# basta con leer lo que haya después de la posición conocida.
+_key_cache: Dict[str, Tuple[Tuple[int, int], Set[Key], Tuple[int, int]]] = {}
+
+def _stat(path: str) -> Optional[Tuple[int, int]]:
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return st.st_size, st.st_mtime_ns
+
+def _row_key(r: Dict[str, str]) -> Key:
+    return (r.get("supplier") or "", r.get("date") or "", r.get("total") or "")
+
+def _parse_keys(data: bytes):
+    return (tuple(r) for r in csv.reader(io.StringIO(data.decode("utf-8"), newline="")))
+
+def _read_key_index(path: str, stamp: Tuple[int, int], cached=None):
+    """
+    (claves, posición) del índice si corresponde a este estado del CSV; si
+    no, None. Con `cached` (de _key_cache) solo se leen las claves nuevas.
+    """
+    try:
+        with open(path + KEY_INDEX_SUFFIX, "rb") as f:
+            if f.readline().decode("ascii") != KEY_INDEX_HEADER.format(*stamp):
+                return None
+            st = os.fstat(f.fileno())
+            if cached is not None and cached[2][0] == st.st_ino and cached[2][1] <= st.st_size:
+                keys = cached[1]
+                f.seek(cached[2][1])
+            else:
+                keys = set()
+            keys.update(_parse_keys(f.read()))
+            return keys, (st.st_ino, f.tell())
+    except (FileNotFoundError, ValueError):
+        return None
+
+def _write_key_index(path: str, stamp: Tuple[int, int], keys: Set[Key]) -> Tuple[int, int]:
+    tmp = path + KEY_INDEX_SUFFIX + ".tmp"
+    with open(tmp, "w", encoding="utf-8", newline="") as f:
+        f.write(KEY_INDEX_HEADER.format(*stamp))
+        csv.writer(f).writerows(keys)
+    os.replace(tmp, path + KEY_INDEX_SUFFIX)
+    st = os.stat(path + KEY_INDEX_SUFFIX)
+    return st.st_ino, st.st_size
+
+def _append_key_index(path: str, stamp: Tuple[int, int], keys: List[Key]) -> Tuple[int, int]:
+    """Añade claves y actualiza la cabecera en su sitio (ancho fijo): O(lote)."""
+    with open(path + KEY_INDEX_SUFFIX, "r+", encoding="utf-8", newline="") as f:
+        f.seek(0, os.SEEK_END)
+        csv.writer(f).writerows(keys)
+        f.flush()
+        st = os.fstat(f.fileno())
+        f.seek(0)
+        f.write(KEY_INDEX_HEADER.format(*stamp))
+    return st.st_ino, st.st_size
+
+def ledger_keys(path: str) -> Set[Key]:
+    """
+    Claves (supplier, date, total) de un CSV. Se guardan en memoria y en el
+    índice <csv>.keys; el CSV solo se vuelve a leer si su tamaño o mtime no
+    coinciden con los del índice.
+    """
+    stamp = _stat(path)
+    if stamp is None:
+        return set()
+    cached = _key_cache.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    found = _read_key_index(path, stamp, cached)
+    if found is not None:
+        keys, position = found
+    else:
+        keys = {_row_key(r) for r in _read_csv(path)}
+        position = _write_key_index(path, stamp, keys)
+        print(f"[LEDGER] Rebuilt key index for {path} ({len(keys)} keys)")
+    _key_cache[path] = (stamp, keys, position)
+    return keys
+
+def _remember_keys(path: str, keys: Set[Key], added: List[Key]) -> None:
+    """Tras añadir filas: actualiza el índice en memoria y en disco."""
+    stamp = _stat(path)
+    keys.update(added)
+    if os.path.exists(path + KEY_INDEX_SUFFIX):
+        position = _append_key_index(path, stamp, added)
+    else:
+        position = _write_key_index(path, stamp, keys)
+    _key_cache[path] = (stamp, keys, position)
+
+# =============================================================================
+# Escritura con bloqueo
+# =============================================================================
+
+class LedgerWriter:
+    """
+    Añade filas a un CSV del libro con un bloqueo exclusivo (flock sobre
+    <csv>.lock), de modo que varios workers de gunicorn no intercalan filas,
+    no escriben dos cabeceras y no se saltan la comprobación de duplicados.
+
+        with LedgerWriter("purchases.csv") as ledger:
+            for row in rows:
+                ledger.add(row)
+
+    Las filas se acumulan y se escriben al salir del bloque: una sola
+    escritura y un fsync por lote, con el bloqueo tomado solo durante ese
+    tiempo (y el índice de claves actualizado de una vez).
+    """
+
+    _thread_lock = threading.Lock()  # flock no serializa sin fcntl
+
+    def __init__(self, path: str, fieldnames: Optional[List[str]] = None):
+        self.path = path
+        self.fieldnames = fieldnames or LEDGER_FIELDS
+        self.rows: List[Tuple[Dict[str, object], bool]] = []
+
+    def add(self, row: Dict[str, object], prevent_duplicates: bool = True) -> None:
+        """Encola una fila; los duplicados se descartan al escribir el lote."""
+        self.rows.append((row, prevent_duplicates))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.flush()
+
+    def flush(self) -> List[bool]:
+        """Escribe el lote; devuelve, por fila, si se guardó (no era duplicado)."""
+        if not self.rows:
+            return []
+        with self._thread_lock, open(self.path + LOCK_SUFFIX, "a") as lock:
+            if fcntl is not None:
+                fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                return self._write_locked()
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def _write_locked(self) -> List[bool]:
+        # Con el bloqueo tomado: las claves reflejan lo que escribieron los demás.
+        keys = ledger_keys(self.path)
+        saved, added, buf = [], set(), io.StringIO()
+        writer = csv.DictWriter(buf, fieldnames=self.fieldnames)
+        if (_stat(self.path) or (0, 0))[0] == 0:
             writer.writeheader()
-        writer.writerow(row)
+        for row, prevent_duplicates in self.rows:
+            key = (str(row["supplier"]), str(row["date"]), str(row["total"]))
+            if prevent_duplicates and (key in keys or key in added):
+                saved.append(False)
+                continue
+            writer.writerow(row)
+            added.add(key)
+            saved.append(True)
+        self.rows = []
+
+        if added:
+            with open(self.path, "a", newline="", encoding="utf-8") as f:
+                f.write(buf.getvalue())
+                f.flush()
+                os.fsync(f.fileno())
+            _remember_keys(self.path, keys, list(added))
+        return saved
+
+# =============================================================================
+# API
+# =============================================================================
+
+def _ledger_row(data: Dict[str, object]) -> Optional[Dict[str, object]]:
+    """Fila del CSV (solo el total, sin cálculos); None si el total no es válido."""
+    total = safe_float(data.get("total"))
+    if total <= 0:
+        return None
+    return {
+        "supplier": (data.get("supplier") or "").strip(),
+        "date": (data.get("date") or "").strip(),
+        "total": f"{total:.2f}",
+        "description": (data.get("description") or "").strip(),
+    }
+
+def _ledger_path(invoice_type: str) -> Optional[str]:
+    invoice_type = (invoice_type or "").strip().lower()
+    if invoice_type not in {"purchase", "sale"}:
+        return None
+    return "purchases.csv" if invoice_type == "purchase" else "invoices.csv"
+
+def save_invoices(
+    items: Iterable[Dict[str, object]],
+    invoice_type: str,
+    *,
+    prevent_duplicates: bool = True
+) -> int:
+    """
+    Guarda varias facturas del mismo tipo en un solo lote (un bloqueo, una
+    escritura, un fsync). Devuelve cuántas se guardaron.
+    """
+    file_path = _ledger_path(invoice_type)
+    if file_path is None:
+        return 0
+    ledger = LedgerWriter(file_path)
+    for data in items:
+        row = _ledger_row(data)
+        if row is not None:
+            ledger.add(row, prevent_duplicates)
+    return sum(ledger.flush())
 
 def save_invoice(
     data: Dict[str, object],
@@ -48,43 +270,7 @@ def save_invoice(
       - invoice_type: 'purchase' o 'sale'
       - prevent_duplicates: evita duplicados por (supplier, date, total)
     """
-    invoice_type = (invoice_type or "").strip().lower()
-    if invoice_type not in {"purchase", "sale"}:
-        return False
-
-    supplier = (data.get("supplier") or "").strip()
-    date_str = (data.get("date") or "").strip()
-    description = (data.get("description") or "").strip()
-    total = safe_float(data.get("total"))
-
-    if total <= 0:
-        return False
-
-    # Estructura común para ambos tipos
-    file_path = "purchases.csv" if invoice_type == "purchase" else "invoices.csv"
-    fieldnames = ["supplier", "date", "total", "description"]
-    row = {
-        "supplier": supplier,
-        "date": date_str,
-        "total": f"{total:.2f}",
-        "description": description
-    }
-
-    # Detección de duplicados
-    if prevent_duplicates:
-        existing = _read_csv(file_path)
-        key_new = (supplier, date_str, row["total"])
-        for r in existing:
-            key_old = (
-                (r.get("supplier") or ""),
-                (r.get("date") or ""),
-                (r.get("total") or ""),
-            )
-            if key_old == key_new:
-                return False
-
-    _write_row(file_path, fieldnames, row)
-    return True
+    return save_invoices([data], invoice_type, prevent_duplicates=prevent_duplicates) == 1
 
 def load_data(filename: str) -> List[Dict[str, str]]:
     """Lee un CSV y devuelve una lista de dicts."""
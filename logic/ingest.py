@@ -0,0 +1,82 @@
+import io
+import os
+from typing import Optional
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import FileSystemStorage
+from PIL import Image, ImageOps
+
+from logic.debugger import debug
+
+# =============================================================================
+# Image normalization on upload
+# =============================================================================
+
+def archive_storage() -> FileSystemStorage:
+    """Cold storage for the untouched originals (INGEST_ARCHIVE_ORIGINALS)."""
+    return FileSystemStorage(location=settings.ARCHIVE_ROOT)
+
+def _flatten(img: Image.Image) -> Image.Image:
+    """RGB (or L) for JPEG; transparency goes on white, like the paper."""
+    if img.mode in ("RGB", "L"):
+        return img
+    if img.mode in ("RGBA", "LA", "P"):
+        img = img.convert("RGBA")
+        background = Image.new("RGB", img.size, "white")
+        background.paste(img, mask=img.getchannel("A"))
+        return background
+    return img.convert("RGB")
+
+def normalize_image(f, max_side: Optional[int] = None, quality: Optional[int] = None) -> Optional[bytes]:
+    """
+    Re-encode an uploaded receipt photo: apply the EXIF rotation, cap the
+    longest side at max_side (INGEST_MAX_SIDE, enough for OCR) and save it
+    as an optimised JPEG without metadata. Returns the JPEG bytes, or None
+    if the image cannot be read or would not get any smaller.
+    """
+    max_side = max_side or settings.INGEST_MAX_SIDE
+    quality = quality or settings.INGEST_JPEG_QUALITY
+    original_size = getattr(f, "size", None)
+    try:
+        f.seek(0)
+        with Image.open(f) as img:
+            # JPEG can decode straight to a reduced scale (at least max_side).
+            img.draft(img.mode, (max_side, max_side))
+            rotated = img.getexif().get(0x0112, 1) != 1
+            img = _flatten(ImageOps.exif_transpose(img))
+            img.thumbnail((max_side, max_side), Image.LANCZOS)
+            out = io.BytesIO()
+            img.save(out, "JPEG", quality=quality, optimize=True, progressive=True)
+    except Exception as e:
+        debug(f"Image normalization skipped: {e}")
+        return None
+    finally:
+        f.seek(0)
+
+    data = out.getvalue()
+    if original_size and len(data) >= original_size and not rotated:
+        return None
+    return data
+
+def ingest_image(f, user_id: int, content_hash: str):
+    """
+    File to store for an uploaded image: the normalized JPEG if it helps,
+    otherwise the upload itself. With INGEST_ARCHIVE_ORIGINALS the original
+    is also kept in ARCHIVE_ROOT under user_<id>/<content hash>.
+    """
+    data = normalize_image(f)
+    if data is None:
+        return f
+
+    if settings.INGEST_ARCHIVE_ORIGINALS:
+        ext = os.path.splitext(f.name)[1].lower()
+        name = f"user_{user_id}/{content_hash}{ext}"
+        storage = archive_storage()
+        if not storage.exists(name):
+            storage.save(name, f)
+        f.seek(0)
+
+    stem = os.path.splitext(os.path.basename(f.name))[0] or "receipt"
+    print(f"[INGEST] {f.name}: {f.size} -> {len(data)} bytes")
+    return ContentFile(data, name=f"{stem}.jpg")
@@ -0,0 +1,151 @@
+import re
+import threading
+from collections import OrderedDict
+from typing import Dict, List, Optional, Tuple
+
+from django.db.models import Max
+from django.utils import timezone
+
+from budsi_database.models import Contact, Invoice
+from logic.debugger import debug
+from logic.ocr_processor import _money_tokens_in, parse_money
+
+# Constantes
+TEMPLATE_SAMPLES = 3         # confirmed invoices a template is learned from
+TEMPLATE_MIN_SAMPLES = 2     # a field needs this many agreeing samples
+MAX_SPAN_DRIFT = 0.03        # max distance between samples (fraction of page height)
+SPAN_PADDING = 0.015         # added above and below the learned span
+MAX_CACHED_USERS = 256       # per-process LRU of users' templates
+TEMPLATE_FIELDS = ("date", "vat", "total")
+MIN_NAME_CHARS = 3           # shorter supplier names match too much by accident
+
+# =============================================================================
+# Learning
+# =============================================================================
+
+def _matches_amount(text: str, amount) -> bool:
+    if not amount:
+        return False
+    target = float(amount)
+    return any(abs(parse_money(tok) - target) < 0.005 for tok in _money_tokens_in(text))
+
+def _date_strings(value) -> List[str]:
+    return [value.strftime(fmt) for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d")]
+
+def field_spans(invoice: Invoice) -> Dict[str, Tuple[float, float]]:
+    """
+    Vertical span of the lines holding the confirmed date, VAT and total,
+    found in the OCR layout saved with the invoice.
+    """
+    layout = (invoice.ocr_data or {}).get("layout") or []
+    dates = _date_strings(invoice.date) if invoice.date else []
+    spans: Dict[str, Tuple[float, float]] = {}
+    for line in layout:
+        text, span = line.get("text", ""), (line["top"], line["bottom"])
+        if "date" not in spans and any(d in text for d in dates):
+            spans["date"] = span
+        if _matches_amount(text, invoice.vat_amount):
+            spans.setdefault("vat", span)
+        # The parser's "total" is stored as subtotal (see ocr_queue.set_ocr_fields).
+        if _matches_amount(text, invoice.subtotal) or _matches_amount(text, invoice.total):
+            spans["total"] = span  # last one wins: totals sit at the bottom
+    return spans
+
+def learn_template(contact: Contact) -> Optional[dict]:
+    """
+    Learn where date/VAT/total sit on this supplier's invoices from the last
+    TEMPLATE_SAMPLES confirmed ones, and save it on the contact. A field is
+    kept when at least TEMPLATE_MIN_SAMPLES samples put it in the same place.
+    """
+    invoices = (
+        Invoice.objects
+        .filter(contact=contact, invoice_type=Invoice.PURCHASE, is_confirmed=True, ocr_data__has_key="layout")
+        .only("id", "date", "subtotal", "vat_amount", "total", "ocr_data")
+        .order_by("-id")[:TEMPLATE_SAMPLES]
+    )
+    samples = [field_spans(inv) for inv in invoices]
+
+    fields = {}
+    for field in TEMPLATE_FIELDS:
+        spans = [s[field] for s in samples if field in s]
+        if len(spans) < TEMPLATE_MIN_SAMPLES:
+            continue
+        tops, bottoms = [t for t, _ in spans], [b for _, b in spans]
+        if max(tops) - min(tops) > MAX_SPAN_DRIFT:
+            continue  # layout not stable enough for this field
+        fields[field] = [round(max(0.0, min(tops) - SPAN_PADDING), 4),
+                         round(min(1.0, max(bottoms) + SPAN_PADDING), 4)]
+
+    template = {"fields": fields, "samples": len(samples)} if fields else {}
+    if template != contact.layout_template:
+        contact.layout_template = template
+        contact.layout_updated_at = timezone.now()
+        contact.save(update_fields=["layout_template", "layout_updated_at"])
+        debug(f"Layout template for {contact.name}: {template}")
+    return template or None
+
+def maybe_learn_template(invoice: Invoice) -> None:
+    """
+    Called on confirmation. Only invoices read by the generic OCR carry a
+    layout, i.e. the supplier has no template yet or it no longer matched,
+    so those are the ones that (re)learn it.
+    """
+    if invoice.invoice_type != Invoice.PURCHASE or "layout" not in (invoice.ocr_data or {}):
+        return
+    try:
+        learn_template(invoice.contact)
+        forget_user(invoice.user_id)
+    except Exception as e:
+        debug(f"Template learning skipped: {e}")
+
+# =============================================================================
+# Lookup (in-memory LRU per user)
+# =============================================================================
+
+def _key(name: str) -> str:
+    return re.sub(r"[^a-z0-9]", "", (name or "").lower())
+
+_cache: "OrderedDict[int, Tuple[object, Dict[str, dict]]]" = OrderedDict()
+_lock = threading.Lock()
+
+def forget_user(user_id: int) -> None:
+    with _lock:
+        _cache.pop(user_id, None)
+
+def user_templates(user_id: int) -> Dict[str, dict]:
+    """
+    {normalised supplier name: template} for one user. Reloaded only when
+    one of the user's templates changed (max layout_updated_at), so workers
+    pick up templates learned by the web process.
+    """
+    contacts = Contact.objects.filter(user_id=user_id, layout_updated_at__isnull=False)
+    stamp = contacts.aggregate(stamp=Max("layout_updated_at"))["stamp"]
+    with _lock:
+        cached = _cache.get(user_id)
+        if cached is not None and cached[0] == stamp:
+            _cache.move_to_end(user_id)
+            return cached[1]
+
+    templates = {
+        _key(name): template
+        for name, template in contacts.values_list("name", "layout_template")
+        if template and _key(name)
+    }
+    with _lock:
+        _cache[user_id] = (stamp, templates)
+        _cache.move_to_end(user_id)
+        while len(_cache) > MAX_CACHED_USERS:
+            _cache.popitem(last=False)
+    return templates
+
+def find_template(user_id: int, header_text: str) -> Optional[dict]:
+    """Template of the user's supplier whose name appears in the header text."""
+    templates = user_templates(user_id)
+    if not templates:
+        return None
+    header = _key(header_text)
+    # Longest name first, so "Acme Supplies" wins over "Acme".
+    for name in sorted(templates, key=len, reverse=True):
+        if len(name) >= MIN_NAME_CHARS and name in header:
+            return templates[name]
+    return None
@@ -0,0 +1,173 @@
+import threading
+from collections import OrderedDict
+from itertools import combinations
+from typing import Dict, List, Optional, Tuple
+
+from PIL import Image, ImageOps
+
+from budsi_database.models import Invoice
+from logic.debugger import debug
+
+# Constantes
+HASH_SIZE = 8                 # dHash of an 8x8 grid -> 64 bits
+CHUNKS = 4                    # multi-index hashing: 4 tables of 16-bit substrings
+CHUNK_BITS = HASH_SIZE * HASH_SIZE // CHUNKS
+MAX_DISTANCE = 6              # Hamming distance still considered the same receipt
+MAX_INDEXED_USERS = 256       # per-process LRU of user indexes
+
+# =============================================================================
+# Perceptual hash
+# =============================================================================
+
+def dhash(img: Image.Image) -> int:
+    """
+    64-bit difference hash: shrink to 9x8 greyscale and record whether each
+    pixel is brighter than its right neighbour. Survives re-compression,
+    resizing and small changes in lighting, unlike the byte hash.
+    """
+    # JPEG can decode straight to a reduced size, much cheaper for photos.
+    # Before exif_transpose, which returns a fully decoded copy.
+    img.draft("L", (HASH_SIZE * 8, HASH_SIZE * 8))
+    img = ImageOps.exif_transpose(img)
+    small = img.convert("L").resize((HASH_SIZE + 1, HASH_SIZE), Image.LANCZOS)
+    px = small.tobytes()
+    bits = 0
+    for row in range(HASH_SIZE):
+        offset = row * (HASH_SIZE + 1)
+        for col in range(HASH_SIZE):
+            bits = (bits << 1) | (px[offset + col] > px[offset + col + 1])
+    return bits
+
+def upload_dhash(f) -> Optional[int]:
+    """dHash of an uploaded image; None for PDFs or unreadable files."""
+    if (getattr(f, "name", "") or "").lower().endswith(".pdf"):
+        return None
+    try:
+        with Image.open(f) as img:
+            return dhash(img)
+    except Exception as e:
+        debug(f"Perceptual hash skipped: {e}")
+        return None
+    finally:
+        f.seek(0)
+
+# Invoice.image_hash is a signed BigIntegerField.
+def to_db(value: int) -> int:
+    return value - (1 << 64) if value >= 1 << 63 else value
+
+def from_db(value: int) -> int:
+    return value + (1 << 64) if value < 0 else value
+
+# =============================================================================
+# Multi-index hashing
+# =============================================================================
+
+def _masks(bits: int, radius: int) -> List[int]:
+    """All XOR masks of `bits` bits with at most `radius` bits set."""
+    masks = [0]
+    for r in range(1, radius + 1):
+        for positions in combinations(range(bits), r):
+            mask = 0
+            for p in positions:
+                mask |= 1 << p
+            masks.append(mask)
+    return masks
+
+_mask_cache: Dict[int, List[int]] = {}
+
+def _chunks(value: int) -> List[int]:
+    mask = (1 << CHUNK_BITS) - 1
+    return [(value >> (i * CHUNK_BITS)) & mask for i in range(CHUNKS)]
+
+class HammingIndex:
+    """
+    Hashes split into CHUNKS substrings, one dict per substring. Two hashes
+    within distance d share at least one substring within d // CHUNKS
+    (pigeonhole), so only those buckets are probed and the rest of the
+    collection is never compared.
+    """
+
+    def __init__(self):
+        self.tables: List[Dict[int, List[Tuple[int, int]]]] = [{} for _ in range(CHUNKS)]
+        self.values: Dict[int, int] = {}
+        self.last_id = 0
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    def add(self, item_id: int, value: int) -> None:
+        if item_id in self.values:
+            self.remove(item_id)
+        for table, chunk in zip(self.tables, _chunks(value)):
+            table.setdefault(chunk, []).append((value, item_id))
+        self.values[item_id] = value
+        self.last_id = max(self.last_id, item_id)
+
+    def remove(self, item_id: int) -> None:
+        value = self.values.pop(item_id, None)
+        if value is None:
+            return
+        for table, chunk in zip(self.tables, _chunks(value)):
+            kept = [entry for entry in table.get(chunk, ()) if entry[1] != item_id]
+            if kept:
+                table[chunk] = kept
+            else:
+                table.pop(chunk, None)
+
+    def search(self, value: int, max_distance: int = MAX_DISTANCE) -> List[Tuple[int, int]]:
+        """(distance, item_id) of every stored hash within max_distance, closest first."""
+        radius = max_distance // CHUNKS
+        masks = _mask_cache.get(radius)
+        if masks is None:
+            masks = _mask_cache[radius] = _masks(CHUNK_BITS, radius)
+        found: Dict[int, int] = {}
+        for table, chunk in zip(self.tables, _chunks(value)):
+            for mask in masks:
+                for stored, item_id in table.get(chunk ^ mask, ()):
+                    if item_id not in found:
+                        distance = (stored ^ value).bit_count()
+                        if distance <= max_distance:
+                            found[item_id] = distance
+        return sorted((d, i) for i, d in found.items())
+
+# =============================================================================
+# Per-user indexes
+# =============================================================================
+
+_indexes: "OrderedDict[int, HammingIndex]" = OrderedDict()
+_lock = threading.Lock()
+
+def index_for(user_id: int) -> HammingIndex:
+    """
+    In-memory index of a user's receipt hashes, kept per process and caught
+    up with a single `id > last_id` query, so new uploads from any worker
+    show up without rebuilding it.
+    """
+    with _lock:
+        index = _indexes.pop(user_id, None)
+        if index is None:
+            index = HammingIndex()
+        _indexes[user_id] = index
+        while len(_indexes) > MAX_INDEXED_USERS:
+            _indexes.popitem(last=False)
+        rows = (
+            Invoice.objects
+            .filter(user_id=user_id, id__gt=index.last_id, image_hash__isnull=False)
+            .values_list("id", "image_hash")
+        )
+        for item_id, value in rows.iterator():
+            index.add(item_id, from_db(value))
+    return index
+
+def find_near_duplicates(user, value: int, max_distance: int = MAX_DISTANCE) -> List[Invoice]:
+    """The user's invoices whose image looks like `value`, closest first."""
+    index = index_for(user.pk)
+    matches = index.search(value, max_distance)
+    if not matches:
+        return []
+    invoices = Invoice.objects.in_bulk([item_id for _, item_id in matches])
+    for _, item_id in matches:
+        if item_id not in invoices:  # deleted since it was indexed
+            with _lock:
+                index.remove(item_id)
+    return [invoices[item_id] for _, item_id in matches if item_id in invoices]
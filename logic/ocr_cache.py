@@ -0,0 +1,111 @@
+import hashlib
+from datetime import timedelta
+from typing import Optional
+
+from django.db import IntegrityError
+from django.db.models import F
+from django.utils import timezone
+
+from budsi_database.models import OcrJob, OcrResultCache
+
+# =============================================================================
+# Hashing
+# =============================================================================
+
+def hash_upload(f) -> str:
+    """
+    SHA-256 of an uploaded file, computed chunk by chunk. Uploads that went
+    through InvoiceUploadHandler were already hashed while streaming.
+    """
+    if getattr(f, "content_hash", None):
+        return f.content_hash
+    digest = hashlib.sha256()
+    for chunk in f.chunks():
+        digest.update(chunk)
+    f.seek(0)
+    return digest.hexdigest()
+
+# =============================================================================
+# Cache API
+# =============================================================================
+
+def get_cached_result(content_hash: str) -> Optional[dict]:
+    """Return the cached process_invoice() result for this content, if any."""
+    from logic.ocr_processor import PARSER_VERSION
+
+    if not content_hash:
+        return None
+    entry = (
+        OcrResultCache.objects
+        .filter(content_hash=content_hash, parser_version=PARSER_VERSION)
+        .only("id", "result")
+        .first()
+    )
+    if entry is None:
+        return None
+    OcrResultCache.objects.filter(id=entry.id).update(hits=F("hits") + 1, last_used_at=timezone.now())
+    return dict(entry.result)
+
+def is_cacheable(result: dict) -> bool:
+    """
+    Only real reads are cached: some text, from OCR or a PDF text layer.
+    A failed OCR (image_ocr swallows errors and returns no text and no
+    passes) must not be served to every later upload of the same file.
+    """
+    if not result or not (result.get("text") or "").strip():
+        return False
+    return (result.get("ocr_passes") or 0) > 0 or result.get("text_source") in ("text_layer", "mixed")
+
+def store_result(content_hash: str, result: dict, file_size: int = 0) -> None:
+    from logic.ocr_processor import PARSER_VERSION
+
+    if not content_hash or not is_cacheable(result):
+        return
+    try:
+        OcrResultCache.objects.update_or_create(
+            content_hash=content_hash,
+            parser_version=PARSER_VERSION,
+            defaults={"result": result, "file_size": file_size},
+        )
+    except IntegrityError:
+        # Another worker cached the same document at the same time.
+        pass
+
+def evict(max_entries: int = 0, max_age_days: int = 0) -> int:
+    """
+    Drop entries from old parser versions, entries not used in the last
+    `max_age_days` days and, beyond `max_entries`, the least recently used.
+    Returns the number of deleted rows.
+    """
+    from logic.ocr_processor import PARSER_VERSION
+
+    deleted, _ = OcrResultCache.objects.exclude(parser_version=PARSER_VERSION).delete()
+    if max_age_days:
+        cutoff = timezone.now() - timedelta(days=max_age_days)
+        n, _ = OcrResultCache.objects.filter(last_used_at__lt=cutoff).delete()
+        deleted += n
+    if max_entries:
+        stale_ids = list(
+            OcrResultCache.objects
+            .order_by("-last_used_at")
+            .values_list("id", flat=True)[max_entries:]
+        )
+        if stale_ids:
+            n, _ = OcrResultCache.objects.filter(id__in=stale_ids).delete()
+            deleted += n
+    return deleted
+
+def cache_stats(since=None) -> dict:
+    """Hit/miss counts from the OCR jobs (one job per upload) plus cache size."""
+    jobs = OcrJob.objects.all()
+    if since is not None:
+        jobs = jobs.filter(created_at__gte=since)
+    hits = jobs.filter(cache_hit=True).count()
+    misses = jobs.filter(cache_hit=False).count()
+    total = hits + misses
+    return {
+        "entries": OcrResultCache.objects.count(),
+        "hits": hits,
+        "misses": misses,
+        "hit_ratio": round(hits / total, 4) if total else 0.0,
+    }
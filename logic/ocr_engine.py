@@ -0,0 +1,208 @@
+import os
+import platform
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import List, NamedTuple, Optional
+
+import pytesseract
+from PIL import Image
+
+# tesserocr (optional) talks to libtesseract directly, so the language model
+# is loaded once per process instead of once per image.
+try:
+    import tesserocr
+except ImportError:  # pragma: no cover - optional dependency
+    tesserocr = None
+
+# =============================================================================
+# Tesseract Configuration
+# =============================================================================
+
+def _maybe_set_tesseract_path():
+    """
+    Try to set a Tesseract path only if it exists.
+    On Windows, use the typical path; on macOS/Linux, avoid changing if already in PATH.
+    """
+    if platform.system() == 'Windows':
+        win_paths = [
+            r'C:\Program Files\Tesseract-OCR\tesseract.exe',
+            r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe'
+        ]
+        for p in win_paths:
+            if os.path.exists(p):
+                pytesseract.pytesseract.tesseract_cmd = p
+                return
+    else:
+        # If the user already has it in PATH, better not force it.
+        # On macOS with Homebrew, adjust if needed:
+        brew_path = '/opt/homebrew/bin/tesseract'
+        if os.path.exists(brew_path):
+            pytesseract.pytesseract.tesseract_cmd = brew_path
+
+_maybe_set_tesseract_path()
+
+# 'auto' uses tesserocr when installed, otherwise pytesseract.
+OCR_ENGINE = os.getenv('OCR_ENGINE', 'auto')
+OCR_LANG = 'eng'
+# psm 6: assume block of text; oem 3: default LSTM
+OCR_PSM = 6
+OCR_OEM = 3
+
+# =============================================================================
+# Engines
+# =============================================================================
+
+class OcrWord(NamedTuple):
+    text: str
+    conf: float      # 0-100 as reported by tesseract (-1 = no confidence)
+    left: int
+    top: int
+    width: int
+    height: int
+    line: tuple      # identifies the text line the word belongs to
+
+def words_to_text(words: List[OcrWord]) -> str:
+    """Rebuild plain text (one line per OCR line) from word boxes."""
+    lines: dict = {}
+    for w in words:
+        lines.setdefault(w.line, []).append(w.text)
+    return "\n".join(" ".join(parts) for parts in lines.values())
+
+class OcrEngine:
+    """Common interface of the OCR backends."""
+    name = 'base'
+
+    def image_to_string(self, img: Image.Image) -> str:
+        raise NotImplementedError
+
+    def image_to_data(self, img: Image.Image) -> List[OcrWord]:
+        """Words with confidence and bounding box, in reading order."""
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+class PytesseractEngine(OcrEngine):
+    """Fallback backend: runs the tesseract CLI once per image."""
+    name = 'pytesseract'
+
+    def __init__(self, lang: str = OCR_LANG, psm: int = OCR_PSM, oem: int = OCR_OEM):
+        self.lang = lang
+        self.config = f'--oem {oem} --psm {psm}'
+
+    def image_to_string(self, img: Image.Image) -> str:
+        return pytesseract.image_to_string(img, lang=self.lang, config=self.config)
+
+    def image_to_data(self, img: Image.Image) -> List[OcrWord]:
+        data = pytesseract.image_to_data(
+            img, lang=self.lang, config=self.config, output_type=pytesseract.Output.DICT
+        )
+        words = []
+        for i, text in enumerate(data['text']):
+            if not (text or '').strip():
+                continue
+            words.append(OcrWord(
+                text=text,
+                conf=float(data['conf'][i]),
+                left=int(data['left'][i]),
+                top=int(data['top'][i]),
+                width=int(data['width'][i]),
+                height=int(data['height'][i]),
+                line=(data['block_num'][i], data['par_num'][i], data['line_num'][i]),
+            ))
+        return words
+
+class TesserocrEngine(OcrEngine):
+    """Keeps one initialised libtesseract handle alive and reuses it."""
+    name = 'tesserocr'
+
+    def __init__(self, lang: str = OCR_LANG, psm: int = OCR_PSM, oem: int = OCR_OEM):
+        if tesserocr is None:
+            raise RuntimeError("tesserocr is not installed")
+        self._api = tesserocr.PyTessBaseAPI(lang=lang, psm=psm, oem=oem)
+        self._lock = threading.Lock()
+
+    def image_to_string(self, img: Image.Image) -> str:
+        with self._lock:
+            self._api.SetImage(img)
+            return self._api.GetUTF8Text()
+
+    def image_to_data(self, img: Image.Image) -> List[OcrWord]:
+        word_level = tesserocr.RIL.WORD
+        words = []
+        with self._lock:
+            self._api.SetImage(img)
+            self._api.Recognize()
+            iterator = self._api.GetIterator()
+            if iterator is None:
+                return words
+            line = -1
+            for r in tesserocr.iterate_level(iterator, word_level):
+                if r.IsAtBeginningOf(tesserocr.RIL.TEXTLINE):
+                    line += 1
+                text = r.GetUTF8Text(word_level) or ''
+                if not text.strip():
+                    continue
+                x1, y1, x2, y2 = r.BoundingBox(word_level)
+                words.append(OcrWord(text, r.Confidence(word_level), x1, y1, x2 - x1, y2 - y1, (line,)))
+        return words
+
+    def close(self) -> None:
+        self._api.End()
+
+def create_engine(name: Optional[str] = None) -> OcrEngine:
+    name = (name or OCR_ENGINE).lower()
+    if name in ('auto', 'tesserocr') and tesserocr is not None:
+        try:
+            return TesserocrEngine()
+        except Exception as e:
+            print(f"[OCR] Could not start tesserocr, using pytesseract: {e}")
+    elif name in ('auto', 'tesserocr'):
+        # Works, but every image starts a tesseract process and reloads the model.
+        print("[OCR] tesserocr not installed, using pytesseract (see requirements.txt).")
+    return PytesseractEngine()
+
+_engine: Optional[OcrEngine] = None
+
+def get_engine() -> OcrEngine:
+    """Engine of the current process, created (and warmed up) on first use."""
+    global _engine
+    if _engine is None:
+        _engine = create_engine()
+        print(f"[OCR] Engine ready: {_engine.name} (pid {os.getpid()})")
+    return _engine
+
+# =============================================================================
+# Warm worker pool
+# =============================================================================
+
+def _warm_worker():
+    """Pool initializer: load the engine before the first task arrives."""
+    get_engine()
+
+_pool: Optional[ProcessPoolExecutor] = None
+_pool_size = 0
+
+def get_pool(workers: int) -> ProcessPoolExecutor:
+    """
+    Long-lived pool of OCR processes, each holding its own warm engine.
+    Kept between calls and re-created only if the size changes.
+    """
+    global _pool, _pool_size
+    if _pool is None or _pool_size != workers:
+        if _pool is not None:
+            _pool.shutdown(wait=False)
+        _pool = ProcessPoolExecutor(max_workers=workers, initializer=_warm_worker)
+        _pool_size = workers
+    return _pool
+
+def reset_pool() -> None:
+    """
+    Drop the pool (e.g. after a child died: the executor is then broken for
+    good); the next get_pool() starts a fresh one.
+    """
+    global _pool, _pool_size
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+    _pool = None
+    _pool_size = 0
@@ -1,38 +1,59 @@
 import re
 import os
-import platform
-from typing import Tuple, List
+from typing import Callable, Dict, NamedTuple, Tuple, List, Optional
 
-import pytesseract
 from PIL import Image, ImageEnhance, ImageFilter
-from pdf2image import convert_from_path
+from pdf2image import convert_from_path, pdfinfo_from_path
+from PyPDF2 import PdfReader
+
+from logic.ocr_engine import OcrWord, get_engine, get_pool, reset_pool, words_to_text
 
 # =============================================================================
-# Tesseract Configuration
+# OCR Configuration
 # =============================================================================
 
-def _maybe_set_tesseract_path():
-    """
-    Try to set a Tesseract path only if it exists.
-    On Windows, use the typical path; on macOS/Linux, avoid changing if already in PATH.
-    """
-    if platform.system() == 'Windows':
-        win_paths = [
-            r'C:\Program Files\Tesseract-OCR\tesseract.exe',
-            r'C:\Program Files (x86)\Tesseract-OCR\tesseract.exe'
-        ]
-        for p in win_paths:
-            if os.path.exists(p):
-                pytesseract.pytesseract.tesseract_cmd = p
-                return
-    else:
-        # If the user already has it in PATH, better not force it.
-        # On macOS with Homebrew, adjust if needed:
-        brew_path = '/opt/homebrew/bin/tesseract'
-        if os.path.exists(brew_path):
-            pytesseract.pytesseract.tesseract_cmd = brew_path
+PDF_DPI = 300
+
+# Processes used to OCR the pages of a PDF concurrently (1 = sequential).
+PDF_OCR_WORKERS = int(os.getenv('OCR_PDF_WORKERS', '1'))
+# Pages rendered at once in sequential mode, and max pages read per PDF (0 = all).
+PDF_PAGE_WINDOW = int(os.getenv('OCR_PDF_WINDOW', '1'))
+PDF_MAX_PAGES = int(os.getenv('OCR_MAX_PDF_PAGES', '50'))
+# A page whose embedded text has fewer alphanumerics than this is OCR'd instead.
+MIN_TEXT_LAYER_CHARS = 20
+# Pages whose embedded text is read (0 = all). No rendering, so far above
+# OCR_MAX_PDF_PAGES: the total of a long statement is on its last page.
+PDF_TEXT_MAX_PAGES = int(os.getenv('OCR_MAX_TEXT_PAGES', '2000'))
+
+# Multi-pass OCR: a cheap low-resolution pass first; the heavy pre-processing
+# and 300-dpi pass run only when the total/VAT/date lines come back below the
+# confidence threshold (FiscalProfile.ocr_confidence_threshold).
+OCR_MULTIPASS = os.getenv('OCR_MULTIPASS', 'True') == 'True'
+DEFAULT_CONFIDENCE_THRESHOLD = 0.70
+CHEAP_MAX_SIDE = 1200
+CHEAP_PDF_DPI = 150
+
+KEY_FIELD_LINE = re.compile(
+    r'(?i)\b(?:total|vat|iva)\b|\b\d{2}[/-]\d{2}[/-]\d{4}\b|\b\d{4}-\d{2}-\d{2}\b'
+)
+
+# Layout-aware mode: the heavy pass OCRs only the header and the
+# total/VAT/date lines found by the cheap pass, falling back to the full page.
+OCR_LAYOUT_MODE = os.getenv('OCR_LAYOUT_MODE', 'False') == 'True'
+HEADER_LINES = 4
+REGION_PADDING = 0.6   # of the line height, above and below each region
 
-_maybe_set_tesseract_path()
+# Supplier layout templates (logic/layout_templates.py): the top band of the
+# page is read to recognise the supplier, then only the learned boxes.
+TEMPLATE_HEADER_BAND = 0.22
+
+class OcrText(NamedTuple):
+    text: str
+    confidence: Optional[float]    # 0-1 on the key fields; None when not measured
+    passes: int                    # OCR passes run (0 = no OCR, e.g. text layer)
+    roi: bool = False              # heavy pass ran on cropped regions only
+    layout: Optional[list] = None  # header/key lines with page-relative positions
+    template: bool = False         # read with a supplier layout template
 
 # =============================================================================
 # OCR utilities
@@ -59,41 +80,424 @@ def _preprocess_image(img: Image.Image) -> Image.Image:
     img = img.filter(ImageFilter.SHARPEN)
     return img
 
-def image_to_text(file_path: str) -> str:
-    img = Image.open(file_path)
-    img = _preprocess_image(img)
-    # psm 6: assume block of text; oem 3: default LSTM
-    config = '--oem 3 --psm 6'
+def _cheap_image(img: Image.Image) -> Image.Image:
+    """First-pass image: grayscale and capped at CHEAP_MAX_SIDE, no enhancement."""
+    w, h = img.size
+    if max(w, h) > CHEAP_MAX_SIDE:
+        factor = CHEAP_MAX_SIDE / max(w, h)
+        img = img.resize((int(w * factor), int(h * factor)))
+    return img.convert('L')
+
+def field_confidence(words: List[OcrWord], require_fields: bool = True) -> float:
+    """
+    Mean word confidence (0-1) on the lines that hold the total, VAT or date.
+    If none of those lines was read, returns 0.0 (or, with
+    require_fields=False, the mean confidence of every word).
+    """
+    lines: Dict[tuple, List[OcrWord]] = {}
+    for w in words:
+        lines.setdefault(w.line, []).append(w)
+
+    key_confs, all_confs = [], []
+    for line_words in lines.values():
+        confs = [w.conf for w in line_words if w.conf >= 0]
+        all_confs.extend(confs)
+        if KEY_FIELD_LINE.search(" ".join(w.text for w in line_words)):
+            key_confs.extend(confs)
+
+    confs = key_confs or ([] if require_fields else all_confs)
+    return (sum(confs) / len(confs)) / 100 if confs else 0.0
+
+def find_regions(words: List[OcrWord], size: Tuple[int, int]) -> List[Tuple[int, int, int, int]]:
+    """
+    Boxes (left, top, right, bottom) worth OCR'ing at full resolution: the
+    header band down to the first HEADER_LINES lines (supplier, description)
+    and every total/VAT/date line, as full-width strips. Returns [] when no
+    key line was found, so the caller falls back to the full page.
+    """
+    lines: Dict[tuple, List[OcrWord]] = {}
+    for w in words:
+        lines.setdefault(w.line, []).append(w)
+
+    boxes = []
+    for line_words in lines.values():
+        top = min(w.top for w in line_words)
+        bottom = max(w.top + w.height for w in line_words)
+        text = " ".join(w.text for w in line_words)
+        boxes.append((top, bottom, bool(KEY_FIELD_LINE.search(text))))
+    boxes.sort()
+
+    if not any(is_key for _, _, is_key in boxes):
+        return []
+
+    width, height = size
+    spans = []
+    header = boxes[:HEADER_LINES]
+    header_pad = int((header[-1][1] - header[-1][0]) * REGION_PADDING)
+    spans.append((0, header[-1][1] + header_pad))
+    for top, bottom, is_key in boxes[HEADER_LINES:]:
+        if is_key:
+            pad = int((bottom - top) * REGION_PADDING)
+            spans.append((max(0, top - pad), bottom + pad))
+
+    merged: List[List[int]] = []
+    for top, bottom in sorted(spans):
+        if merged and top <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], bottom)
+        else:
+            merged.append([top, bottom])
+    return [(0, top, width, min(bottom, height)) for top, bottom in merged]
+
+def _roi_text(words: List[OcrWord], cheap_size: Tuple[int, int], full_img: Image.Image) -> Optional[str]:
+    """OCR only the regions found on the cheap image, cropped from the full one."""
+    regions = find_regions(words, cheap_size)
+    if not regions:
+        return None
+
+    sx = full_img.width / cheap_size[0]
+    sy = full_img.height / cheap_size[1]
+    engine = get_engine()
+    texts = []
+    for left, top, right, bottom in regions:
+        crop = full_img.crop((int(left * sx), int(top * sy), int(right * sx), int(bottom * sy)))
+        crop_img = _preprocess_image(crop)
+        try:
+            texts.append(engine.image_to_string(crop_img))
+        finally:
+            crop_img.close()
+    return "\n".join(texts)
+
+def line_layout(words: List[OcrWord], size: Tuple[int, int]) -> list:
+    """
+    Header lines and total/VAT/date lines of a page with their vertical span
+    relative to the page height. Stored with the OCR result so a supplier
+    template can be learned once the user confirms the values.
+    """
+    lines: Dict[tuple, List[OcrWord]] = {}
+    for w in words:
+        lines.setdefault(w.line, []).append(w)
+
+    height = float(size[1] or 1)
+    rows = []
+    for line_words in lines.values():
+        text = " ".join(w.text for w in line_words)
+        top = min(w.top for w in line_words)
+        bottom = max(w.top + w.height for w in line_words)
+        rows.append((top, bottom, text))
+    rows.sort()
+
+    layout = []
+    for i, (top, bottom, text) in enumerate(rows):
+        if i < HEADER_LINES or KEY_FIELD_LINE.search(text):
+            layout.append({"text": text, "top": round(top / height, 4), "bottom": round(bottom / height, 4)})
+    return layout
+
+def _template_ocr(img: Image.Image, threshold: float, template_for: Callable[[str], Optional[dict]]) -> Optional[OcrText]:
+    """
+    Targeted OCR with a supplier template: read the header band of a small
+    copy to recognise the supplier, then only the template's strips at full
+    resolution. Returns None (generic OCR follows) when no template matches
+    or the fields come back below `threshold`.
+    """
+    engine = get_engine()
+    cheap_img = _cheap_image(img)
+    band = cheap_img.crop((0, 0, cheap_img.width, int(cheap_img.height * TEMPLATE_HEADER_BAND)))
+    header = engine.image_to_string(band).strip()
+    template = template_for(header) if header else None
+    if not template or not template.get("fields"):
+        return None
+
+    spans = sorted(tuple(span) for span in template["fields"].values())
+    merged: List[List[float]] = []
+    for top, bottom in spans:
+        if merged and top <= merged[-1][1]:
+            merged[-1][1] = max(merged[-1][1], bottom)
+        else:
+            merged.append([top, bottom])
+
+    width, height = img.size
+    texts, words = [header], []
+    for i, (top, bottom) in enumerate(merged):
+        crop = img.crop((0, int(max(0.0, top) * height), width, int(min(1.0, bottom) * height)))
+        crop_img = _preprocess_image(crop)
+        try:
+            strip_words = [w._replace(line=(i,) + tuple(w.line)) for w in engine.image_to_data(crop_img)]
+        finally:
+            crop_img.close()
+        words.extend(strip_words)
+        texts.append(words_to_text(strip_words))
+
+    confidence = field_confidence(words, require_fields=True)
+    if confidence < threshold:
+        print(f"[OCR] Template fields below threshold ({confidence:.2f}), running full OCR.")
+        return None
+    return OcrText("\n".join(texts), confidence, 1, roi=True, template=True)
+
+def _ocr_multipass(cheap_img: Image.Image, threshold: float, load_full, require_fields: bool) -> OcrText:
+    """
+    Cheap pass on a small image; only when the key fields come back below
+    `threshold` is the full-resolution image loaded, enhanced and OCR'd again
+    (just the header/totals regions in layout mode).
+    """
+    engine = get_engine()
+    words = engine.image_to_data(cheap_img)
+    confidence = field_confidence(words, require_fields)
+    layout = line_layout(words, cheap_img.size)
+    if confidence >= threshold:
+        return OcrText(words_to_text(words), confidence, 1, layout=layout)
+
+    source_img = load_full()
+    if OCR_LAYOUT_MODE:
+        roi_text = _roi_text(words, cheap_img.size, source_img)
+        if roi_text is not None:
+            return OcrText(roi_text, confidence, 2, roi=True, layout=layout)
+
+    full_img = _preprocess_image(source_img)
     try:
-        text = pytesseract.image_to_string(img, lang='eng', config=config)
+        return OcrText(engine.image_to_string(full_img), confidence, 2, layout=layout)
+    finally:
+        full_img.close()
+
+def image_ocr(
+    file_path: str,
+    confidence_threshold: Optional[float] = None,
+    template_for: Optional[Callable[[str], Optional[dict]]] = None,
+) -> OcrText:
+    """
+    OCR an image. template_for(header_text) may return a supplier layout
+    template, in which case only its boxes are read (see _template_ocr).
+    """
+    threshold = DEFAULT_CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+    try:
+        img = Image.open(file_path)
+        if template_for is not None:
+            templated = _template_ocr(img, threshold, template_for)
+            if templated is not None:
+                return templated
+        if not OCR_MULTIPASS:
+            return OcrText(get_engine().image_to_string(_preprocess_image(img)), None, 1)
+        return _ocr_multipass(_cheap_image(img), threshold, lambda: img, require_fields=True)
     except Exception as e:
         print(f"[OCR] Error in image_to_text: {e}")
-        text = ""
-    return text
+        return OcrText("", None, 0)
+
+def image_to_text(file_path: str, confidence_threshold: Optional[float] = None) -> str:
+    return image_ocr(file_path, confidence_threshold).text
+
+def _render_pdf_page(file_path: str, page_no: int, dpi: int) -> Image.Image:
+    return convert_from_path(file_path, dpi=dpi, first_page=page_no, last_page=page_no)[0]
 
-def pdf_to_text(file_path: str) -> str:
+def _ocr_rendered_page(file_path: str, page_no: int, page_img: Image.Image, threshold: float) -> OcrText:
+    """
+    OCR a page rendered at _first_pass_dpi(). Pages without total/VAT/date
+    lines (item listings) are judged on the confidence of all their words.
+    """
+    if not OCR_MULTIPASS:
+        full_img = _preprocess_image(page_img)
+        try:
+            return OcrText(get_engine().image_to_string(full_img), None, 1)
+        finally:
+            full_img.close()
+    return _ocr_multipass(
+        _cheap_image(page_img), threshold,
+        lambda: _render_pdf_page(file_path, page_no, PDF_DPI),
+        require_fields=False,
+    )
+
+def _first_pass_dpi() -> int:
+    return CHEAP_PDF_DPI if OCR_MULTIPASS else PDF_DPI
+
+def _ocr_pdf_page(file_path: str, page_no: int, threshold: float = DEFAULT_CONFIDENCE_THRESHOLD) -> OcrText:
+    """
+    Rasterize and OCR a single PDF page. Runs inside the warm OCR pool, so
+    each worker renders its own page instead of receiving a pickled image.
+    """
     try:
-        pages = convert_from_path(file_path, dpi=300)
+        page_img = _render_pdf_page(file_path, page_no, _first_pass_dpi())
+        try:
+            result = _ocr_rendered_page(file_path, page_no, page_img, threshold)
+        finally:
+            page_img.close()
+        print(f"[OCR] Page {page_no}: {len(result.text)} characters extracted (pass {result.passes}).")
+        return result
+    except Exception as e:
+        print(f"[OCR] Error in OCR for page {page_no}: {e}")
+        return OcrText("", None, 0)
+
+def _pdf_page_count(file_path: str, max_pages: int) -> int:
+    page_count = int(pdfinfo_from_path(file_path)['Pages'])
+    if max_pages and page_count > max_pages:
+        print(f"[OCR] PDF has {page_count} pages; only the first {max_pages} will be read.")
+        page_count = max_pages
+    return page_count
+
+def _page_batches(page_numbers: List[int], window: int):
+    """Group page numbers into runs of consecutive pages, at most `window` long."""
+    window = max(1, window)
+    run: List[int] = []
+    for page_no in page_numbers:
+        if run and (page_no != run[-1] + 1 or len(run) >= window):
+            yield run[0], run[-1]
+            run = []
+        run.append(page_no)
+    if run:
+        yield run[0], run[-1]
+
+def _iter_pdf_pages(file_path: str, page_numbers: List[int], window: int, dpi: int = PDF_DPI):
+    """
+    Yield (page_no, image) rendering at most `window` pages at a time, so a
+    long scan never has every 300-dpi page in memory at once.
+    """
+    for first, last in _page_batches(page_numbers, window):
+        images = convert_from_path(file_path, dpi=dpi, first_page=first, last_page=last)
+        for offset, img in enumerate(images):
+            yield first + offset, img
+        del images
+
+def _ocr_pdf_pages(
+    file_path: str,
+    page_numbers: List[int],
+    workers: int,
+    window: int,
+    threshold: float = DEFAULT_CONFIDENCE_THRESHOLD,
+) -> Dict[int, OcrText]:
+    """OCR the given pages and return {page_no: OcrText}."""
+    if workers > 1 and len(page_numbers) > 1:
+        try:
+            pool = get_pool(workers)
+            n = len(page_numbers)
+            # map() yields results in submission order, so texts line up with page_numbers.
+            results = pool.map(_ocr_pdf_page, [file_path] * n, page_numbers, [threshold] * n)
+            return dict(zip(page_numbers, results))
+        except Exception as e:
+            print(f"[OCR] Parallel OCR failed, falling back to sequential: {e}")
+            reset_pool()
+
+    results: Dict[int, OcrText] = {}
+    try:
+        for i, page in _iter_pdf_pages(file_path, page_numbers, window, dpi=_first_pass_dpi()):
+            try:
+                result = _ocr_rendered_page(file_path, i, page, threshold)
+                print(f"[OCR] Page {i}: {len(result.text)} characters extracted (pass {result.passes}).")
+                results[i] = result
+            except Exception as e:
+                print(f"[OCR] Error in OCR for page {i}: {e}")
+            finally:
+                page.close()
     except Exception as e:
         print(f"[OCR] Error converting PDF to images: {e}")
-        return ""
+    return results
+
+def _merge_pages(pages: Dict[int, OcrText]) -> OcrText:
+    """Join page results in page order; confidence is the worst page's."""
+    ordered = [pages[p] for p in sorted(pages)]
+    confs = [r.confidence for r in ordered if r.confidence is not None]
+    return OcrText(
+        "\n".join(r.text for r in ordered),
+        min(confs) if confs else None,
+        max((r.passes for r in ordered), default=0),
+        any(r.roi for r in ordered),
+    )
+
+def pdf_ocr(
+    file_path: str,
+    workers: Optional[int] = None,
+    max_pages: Optional[int] = None,
+    window: Optional[int] = None,
+    pages: Optional[List[int]] = None,
+    confidence_threshold: Optional[float] = None,
+) -> OcrText:
+    """
+    OCR the pages of a PDF, streaming them: each page (or window of pages)
+    is rendered, pre-processed, OCR'd and freed before the next one.
+      - workers > 1: pages are OCR'd concurrently in a process pool
+        (default OCR_PDF_WORKERS)
+      - max_pages: only the first N pages are read (default OCR_MAX_PDF_PAGES,
+        0 = no limit)
+      - window: pages rendered per batch in sequential mode (default OCR_PDF_WINDOW)
+      - pages: OCR only these page numbers (1-based)
+      - confidence_threshold: below it a page gets the heavy 300-dpi pass
+    """
+    workers = PDF_OCR_WORKERS if workers is None else workers
+    max_pages = PDF_MAX_PAGES if max_pages is None else max_pages
+    window = PDF_PAGE_WINDOW if window is None else window
+    threshold = DEFAULT_CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+
+    if pages is None:
+        try:
+            page_count = _pdf_page_count(file_path, max_pages)
+        except Exception as e:
+            print(f"[OCR] Error reading PDF info: {e}")
+            return OcrText("", None, 0)
+        pages = list(range(1, page_count + 1))
+
+    return _merge_pages(_ocr_pdf_pages(file_path, sorted(pages), workers, window, threshold))
+
+def pdf_to_text(file_path: str, **kwargs) -> str:
+    """Plain-text version of pdf_ocr() (same keyword arguments)."""
+    return pdf_ocr(file_path, **kwargs).text
+
+def _has_usable_text(text: str) -> bool:
+    return sum(ch.isalnum() for ch in text or '') >= MIN_TEXT_LAYER_CHARS
+
+def pdf_text_layer(file_path: str, max_pages: Optional[int] = None) -> List[str]:
+    """
+    Embedded text of each page (digital PDFs from accounting software).
+    Pages without usable text come back as ''.
+    """
+    max_pages = PDF_TEXT_MAX_PAGES if max_pages is None else max_pages
+    try:
+        reader = PdfReader(file_path)
+        if reader.is_encrypted:
+            reader.decrypt('')
+        pages = reader.pages
+        count = min(len(pages), max_pages) if max_pages else len(pages)
+    except Exception as e:
+        print(f"[OCR] Could not read PDF text layer: {e}")
+        return []
 
-    all_text = []
-    for i, page in enumerate(pages, start=1):
+    texts = []
+    for i in range(count):
         try:
-            page_img = _preprocess_image(page)
-            config = '--oem 3 --psm 6'
-            page_text = pytesseract.image_to_string(page_img, lang='eng', config=config)
-            print(f"[OCR] Page {i}: {len(page_text)} characters extracted.")
-            all_text.append(page_text)
+            text = pages[i].extract_text() or ''
         except Exception as e:
-            print(f"[OCR] Error in OCR for page {i}: {e}")
-    return "\n".join(all_text)
+            print(f"[OCR] Error extracting text layer of page {i + 1}: {e}")
+            text = ''
+        texts.append(text if _has_usable_text(text) else '')
+    return texts
+
+def pdf_extract_text(file_path: str, confidence_threshold: Optional[float] = None) -> Tuple[OcrText, str]:
+    """
+    Text of a PDF using the embedded text layer where possible and OCR only
+    for pages without one. Returns (OcrText, source) where source is
+    'text_layer', 'ocr' or 'mixed'.
+    """
+    threshold = DEFAULT_CONFIDENCE_THRESHOLD if confidence_threshold is None else confidence_threshold
+    layer = pdf_text_layer(file_path)
+    missing = [i for i, t in enumerate(layer, start=1) if not t]
+
+    if not layer:
+        return pdf_ocr(file_path, confidence_threshold=threshold), 'ocr'
+    if not missing:
+        print(f"[OCR] Using embedded text layer ({len(layer)} pages).")
+        return OcrText("\n".join(layer), None, 0), 'text_layer'
+
+    # Only the pages rasterised for OCR are capped by OCR_MAX_PDF_PAGES.
+    to_ocr = missing[:PDF_MAX_PAGES] if PDF_MAX_PAGES else missing
+    ocr_pages = _ocr_pdf_pages(file_path, to_ocr, PDF_OCR_WORKERS, PDF_PAGE_WINDOW, threshold)
+    merged = _merge_pages(ocr_pages)
+    texts = [t or (ocr_pages[i].text if i in ocr_pages else '') for i, t in enumerate(layer, start=1)]
+    source = 'ocr' if len(missing) == len(layer) else 'mixed'
+    print(f"[OCR] Text layer on {len(layer) - len(missing)} pages, OCR on {len(to_ocr)} of {len(missing)}.")
+    return OcrText("\n".join(texts), merged.confidence, merged.passes, merged.roi), source
 
 # =============================================================================
 # Parsing and extraction utilities
 # =============================================================================
 
+# Bump when the parsing below changes, so cached/stored results are redone.
+PARSER_VERSION = 1
+
 MONEY_TOKEN = re.compile(
     r'([€$]?\s*[+-]?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{2}))'
 )
@@ -145,71 +549,142 @@ def _clean_lines(text: str) -> List[str]:
     lines = [l.strip() for l in text.splitlines()]
     return [l for l in lines if l]
 
-def extract_date(text: str) -> str:
+# ---- Line tokenizer ----
+# One scan of the text jumps from keyword to keyword; each line that mentions
+# total/VAT/tax IDs is classified once and its money tokens are collected
+# right there. Lines without keywords cost nothing in Python. The full token
+# list and the multi-line 'Total' fallback are only computed when needed.
+
+LINE_TOTAL = 1          # 'Total' (not 'Subtotal')
+LINE_SUBTOTAL = 2
+LINE_VAT = 4            # 'VAT'/'IVA' amount line
+LINE_VAT_RATE = 8       # VAT line with a rate ('@ 23%'), preferred
+LINE_VAT_NUMBER = 16    # 'VAT No', 'Tax ID', 'NIF', 'CIF' (not an amount)
+
+LINE_KEYWORD = re.compile(r'(?i)total|vat|iva|tax|nif|cif')
+LINE_BREAKS = re.compile(r'[\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]')  # besides \n, as in str.splitlines()
+TOTAL_WORD = re.compile(r'(?i)\btotal\b')
+SUBTOTAL_WORD = re.compile(r'(?i)sub\s*total')
+VAT_WORD = re.compile(r'(?i)\b(vat|iva)\b')
+VAT_NUMBER_WORD = re.compile(r'(?i)\b(vat\s*(no|number)|tax\s*id|nif|cif)\b')
+VAT_RATE = re.compile(r'(?i)@\s*\d{1,2}')
+DATE_DMY = re.compile(r'\b(\d{2}[/-]\d{2}[/-]\d{4})\b')
+DATE_ISO = re.compile(r'\b(\d{4}-\d{2}-\d{2})\b')
+TOTAL_FALLBACK = re.compile(
+    r'(?is)\btotal\b[^0-9€$+-]*([€$]?\s*[+-]?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{2}))'
+)
+
+class ParsedText(NamedTuple):
+    text: str                         # text with line breaks normalised to '\n'
+    kinds: List[int]                  # LINE_* flags of each keyword line, in order
+    last_tokens: List[Optional[str]]  # last money token of each keyword line
+    date: str
+
+    def first_lines(self, n: int) -> List[str]:
+        return _first_nonempty_lines(self.text, n)
+
+    def money_tokens(self) -> List[str]:
+        return MONEY_TOKEN.findall(self.text)
+
+    def total_fallback(self) -> Optional[str]:
+        """First amount after a 'Total' word, even on a later line."""
+        m = TOTAL_FALLBACK.search(self.text)
+        return m.group(1) if m else None
+
+def classify_line(line: str) -> int:
+    kind = 0
+    if SUBTOTAL_WORD.search(line):
+        kind |= LINE_SUBTOTAL
+    elif TOTAL_WORD.search(line):
+        kind |= LINE_TOTAL
+    if VAT_NUMBER_WORD.search(line):
+        kind |= LINE_VAT_NUMBER
+    elif VAT_WORD.search(line):
+        kind |= LINE_VAT
+        if VAT_RATE.search(line):
+            kind |= LINE_VAT_RATE
+    return kind
+
+def tokenize(text: str) -> ParsedText:
+    text = text or ''
+    if LINE_BREAKS.search(text):
+        text = LINE_BREAKS.sub('\n', text)
+
+    kinds: List[int] = []
+    last_tokens: List[Optional[str]] = []
+    pos = 0
+    while True:
+        m = LINE_KEYWORD.search(text, pos)
+        if m is None:
+            break
+        start = text.rfind('\n', 0, m.start()) + 1
+        end = text.find('\n', m.end())
+        if end < 0:
+            end = len(text)
+        pos = end + 1
+
+        line = text[start:end]
+        kind = classify_line(line)
+        if kind:
+            toks = MONEY_TOKEN.findall(line) if kind & (LINE_TOTAL | LINE_VAT) else None
+            kinds.append(kind)
+            last_tokens.append(toks[-1] if toks else None)
+
+    m = DATE_DMY.search(text) or DATE_ISO.search(text)
+    return ParsedText(text, kinds, last_tokens, m.group(1) if m else '')
+
+def extract_date(text: str, parsed: Optional[ParsedText] = None) -> str:
     """
     Return a date in the format found (dd/mm/yyyy, dd-mm-yyyy, yyyy-mm-dd).
     If not found, return an empty string.
     """
-    m = re.search(r'\b(\d{2}[/-]\d{2}[/-]\d{4})\b', text)
-    if m:
-        return m.group(1)
-    m = re.search(r'\b(\d{4}-\d{2}-\d{2})\b', text)
-    if m:
-        return m.group(1)
-    return ""
+    parsed = parsed or tokenize(text)
+    return parsed.date
 
-def extract_amounts(text: str) -> Tuple[float, float]:
+def extract_amounts(text: str, parsed: Optional[ParsedText] = None) -> Tuple[float, float]:
     """
     Extract Total and VAT robustly:
       - 'Total' per line (avoids 'Subtotal')
       - 'VAT/IVA' per line, avoiding 'VAT No', 'VAT Number', 'Tax ID', etc.
       - Monetary tokens with decimal or symbol.
       - Sanity check: if VAT > Total, try to fix; if not, set VAT=0.
+    Pass `parsed` (from tokenize) to reuse an existing tokenization.
     """
-    lines = _clean_lines(text)
+    parsed = parsed or tokenize(text)
+    kinds, last_tokens = parsed.kinds, parsed.last_tokens
 
     # --- TOTAL ---
     total = 0.0
-    total_lines = [ln for ln in lines
-                   if re.search(r'(?i)\btotal\b', ln)
-                   and not re.search(r'(?i)sub\s*total', ln)]
-    for ln in reversed(total_lines):
-        toks = _money_tokens_in(ln)
-        if toks:
-            total = parse_money(toks[-1])
+    for i in range(len(kinds) - 1, -1, -1):
+        if kinds[i] & LINE_TOTAL and last_tokens[i]:
+            total = parse_money(last_tokens[i])
             break
 
     if total == 0.0:
-        m = re.search(
-            r'(?is)\btotal\b[^0-9€$+-]*([€$]?\s*[+-]?(?:\d{1,3}(?:[.,]\d{3})+|\d+)(?:[.,]\d{2}))',
-            text
-        )
-        if m:
-            total = parse_money(m.group(1))
+        fallback = parsed.total_fallback()
+        if fallback:
+            total = parse_money(fallback)
 
     # --- VAT ---
     vat = 0.0
-    vat_exclude = re.compile(r'(?i)\b(vat\s*(no|number)|tax\s*id|nif|cif)\b')
-    vat_lines = [ln for ln in lines
-                 if re.search(r'(?i)\b(vat|iva)\b', ln) and not vat_exclude.search(ln)]
-
-    vat_lines_sorted = sorted(
-        vat_lines,
-        key=lambda s: 0 if re.search(r'(?i)@\s*\d{1,2}', s) else 1
-    )
-
-    for ln in vat_lines_sorted:
-        toks = _money_tokens_in(ln)
-        if toks:
-            candidate = parse_money(toks[-1])
-            vat = candidate
+    vat_with_rate = vat_without_rate = None
+    for kind, tok in zip(kinds, last_tokens):
+        if not (kind & LINE_VAT) or not tok:
+            continue
+        if kind & LINE_VAT_RATE:
+            vat_with_rate = tok
             break
+        if vat_without_rate is None:
+            vat_without_rate = tok
+    candidate = vat_with_rate or vat_without_rate
+    if candidate:
+        vat = parse_money(candidate)
 
     if vat == 0.0 and total > 0:
         vat = round(total * 0.23, 2)
 
     if total > 0 and vat > total:
-        toks_all = [parse_money(t) for t in _money_tokens_in(text)]
+        toks_all = [parse_money(t) for t in parsed.money_tokens()]
         plausibles = [t for t in toks_all if 0 < t <= total]
         if plausibles:
             vat = max(plausibles)
@@ -223,7 +698,29 @@ def extract_amounts(text: str) -> Tuple[float, float]:
 # Main API
 # =============================================================================
 
-def process_invoice(file_path: str) -> dict:
+def parse_invoice_text(text: str) -> dict:
+    """
+    Parsing stage only: supplier, date, total, vat and description from the
+    raw OCR/text-layer text. Stored text can be re-parsed with it after the
+    parser changes, without running OCR again.
+    """
+    parsed = tokenize(text or '')
+    lines = parsed.first_lines(4)
+    total, vat = extract_amounts(text or '', parsed)
+    return {
+        'supplier': lines[0] if lines else 'Unknown supplier',
+        'date': extract_date(text or '', parsed),
+        'total': f"{total:.2f}",
+        'vat': f"{vat:.2f}",
+        'description': ' | '.join(lines[1:3]) if len(lines) > 1 else '',
+    }
+
+def process_invoice(
+    file_path: str,
+    confidence_threshold: Optional[float] = None,
+    template_for: Optional[Callable[[str], Optional[dict]]] = None,
+    kind: Optional[str] = None,
+) -> dict:
     """
     Process an invoice image or PDF and return a dictionary with:
       - supplier
@@ -231,30 +728,42 @@ def process_invoice(file_path: str) -> dict:
       - total
       - vat
       - description
+      - text (raw extracted text, kept so it can be re-parsed later)
+      - text_source ('text_layer', 'ocr' or 'mixed')
+      - ocr_confidence (0-1 on the key fields, None if not measured)
+      - ocr_passes (1 = cheap pass was enough, 2 = heavy pass needed)
+      - ocr_roi (heavy pass only read the header/totals regions)
+      - ocr_template (only the boxes of a supplier layout template were read)
+      - layout (header/key line positions, images only; used to learn templates)
+    confidence_threshold decides when the heavy OCR pass is run; template_for
+    looks up a supplier layout template from the header text (images only).
+    kind ('pdf' or 'image') defaults to the file extension; pass it when the
+    path has none (content-addressed media blobs).
     Does not return net_amount or vat_amount (calculated later in data_manager for purchases).
     """
     print(f"[OCR] Processing file: {file_path}")
-    if file_path.lower().endswith('.pdf'):
-        text = pdf_to_text(file_path)
+    if kind is None:
+        kind = 'pdf' if file_path.lower().endswith('.pdf') else 'image'
+    if kind == 'pdf':
+        ocr, source = pdf_extract_text(file_path, confidence_threshold)
     else:
-        text = image_to_text(file_path)
+        ocr, source = image_ocr(file_path, confidence_threshold, template_for), 'ocr'
+    text = ocr.text
 
     preview = (text or '')[:300]
     print(f"[OCR] Extracted text (first 300 chars): {preview!r}")
 
-    lines = _first_nonempty_lines(text, n=4)
-    supplier = lines[0] if lines else 'Unknown supplier'
-    date_str = extract_date(text)
-    total, vat = extract_amounts(text)
-    description = ' | '.join(lines[1:3]) if len(lines) > 1 else ''
-
-    result = {
-        'supplier': supplier,
-        'date': date_str,
-        'total': f"{total:.2f}",
-        'vat': f"{vat:.2f}",
-        'description': description
-    }
+    result = parse_invoice_text(text)
+    result.update({
+        'text_source': source,
+        'ocr_confidence': round(ocr.confidence, 2) if ocr.confidence is not None else None,
+        'ocr_passes': ocr.passes,
+        'ocr_roi': ocr.roi,
+        'ocr_template': ocr.template,
+    })
+    if ocr.layout:
+        result['layout'] = ocr.layout
 
     print(f"[OCR] Processed result: {result}")
+    result['text'] = text or ''
     return result
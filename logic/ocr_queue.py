@@ -0,0 +1,273 @@
+import os
+import socket
+import zlib
+from datetime import datetime, timedelta
+from decimal import Decimal
+from typing import Optional
+
+from django.db import transaction
+from django.utils import timezone
+
+from budsi_database.models import Contact, Invoice, OcrJob
+from logic.debugger import debug
+from logic.ocr_cache import get_cached_result, store_result
+
+# Constantes
+MAX_ATTEMPTS = 3
+DEFAULT_SUPPLIER = "Supplier"
+# Written by OCR; anything else on the invoice belongs to the user.
+OCR_FIELDS = [
+    "contact", "date", "subtotal", "vat_amount", "total", "description", "ocr_data",
+    "ocr_text", "ocr_parser_version", "status", "updated_at",
+]
+
+# =============================================================================
+# Helpers
+# =============================================================================
+
+def _parse_date_str(date_str: str):
+    if not date_str:
+        return None
+    for fmt in ("%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d"):
+        try:
+            return datetime.strptime(date_str, fmt).date()
+        except Exception:
+            pass
+    return None
+
+def _to_decimal(value) -> Decimal:
+    try:
+        return Decimal(str(value or 0))
+    except Exception:
+        return Decimal("0")
+
+def worker_name() -> str:
+    """Identifica al worker en la tabla de jobs (host:pid)."""
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+def _file_size(invoice: Invoice) -> int:
+    try:
+        return invoice.original_file.size
+    except Exception:
+        return 0
+
+def file_kind(invoice: Invoice) -> str:
+    """'pdf' or 'image', from the logical name (the stored blob has no extension)."""
+    return "pdf" if invoice.original_file.name.lower().endswith(".pdf") else "image"
+
+def confidence_threshold(user) -> Optional[float]:
+    """User's FiscalProfile.ocr_confidence_threshold, if they have a profile."""
+    try:
+        return float(user.fiscal_profile.ocr_confidence_threshold)
+    except Exception:
+        return None
+
+def pack_text(text: str) -> bytes:
+    """Compress raw OCR text for Invoice.ocr_text."""
+    return zlib.compress(text.encode("utf-8"), 6) if text else b""
+
+def unpack_text(data) -> str:
+    if not data:
+        return ""
+    return zlib.decompress(bytes(data)).decode("utf-8")
+
+def placeholder_contact(user) -> Contact:
+    """Contact used while the real supplier is still unknown (OCR pending)."""
+    contact, _ = Contact.objects.get_or_create(
+        user=user,
+        name=DEFAULT_SUPPLIER,
+        defaults={"is_supplier": True}
+    )
+    return contact
+
+# =============================================================================
+# Queue API
+# =============================================================================
+
+def enqueue_invoice(invoice: Invoice) -> OcrJob:
+    """
+    Mark the invoice as processing and create a queued OCR job for it.
+    The job is picked up by `python manage.py ocr_worker`.
+    """
+    invoice.status = Invoice.PROCESSING
+    invoice.save(update_fields=["status", "updated_at"])
+    job = OcrJob.objects.create(invoice=invoice)
+    debug(f"OCR job {job.id} queued for invoice {invoice.id}")
+    return job
+
+def claim_next_job(worker: str = "", invoice: Optional[Invoice] = None) -> Optional[OcrJob]:
+    """
+    Atomically take the oldest queued job (optionally only for one invoice).
+    Rows locked by another worker are skipped, so several workers can poll
+    the same table safely.
+    """
+    with transaction.atomic():
+        jobs = OcrJob.objects.select_for_update(skip_locked=True).filter(status=OcrJob.QUEUED)
+        if invoice is not None:
+            jobs = jobs.filter(invoice=invoice)
+        job = jobs.order_by("created_at", "id").first()
+        if job is None:
+            return None
+        job.status = OcrJob.RUNNING
+        job.attempts += 1
+        job.worker = worker or worker_name()
+        job.started_at = timezone.now()
+        job.save(update_fields=["status", "attempts", "worker", "started_at"])
+    return job
+
+def mark_ocr_failed(invoice_ids) -> None:
+    """Hand the invoices back to the user to fill in (unless already confirmed)."""
+    Invoice.objects.filter(pk__in=invoice_ids, is_confirmed=False).update(
+        status=Invoice.DRAFT,
+        description="OCR failed (please fill in manually).",
+        updated_at=timezone.now(),
+    )
+
+def requeue_stale_jobs(timeout: timedelta) -> int:
+    """
+    Put back jobs whose worker died while running them. Jobs that already
+    had MAX_ATTEMPTS (a PDF that gets the worker OOM-killed every time)
+    fail instead, so they cannot kill workers forever.
+    """
+    now = timezone.now()
+    stale = OcrJob.objects.filter(status=OcrJob.RUNNING, started_at__lt=now - timeout)
+    with transaction.atomic():
+        exhausted = stale.filter(attempts__gte=MAX_ATTEMPTS)
+        invoice_ids = list(exhausted.values_list("invoice_id", flat=True))
+        if invoice_ids:
+            exhausted.update(status=OcrJob.FAILED, error="Worker died while running the job.", finished_at=now)
+            mark_ocr_failed(invoice_ids)
+            print(f"[QUEUE] {len(invoice_ids)} stale job(s) failed after {MAX_ATTEMPTS} attempts.")
+        return stale.update(status=OcrJob.QUEUED, worker="")
+
+def set_ocr_fields(invoice: Invoice, ocr: dict, contact: Contact) -> None:
+    """Copy the parsed fields onto the invoice (without saving it)."""
+    parsed_date = _parse_date_str(ocr.get("date") or "")
+    subtotal = _to_decimal(ocr.get("total"))
+    vat_amount = _to_decimal(ocr.get("vat"))
+    description = (ocr.get("description") or "").strip()
+
+    invoice.contact = contact
+    if parsed_date:
+        invoice.date = parsed_date
+    invoice.subtotal = subtotal
+    invoice.vat_amount = vat_amount
+    invoice.total = subtotal + vat_amount
+    invoice.description = description or "OCR Invoice (please review)."
+    invoice.ocr_data = {k: v for k, v in ocr.items() if k != "text"}
+
+def supplier_name(ocr: dict) -> str:
+    return (ocr.get("supplier") or "").strip() or DEFAULT_SUPPLIER
+
+def apply_ocr_result(invoice: Invoice, ocr: dict) -> None:
+    """Copy supplier/date/total/VAT from an OCR result onto the invoice."""
+    from logic.ocr_processor import PARSER_VERSION
+
+    contact, _ = Contact.objects.get_or_create(
+        user=invoice.user,
+        name=supplier_name(ocr),
+        defaults={"is_supplier": True}
+    )
+    set_ocr_fields(invoice, ocr, contact)
+    # Raw text is kept so a newer parser can redo the fields without OCR.
+    invoice.ocr_text = pack_text(ocr.get("text") or "")
+    invoice.ocr_parser_version = PARSER_VERSION
+    invoice.status = Invoice.DRAFT
+    invoice.save(update_fields=OCR_FIELDS)
+
+def _save_to_ledger(invoice: Invoice, ocr: dict) -> None:
+    from logic.data_manager import save_invoice
+
+    try:
+        save_invoice(
+            {
+                "supplier": invoice.contact.name,
+                "date": ocr.get("date") or "",
+                "total": float(invoice.subtotal),
+                "description": (ocr.get("description") or "").strip(),
+            },
+            invoice_type="purchase",
+            prevent_duplicates=True
+        )
+    except Exception as e:
+        debug(f"CSV save skipped: {e}")
+
+def complete_from_cache(invoice: Invoice, ocr: dict) -> OcrJob:
+    """Fill in an upload whose content was already OCR'd; no worker needed."""
+    apply_ocr_result(invoice, ocr)
+    now = timezone.now()
+    job = OcrJob.objects.create(
+        invoice=invoice,
+        status=OcrJob.DONE,
+        cache_hit=True,
+        started_at=now,
+        finished_at=now,
+    )
+    _save_to_ledger(invoice, ocr)
+    return job
+
+def run_job(job: OcrJob) -> bool:
+    """
+    Run OCR for a claimed job and fill in the invoice.
+    Returns True on success. Failed jobs are re-queued until MAX_ATTEMPTS.
+    """
+    from logic.layout_templates import find_template, user_templates
+    from logic.ocr_processor import process_invoice
+
+    invoice = job.invoice
+    try:
+        # A duplicate may have been OCR'd while this job was waiting.
+        ocr = get_cached_result(invoice.content_hash)
+        job.cache_hit = ocr is not None
+        if ocr is None:
+            kind = file_kind(invoice)
+            # Reading the header to look for a template costs a tesseract
+            # call: only worth it if the user has templates at all.
+            template_for = None
+            if kind == "image" and user_templates(invoice.user_id):
+                template_for = lambda header: find_template(invoice.user_id, header)
+            ocr = process_invoice(
+                invoice.original_file.path,
+                kind=kind,
+                confidence_threshold=confidence_threshold(invoice.user),
+                template_for=template_for,
+            ) or {}
+            store_result(invoice.content_hash, ocr, _file_size(invoice))
+        # OCR can take a while: re-read the invoice, and leave it alone if
+        # the user confirmed it in the meantime.
+        with transaction.atomic():
+            invoice = Invoice.objects.select_for_update().get(pk=invoice.pk)
+            applied = not invoice.is_confirmed
+            if applied:
+                apply_ocr_result(invoice, ocr)
+            else:
+                print(f"[QUEUE] Invoice {invoice.id} was confirmed during OCR; result not applied.")
+                invoice.status = Invoice.DRAFT
+                invoice.save(update_fields=["status", "updated_at"])
+    except Exception as e:
+        print(f"[QUEUE] Job {job.id} failed (attempt {job.attempts}): {e}")
+        job.error = str(e)
+        job.finished_at = timezone.now()
+        if job.attempts >= MAX_ATTEMPTS:
+            job.status = OcrJob.FAILED
+            mark_ocr_failed([invoice.pk])
+        else:
+            job.status = OcrJob.QUEUED
+        job.save(update_fields=["status", "error", "finished_at", "cache_hit"])
+        return False
+
+    job.status = OcrJob.DONE
+    job.error = ""
+    job.finished_at = timezone.now()
+    job.save(update_fields=["status", "error", "finished_at", "cache_hit"])
+
+    if applied:
+        _save_to_ledger(invoice, ocr)
+    return True
+
+def process_next(worker: str = "", invoice: Optional[Invoice] = None) -> Optional[OcrJob]:
+    """Claim and run one job; returns it, or None if the queue is empty."""
+    job = claim_next_job(worker, invoice=invoice)
+    if job is not None:
+        run_job(job)
+    return job
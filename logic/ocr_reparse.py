@@ -0,0 +1,96 @@
+from typing import Dict, Optional, Tuple
+
+from django.db import transaction
+from django.db.models import QuerySet
+from django.utils import timezone
+
+from budsi_database.models import Contact, Invoice
+from logic.ocr_processor import PARSER_VERSION, parse_invoice_text
+from logic.ocr_queue import set_ocr_fields, supplier_name, unpack_text
+
+# Constantes
+DEFAULT_BATCH_SIZE = 500
+UPDATE_FIELDS = [
+    "contact", "date", "subtotal", "vat_amount", "total",
+    "description", "ocr_data", "ocr_parser_version", "updated_at",
+]
+
+# =============================================================================
+# Re-parse stored OCR text
+# =============================================================================
+
+def reparse_candidates(force: bool = False) -> QuerySet:
+    """
+    Invoices whose stored OCR text can be parsed again: not confirmed by the
+    user, not waiting for OCR and (unless force) parsed by an older parser.
+    """
+    qs = (
+        Invoice.objects
+        .filter(is_confirmed=False, ocr_parser_version__gt=0)
+        .exclude(status=Invoice.PROCESSING)
+    )
+    if not force:
+        qs = qs.filter(ocr_parser_version__lt=PARSER_VERSION)
+    return qs
+
+def _contact_for(user_id: int, name: str, contacts: Dict[Tuple[int, str], Contact]) -> Contact:
+    key = (user_id, name)
+    if key not in contacts:
+        contacts[key], _ = Contact.objects.get_or_create(
+            user_id=user_id, name=name, defaults={"is_supplier": True}
+        )
+    return contacts[key]
+
+def _fields(invoice: Invoice) -> tuple:
+    return (invoice.contact_id, invoice.date, invoice.subtotal, invoice.vat_amount, invoice.description)
+
+def _reparse_batch(ids, contacts: Dict[Tuple[int, str], Contact], dry_run: bool) -> int:
+    """Parse one batch inside a transaction; returns how many invoices changed."""
+    changed = 0
+    parsed_invoices = []
+    now = timezone.now()
+    with transaction.atomic():
+        # Lock the rows so a confirmation arriving meanwhile is not overwritten.
+        invoices = (
+            Invoice.objects
+            .select_for_update()
+            .filter(id__in=ids, is_confirmed=False)
+            .defer("original_file")
+        )
+        for invoice in invoices:
+            text = unpack_text(invoice.ocr_text)
+            if not text:
+                continue
+            before = _fields(invoice)
+            parsed = parse_invoice_text(text)
+            contact = _contact_for(invoice.user_id, supplier_name(parsed), contacts)
+            set_ocr_fields(invoice, {**invoice.ocr_data, **parsed}, contact)
+            invoice.ocr_parser_version = PARSER_VERSION
+            invoice.updated_at = now  # bulk_update() skips auto_now
+            changed += _fields(invoice) != before
+            parsed_invoices.append(invoice)
+        # Unchanged rows are saved too, to record the new parser version.
+        if parsed_invoices and not dry_run:
+            Invoice.objects.bulk_update(parsed_invoices, UPDATE_FIELDS)
+    return changed
+
+def reparse_invoices(queryset: Optional[QuerySet] = None, batch_size: int = DEFAULT_BATCH_SIZE,
+                     dry_run: bool = False, force: bool = False) -> dict:
+    """
+    Re-run only the parsing stage over stored OCR text, in batches of
+    `batch_size` invoices (keyset pagination on id, one transaction and one
+    bulk UPDATE per batch). Returns counts of scanned and updated invoices.
+    """
+    qs = queryset if queryset is not None else reparse_candidates(force)
+    contacts: Dict[Tuple[int, str], Contact] = {}
+    scanned = updated = 0
+    last_id = 0
+    while True:
+        ids = list(qs.filter(id__gt=last_id).order_by("id").values_list("id", flat=True)[:batch_size])
+        if not ids:
+            break
+        last_id = ids[-1]
+        scanned += len(ids)
+        updated += _reparse_batch(ids, contacts, dry_run)
+        print(f"[PARSE] {scanned} invoices scanned, {updated} updated")
+    return {"scanned": scanned, "updated": updated}
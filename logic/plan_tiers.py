@@ -10,6 +10,19 @@ PLAN_TIERS = {
     'admin': 3,
 }
 
+# Subidas de facturas (token bucket por usuario, ver logic/admission.py):
+# burst = subidas seguidas permitidas, per_minute = ritmo de recarga.
+UPLOAD_LIMITS = {
+    'lite': {'burst': 5, 'per_minute': 2},
+    'smart': {'burst': 20, 'per_minute': 10},
+    'elite': {'burst': 50, 'per_minute': 30},
+    'admin': {'burst': 200, 'per_minute': 120},
+}
+
+def upload_limits(plan):
+    """Límites de subida del plan; planes desconocidos usan los de 'lite'."""
+    return UPLOAD_LIMITS.get(plan if plan in PLAN_TIERS else 'lite', UPLOAD_LIMITS['lite'])
+
 def require_plan(required_plan):
     """
     Decorador para proteger vistas según el plan del usuario.
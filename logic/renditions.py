@@ -0,0 +1,107 @@
+import hashlib
+import io
+import os
+import re
+from typing import Optional
+
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from pdf2image import convert_from_path
+from PIL import Image, ImageOps
+
+from budsi_database.models import Invoice
+from logic.debugger import debug
+from logic.ingest import _flatten
+
+# Constantes
+RENDITION_SIZES = {"small": 320, "medium": 1200}   # longest side in px
+RENDITION_QUALITY = 80
+RENDITION_VERSION = 1    # bump to regenerate every rendition
+PDF_RENDITION_DPI = 100
+
+# =============================================================================
+# Thumbnails / previews of the original file
+# =============================================================================
+
+def is_renderable(invoice: Invoice) -> bool:
+    """Images and PDFs have a visual rendition; XML e-invoices do not."""
+    return bool(invoice.original_file) and not invoice.original_file.name.lower().endswith(".xml")
+
+def rendition_key(invoice: Invoice) -> str:
+    """
+    Changes whenever the original file (or the rendering code) changes, so
+    it can be used as the ETag and in the stored file name.
+    """
+    source = f"{invoice.original_file.name}:{invoice.content_hash}:{RENDITION_VERSION}"
+    return hashlib.sha1(source.encode()).hexdigest()[:12]
+
+def rendition_name(invoice: Invoice, size: str) -> str:
+    """Stored next to the original: <dir>/renditions/<stem>.<size>.<key>.jpg"""
+    folder, filename = os.path.split(invoice.original_file.name)
+    stem = os.path.splitext(filename)[0]
+    return f"{folder}/renditions/{stem}.{size}.{rendition_key(invoice)}.jpg"
+
+def delete_renditions(name: str, size: Optional[str] = None, keep: str = "") -> int:
+    """
+    Delete the stored renditions of the file `name` (of one size, or all of
+    them) except `keep`: those of an older RENDITION_VERSION, or all of a
+    deleted or replaced original. Returns how many were deleted.
+    """
+    folder, filename = os.path.split(name)
+    stem = os.path.splitext(filename)[0]
+    sizes = "|".join([size] if size else RENDITION_SIZES)
+    pattern = re.compile(rf"{re.escape(stem)}\.(?:{sizes})\.[0-9a-f]{{12}}\.jpg")
+    try:
+        files = default_storage.listdir(f"{folder}/renditions")[1]
+    except FileNotFoundError:
+        return 0
+    deleted = 0
+    for filename in files:
+        stored = f"{folder}/renditions/{filename}"
+        if pattern.fullmatch(filename) and stored != keep:
+            default_storage.delete(stored)
+            deleted += 1
+    return deleted
+
+def _render(invoice: Invoice, max_side: int) -> Image.Image:
+    if invoice.original_file.name.lower().endswith(".pdf"):
+        pages = convert_from_path(
+            invoice.original_file.path, dpi=PDF_RENDITION_DPI,
+            first_page=1, last_page=1, size=(None, max_side),
+        )
+        return pages[0]
+    with invoice.original_file.open("rb") as f, Image.open(f) as img:
+        img.draft(img.mode, (max_side, max_side))
+        img = ImageOps.exif_transpose(img)
+        img.load()
+        return img
+
+def get_rendition(invoice: Invoice, size: str) -> Optional[str]:
+    """
+    Storage name of the `size` rendition of the invoice's original file,
+    generated on first request and kept afterwards. None if the file cannot
+    be rendered (XML, missing file, no poppler for PDFs...).
+    """
+    if size not in RENDITION_SIZES or not is_renderable(invoice):
+        return None
+    name = rendition_name(invoice, size)
+    if default_storage.exists(name):
+        return name
+
+    max_side = RENDITION_SIZES[size]
+    try:
+        img = _flatten(_render(invoice, max_side))
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        out = io.BytesIO()
+        img.save(out, "JPEG", quality=RENDITION_QUALITY, optimize=True)
+    except Exception as e:
+        debug(f"Rendition {size} of invoice {invoice.id} failed: {e}")
+        return None
+
+    # Two requests may render it at the same time; keep the first one.
+    if default_storage.exists(name):
+        return name
+    name = default_storage.save(name, ContentFile(out.getvalue()))
+    # Renditions of an older RENDITION_VERSION (or original) are not served again.
+    delete_renditions(invoice.original_file.name, size, keep=name)
+    return name
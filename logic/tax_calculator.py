@@ -1,16 +1,20 @@
+from decimal import Decimal, ROUND_HALF_UP
+from typing import Dict
+
 from logic.data_manager import load_data
 
-def calculate_taxes(invoices, purchases):
-    VAT_RATE = 0.23
-    TAX_CREDITS = 4000
-    INCOME_TAX_BRACKETS = [(44000, 0.2), (float('inf'), 0.4)]
-    USC_BANDS = [
-        (0, 12012, 0.005),
-        (12012, 25760, 0.02),
-        (25760, 70044, 0.045),
-        (70044, float('inf'), 0.08)
-    ]
+# Constantes
+VAT_RATE = 0.23
+TAX_CREDITS = 4000
+INCOME_TAX_BRACKETS = [(44000, 0.2), (float('inf'), 0.4)]
+USC_BANDS = [
+    (0, 12012, 0.005),
+    (12012, 25760, 0.02),
+    (25760, 70044, 0.045),
+    (70044, float('inf'), 0.08)
+]
 
+def calculate_taxes(invoices, purchases):
     # -- Cálculos compatibles con Excel --
     vat_collected = sum(float(inv['total']) * VAT_RATE / (1 + VAT_RATE) for inv in invoices)
     gross_income_net = sum(float(inv['total']) / (1 + VAT_RATE) for inv in invoices)
@@ -18,6 +22,10 @@ def calculate_taxes(invoices, purchases):
     vat_paid = sum(float(pur['total']) * VAT_RATE / (1 + VAT_RATE) for pur in purchases)
     expenses_net = sum(float(pur['total']) / (1 + VAT_RATE) for pur in purchases)
 
+    return taxes_from_totals(vat_collected, vat_paid, gross_income_net, expenses_net)
+
+def taxes_from_totals(vat_collected: float, vat_paid: float, gross_income_net: float, expenses_net: float) -> dict:
+    """Impuestos a partir de las sumas de IVA y netos de ventas y compras."""
     vat_collected = round(vat_collected, 2)
     vat_paid = round(vat_paid, 2)
     gross_income_net = round(gross_income_net, 2)
@@ -86,4 +94,20 @@ def calculate_taxes(invoices, purchases):
             'currency': 'EUR',
             'calculation_method': 'net_base'
         }
-    }
\ No newline at end of file
+    }
+
+def _q2(x: Decimal) -> Decimal:
+    return x.quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+
+def income_tax_bands(tax_data: dict) -> Dict[str, object]:
+    """Primer tramo y exceso del impuesto sobre la renta a partir de tax_data."""
+    taxable_income = Decimal(str(tax_data['income']['taxable']))
+    first_band = min(taxable_income, Decimal('44000'))
+    excess = max(taxable_income - Decimal('44000'), Decimal('0'))
+    return {
+        "first_band_amount": _q2(first_band),
+        "first_band_tax": _q2(first_band * Decimal('0.2')),
+        "excess_amount": _q2(excess),
+        "excess_tax": _q2(excess * Decimal('0.4')),
+        "show_excess": taxable_income > Decimal('44000'),
+    }
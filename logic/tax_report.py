@@ -0,0 +1,113 @@
+from datetime import date
+from decimal import ROUND_HALF_UP, Decimal
+from typing import Dict, List, Optional, Tuple
+
+from django.db.models import Count, DecimalField, Exists, ExpressionWrapper, F, OuterRef, QuerySet, Sum
+
+from budsi_database.models import Invoice, InvoiceLine
+from logic.tax_calculator import income_tax_bands, taxes_from_totals
+
+# Constantes
+CENT = Decimal("0.01")
+LINE_NET = ExpressionWrapper(
+    F("quantity") * F("unit_price"), output_field=DecimalField(max_digits=22, decimal_places=4)
+)
+
+# =============================================================================
+# Tax report from the user's confirmed invoices
+# =============================================================================
+# Everything is summed by the database: one GROUP BY invoice_type over the
+# invoices, one over their lines by VAT rate, and one for the invoices that
+# have no lines (OCR and manual entries only have the header amounts). Only
+# those few rows come back to Python, however many invoices there are.
+
+def tax_year(today: Optional[date] = None) -> Tuple[date, date]:
+    """The Irish tax year (the calendar year) containing `today`."""
+    today = today or date.today()
+    return date(today.year, 1, 1), date(today.year, 12, 31)
+
+def report_invoices(user, start: date, end: date) -> QuerySet:
+    """Confirmed invoices of `user` dated between start and end (inclusive)."""
+    return Invoice.objects.filter(user=user, is_confirmed=True, date__range=(start, end))
+
+def _empty() -> Dict[str, object]:
+    return {"count": 0, "net": Decimal("0.00"), "vat": Decimal("0.00"), "gross": Decimal("0.00")}
+
+def totals_by_type(invoices: QuerySet) -> Dict[str, Dict[str, object]]:
+    """{invoice_type: {count, net, vat, gross}} from the invoice headers."""
+    totals = {Invoice.SALE: _empty(), Invoice.PURCHASE: _empty()}
+    rows = (
+        invoices.order_by()
+        .values("invoice_type")
+        .annotate(count=Count("id"), net=Sum("subtotal"), vat=Sum("vat_amount"), gross=Sum("total"))
+    )
+    for row in rows:
+        # SQLite drops the scale of whole sums (1000, not 1000.00).
+        for key in ("net", "vat", "gross"):
+            row[key] = row[key].quantize(CENT, rounding=ROUND_HALF_UP)
+        totals[row.pop("invoice_type")] = row
+    return totals
+
+def vat_by_rate(invoices: QuerySet) -> Dict[str, List[Dict[str, object]]]:
+    """
+    {invoice_type: [{rate, count, net, vat, gross}, ...]} from the invoice
+    lines, highest rate first. Invoices without lines come last with
+    rate None and their header amounts; `count` is lines or invoices.
+    """
+    by_type: Dict[str, List[Dict[str, object]]] = {Invoice.SALE: [], Invoice.PURCHASE: []}
+    rows = (
+        InvoiceLine.objects.filter(invoice__in=invoices)
+        .values("invoice__invoice_type", "vat_rate")
+        .annotate(count=Count("id"), net=Sum(LINE_NET))
+        .order_by("invoice__invoice_type", "-vat_rate")
+    )
+    for row in rows:
+        # One multiplication per rate, not per line.
+        net = row["net"].quantize(CENT, rounding=ROUND_HALF_UP)
+        vat = (row["net"] * row["vat_rate"] / 100).quantize(CENT, rounding=ROUND_HALF_UP)
+        by_type[row["invoice__invoice_type"]].append(
+            {"rate": row["vat_rate"], "count": row["count"], "net": net, "vat": vat, "gross": net + vat}
+        )
+
+    unitemised = invoices.filter(~Exists(InvoiceLine.objects.filter(invoice=OuterRef("pk"))))
+    for invoice_type, totals in totals_by_type(unitemised).items():
+        if totals["count"]:
+            by_type[invoice_type].append({"rate": None, **totals})
+    return by_type
+
+def reconcile(rows: List[Dict[str, object]], totals: Dict[str, object]) -> List[Dict[str, object]]:
+    """
+    Append an adjustments row when the rate rows do not add up to the header
+    totals: document-level allowances and charges, and line prices stored to
+    the cent, are in an invoice's subtotal and VAT but not in its lines.
+    """
+    diff = {key: totals[key] - sum((r[key] for r in rows), Decimal("0.00")) for key in ("net", "vat", "gross")}
+    if any(diff.values()):
+        rows.append({"rate": None, "adjustment": True, "count": None, **diff})
+    return rows
+
+def tax_data_from_totals(totals: Dict[str, Dict[str, object]]) -> dict:
+    """calculate_taxes() output for the stored net and VAT amounts."""
+    return taxes_from_totals(
+        vat_collected=float(totals[Invoice.SALE]["vat"]),
+        vat_paid=float(totals[Invoice.PURCHASE]["vat"]),
+        gross_income_net=float(totals[Invoice.SALE]["net"]),
+        expenses_net=float(totals[Invoice.PURCHASE]["net"]),
+    )
+
+def build_tax_report(user, start: date, end: date) -> Dict[str, object]:
+    """Template context for the tax report of `user` between start and end."""
+    invoices = report_invoices(user, start, end)
+    totals = totals_by_type(invoices)
+    rates = vat_by_rate(invoices)
+    tax_data = tax_data_from_totals(totals)
+    return {
+        "start": start,
+        "end": end,
+        "sales_totals": totals[Invoice.SALE],
+        "purchase_totals": totals[Invoice.PURCHASE],
+        "sales_rates": reconcile(rates[Invoice.SALE], totals[Invoice.SALE]),
+        "purchase_rates": reconcile(rates[Invoice.PURCHASE], totals[Invoice.PURCHASE]),
+        "tax_data": tax_data,
+        **income_tax_bands(tax_data),
+    }